@@ -0,0 +1,274 @@
+"""Replay recorded inputs through the emotion pipeline and report per-stage latency.
+
+Runs headless (no camera or microphone needed) and writes machine-readable results:
+
+    python benchmark_pipeline.py --video session.mp4 --wav session.wav --mouse-trace mouse.jsonl \
+        --output benchmark_results.json
+
+Inputs are replayed on a simulated clock that follows the recording (frame rate, audio length,
+trace times), so duration-based rules fire as they would live however fast the replay runs.
+Any input may be omitted. The mouse trace is JSON Lines, one event per line:
+    {"t": 0.25, "type": "move", "x": 310, "y": 200}
+with "t" in seconds from the start of the recording and "type" one of click, hover_start,
+hover_end or move (as accepted by update_mouse_activity).
+"""
+import argparse
+import atexit
+import itertools
+import json
+import math
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+import wave
+from datetime import datetime
+
+# Keep benchmark sessions and logs out of the real data directory, and remove them at exit
+# (set EMOLEARN_SESSIONS_DIR to keep them). Registered first, so it runs after the modules' own exit hooks.
+if "EMOLEARN_SESSIONS_DIR" not in os.environ:
+    os.environ["EMOLEARN_SESSIONS_DIR"] = tempfile.mkdtemp(prefix="emolearn-bench-")
+    atexit.register(shutil.rmtree, os.environ["EMOLEARN_SESSIONS_DIR"], ignore_errors=True)
+
+from modules import facial_emotion, mouse_emotion, speech_emotion
+from modules.clock import VirtualClock
+from modules.emotion_combiner import get_combined_emotion
+from modules.metrics import STAGE_SECONDS, TRANSITIONS, capture_samples
+from modules.session_registry import session_registry
+
+RESULTS_VERSION = 1
+MOUSE_TICK = 0.5  # Seconds of trace time between mouse evaluations, as in mouse_emotion_loop
+
+EVALUATE_SECONDS = STAGE_SECONDS.labels("mouse", "evaluate_mouse_state")
+DECODE_SECONDS = STAGE_SECONDS.labels("facial", "decode")
+
+
+# --- Statistics ---
+
+def percentile(sorted_values, q):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+    rank = max(1, math.ceil(q / 100.0 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+def summarize(values):
+    values = sorted(values)
+    total = sum(values)
+    return {
+        "count": len(values),
+        "total_s": round(total, 6),
+        "throughput_per_s": round(len(values) / total, 3) if total > 0 else None,
+        "mean_ms": round(total / len(values) * 1000, 3),
+        "p50_ms": round(percentile(values, 50) * 1000, 3),
+        "p95_ms": round(percentile(values, 95) * 1000, 3),
+        "p99_ms": round(percentile(values, 99) * 1000, 3),
+        "max_ms": round(values[-1] * 1000, 3),
+    }
+
+
+def stage_names():
+    """Histogram child -> "detector/stage" for every pipeline stage timer."""
+    return {child: "/".join(key) for key, child in STAGE_SECONDS.children.items()}
+
+
+# --- Replay ---
+
+def fuse_if_changed(session, fusions):
+    """Fuse the way fusion_loop does: only when a detector reported a change."""
+    if session.changes.wait(0):
+        get_combined_emotion(session)
+        fusions[0] += 1
+
+
+def replay_video(session, path, max_frames, warmup, calibration_frames, fusions, samples):
+    import cv2
+
+    state = session.facial_state
+    state["face_mesh"] = facial_emotion.create_face_mesh()
+    cap = cv2.VideoCapture(path)
+    if not cap.isOpened():
+        raise SystemExit(f"Cannot open video {path}")
+    frame_interval = 1.0 / (cap.get(cv2.CAP_PROP_FPS) or 30.0)
+
+    def frames():
+        count = 0
+        while max_frames is None or count < max_frames:
+            with DECODE_SECONDS.time():
+                ret, frame = cap.read()
+            if not ret:
+                return
+            count += 1
+            yield frame
+
+    # Calibrate on the first frames (kept in memory), then stream the rest
+    stream = frames()
+    head = [frame for _, frame in zip(range(calibration_frames), stream)]
+    eye_samples = []
+    for frame in head:
+        eye_samples.extend(facial_emotion.eye_levels(state["face_mesh"], frame))
+    calibrated_eye_y = sum(eye_samples) / len(eye_samples) if eye_samples else 0.5
+    tracker = facial_emotion.new_frame_tracker(calibrated_eye_y)
+    gate = tracker["motion_gate"]
+
+    measured = 0
+    skipped_before = 0
+    start = None
+    for i, frame in enumerate(itertools.chain(head, stream)):
+        if i == warmup:
+            # Warm-up frames load the FaceMesh/DeepFace models; drop them from the statistics
+            samples.clear()
+            start = time.perf_counter()
+            skipped_before = gate.skipped if gate is not None else 0
+        session.clock.advance(frame_interval)
+        facial_emotion.analyze_frame(state, frame, tracker)
+        fuse_if_changed(session, fusions)
+        if start is not None:
+            measured += 1
+    wall = time.perf_counter() - start if start is not None else 0.0
+    cap.release()
+    facial_emotion.close_face_mesh(state)
+    return {"frames": measured, "wall_s": round(wall, 3), "fps": round(measured / wall, 2) if wall else None,
+            "face_mesh_skipped": gate.skipped - skipped_before if gate is not None else 0}
+
+
+def replay_wav(session, path, fusions):
+    state = session.speech_state
+    with wave.open(path, "rb") as wav:
+        if wav.getframerate() != speech_emotion.RATE or wav.getnchannels() != 1 or wav.getsampwidth() != 2:
+            raise SystemExit(f"{path} must be {speech_emotion.RATE} Hz mono 16-bit PCM")
+        audio = wav.readframes(wav.getnframes())
+
+    # Same window as process_audio: whole CHUNKs until WINDOW_SECONDS of audio is buffered
+    chunks_per_window = 1
+    while chunks_per_window * speech_emotion.CHUNK / speech_emotion.RATE < speech_emotion.WINDOW_SECONDS:
+        chunks_per_window += 1
+    window_bytes = chunks_per_window * speech_emotion.CHUNK * 2
+
+    # Start as start_speech_emotion_detection does: the change hold and silence timeout count from here
+    with state["lock"]:
+        state["last_emotion"] = "Engaged"
+        state["latest_text"] = ""
+        state["transcription"] = ""
+        state["last_change_time"] = state["last_speech_time"] = session.clock.time()
+
+    windows = 0
+    start = time.perf_counter()
+    for offset in range(0, len(audio) - window_bytes + 1, window_bytes):
+        session.clock.advance(window_bytes / 2 / speech_emotion.RATE)
+        windows += 1
+        speech_emotion.analyze_audio_window(state, audio[offset:offset + window_bytes])
+        fuse_if_changed(session, fusions)
+    wall = time.perf_counter() - start
+    audio_seconds = len(audio) / 2 / speech_emotion.RATE
+    return {"windows": windows, "audio_s": round(audio_seconds, 3), "wall_s": round(wall, 3),
+            "realtime_factor": round(audio_seconds / wall, 2) if wall else None}
+
+
+def replay_mouse(session, path, fusions):
+    state = session.mouse_state
+    with open(path, "r") as f:
+        events = [json.loads(line) for line in f if line.strip()]
+    if not events:
+        return {"events": 0}
+    events.sort(key=lambda e: e["t"])
+
+    clock = session.clock
+    base = clock.time()
+    state["last_activity_time"] = base + events[0]["t"]
+    next_tick = events[0]["t"] + MOUSE_TICK
+    ticks = 0
+    start = time.perf_counter()
+    for event in events:
+        while next_tick <= event["t"]:
+            clock.advance(max(0.0, base + next_tick - clock.time()))
+            with EVALUATE_SECONDS.time():
+                mouse_emotion.evaluate_mouse_state(state, base + next_tick)
+            fuse_if_changed(session, fusions)
+            next_tick += MOUSE_TICK
+            ticks += 1
+        clock.advance(max(0.0, base + event["t"] - clock.time()))
+        mouse_emotion.update_mouse_activity(event["type"], x=event.get("x"), y=event.get("y"),
+                                            duration=event.get("duration", 0), state=state,
+                                            timestamp=base + event["t"])
+    wall = time.perf_counter() - start
+    return {"events": len(events), "ticks": ticks, "trace_s": round(events[-1]["t"] - events[0]["t"], 3),
+            "wall_s": round(wall, 3)}
+
+
+def run(args):
+    session = session_registry.get("benchmark")
+    session.set_clock(VirtualClock())
+    running = session.detectors_running
+    running["facial"] = bool(args.video)
+    running["speech"] = bool(args.wav)
+    running["mouse"] = bool(args.mouse_trace)
+    fusions = [0]
+    inputs = {}
+
+    with capture_samples() as samples:
+        # Video goes first: its warm-up resets the captured samples
+        if args.video:
+            inputs["video"] = dict(path=args.video, **replay_video(
+                session, args.video, args.max_frames, args.warmup, args.calibration_frames, fusions, samples))
+        if args.wav:
+            inputs["wav"] = dict(path=args.wav, **replay_wav(session, args.wav, fusions))
+        if args.mouse_trace:
+            inputs["mouse_trace"] = dict(path=args.mouse_trace, **replay_mouse(session, args.mouse_trace, fusions))
+        # Fixed number of fusions so the combiner stage is measured even without transitions
+        for _ in range(args.fusions):
+            get_combined_emotion(session)
+
+    names = stage_names()
+    stages = {names[h]: summarize(values) for h, values in samples.items() if h in names and values}
+    return {
+        "version": RESULTS_VERSION,
+        "started_at": datetime.now().isoformat(timespec="seconds"),
+        "host": {
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "machine": platform.machine(),
+            "cpu_count": os.cpu_count(),
+        },
+        "inputs": inputs,
+        "fusions_on_change": fusions[0],
+        "transitions": {"/".join(key): child.values.total()[0] for key, child in TRANSITIONS.children.items()},
+        "stages": dict(sorted(stages.items())),
+    }
+
+
+def print_table(results):
+    print(f"{'stage':<40} {'count':>7} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'per s':>9}")
+    for name, s in results["stages"].items():
+        print(f"{name:<40} {s['count']:>7} {s['p50_ms']:>9} {s['p95_ms']:>9} {s['p99_ms']:>9} "
+              f"{s['throughput_per_s'] or '-':>9}")
+    for name, info in results["inputs"].items():
+        print(f"{name}: {info}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay recorded inputs through the emotion pipeline.")
+    parser.add_argument("--video", help="Video file replayed through the facial detector")
+    parser.add_argument("--wav", help="16 kHz mono 16-bit WAV replayed through the speech features/classifier")
+    parser.add_argument("--mouse-trace", help="JSON Lines mouse event trace")
+    parser.add_argument("--max-frames", type=int, default=None, help="Stop after this many video frames")
+    parser.add_argument("--warmup", type=int, default=5, help="Video frames processed before measuring")
+    parser.add_argument("--calibration-frames", type=int, default=50, help="Frames used for gaze calibration")
+    parser.add_argument("--fusions", type=int, default=200, help="Extra get_combined_emotion calls to time")
+    parser.add_argument("--output", default="benchmark_results.json", help="Where to write the JSON results")
+    args = parser.parse_args()
+    if not (args.video or args.wav or args.mouse_trace):
+        parser.error("give at least one of --video, --wav or --mouse-trace")
+
+    results = run(args)
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    print_table(results)
+    print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,204 @@
+"""Export DeepFace's emotion model to ONNX and compare the ONNX backend with DeepFace.analyze.
+
+    python compare_emotion_backends.py export --output emotion_model.onnx --int8 emotion_model.int8.onnx \
+        --calibration faces/
+    python compare_emotion_backends.py compare --faces faces/ --models emotion_model.onnx emotion_model.int8.onnx \
+        --output emotion_backends.json
+
+"export" converts the Keras model DeepFace uses (weights downloaded by DeepFace as usual) with
+tf2onnx and, with --int8, writes an int8-quantized copy: statically quantized on the --calibration
+face crops when given, dynamically (weights only) otherwise.
+
+"compare" runs every image of a folder of face crops through DeepFace.analyze (detector_backend="skip",
+as the facial loop calls it on its crops) and through each ONNX model, then reports how often the
+dominant emotion and the learner emotion (deepface_emotion()) agree, the mean probability
+difference, load times and per-face latency, single and batched.
+"""
+import argparse
+import glob
+import json
+import os
+import platform
+import time
+
+import cv2
+import numpy as np
+
+from modules.onnx_emotion import EMOTION_LABELS, MODEL_INPUT_SIZE, OnnxEmotionModel, preprocess
+
+IMAGE_PATTERNS = ("*.jpg", "*.jpeg", "*.png")
+RESULTS_VERSION = 1
+
+
+def load_faces(directory, limit=None):
+    paths = sorted(p for pattern in IMAGE_PATTERNS for p in glob.glob(os.path.join(directory, pattern)))
+    faces = []
+    for path in paths[:limit]:
+        face = cv2.imread(path)
+        if face is not None:
+            faces.append((os.path.basename(path), face))
+    if not faces:
+        raise SystemExit(f"No readable images in {directory}")
+    return faces
+
+
+# --- Export ---
+
+def keras_emotion_model():
+    from deepface import DeepFace
+
+    try:
+        client = DeepFace.build_model(task="facial_attribute", model_name="Emotion")
+    except TypeError:
+        client = DeepFace.build_model("Emotion")  # DeepFace releases before the task argument
+    return client.model
+
+
+def export(args):
+    import tensorflow as tf
+    import tf2onnx
+
+    model = keras_emotion_model()
+    signature = [tf.TensorSpec((None, MODEL_INPUT_SIZE, MODEL_INPUT_SIZE, 1), tf.float32, name="face")]
+
+    # Converted as a tf.function: tf2onnx's from_keras does not handle Keras 3 models
+    @tf.function(input_signature=signature)
+    def forward(face):
+        return model(face, training=False)
+
+    tf2onnx.convert.from_function(forward, input_signature=signature, opset=args.opset, output_path=args.output)
+    print(f"ONNX model written to {args.output}")
+    if args.int8:
+        quantize(args.output, args.int8, args.calibration)
+
+
+def quantize(source, target, calibration_dir):
+    from onnxruntime.quantization import CalibrationDataReader, QuantType, quantize_dynamic, quantize_static
+
+    if not calibration_dir:
+        quantize_dynamic(source, target, weight_type=QuantType.QInt8)
+        print(f"Dynamically quantized int8 model written to {target}")
+        return
+
+    class FaceReader(CalibrationDataReader):
+        def __init__(self, faces):
+            self.inputs = iter([{"face": preprocess(face)[np.newaxis]} for _, face in faces])
+
+        def get_next(self):
+            return next(self.inputs, None)
+
+    faces = load_faces(calibration_dir)
+    quantize_static(source, target, FaceReader(faces), activation_type=QuantType.QInt8,
+                    weight_type=QuantType.QInt8)
+    print(f"Statically quantized int8 model written to {target} (calibrated on {len(faces)} faces)")
+
+
+# --- Comparison ---
+
+def latency(fn, items, repeats):
+    """Median seconds of fn(item) per item over `repeats` passes."""
+    runs = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        for item in items:
+            fn(item)
+        runs.append((time.perf_counter() - start) / len(items))
+    return float(np.median(runs))
+
+
+def probabilities(analysis):
+    emotion = analysis[0]["emotion"]
+    return np.array([emotion[label] for label in EMOTION_LABELS], dtype=np.float64)
+
+
+def compare(args):
+    from modules.facial_emotion import deepface_emotion
+
+    faces = load_faces(args.faces, args.limit)
+    crops = [face for _, face in faces]
+
+    start = time.perf_counter()
+    from deepface import DeepFace
+    deepface_import = time.perf_counter() - start
+
+    def deepface_analyze(face):
+        return DeepFace.analyze(face, actions=["emotion"], enforce_detection=False, silent=True,
+                                detector_backend="skip")
+
+    deepface_analyze(crops[0])  # Builds and loads the model
+    reference = [deepface_analyze(face) for face in crops]
+    results = {
+        "version": RESULTS_VERSION,
+        "host": {"platform": platform.platform(), "cpu_count": os.cpu_count()},
+        "faces": len(crops),
+        "deepface": {
+            "import_s": round(deepface_import, 3),
+            "per_face_ms": round(latency(deepface_analyze, crops, args.repeats) * 1000, 3),
+        },
+        "onnx": {},
+    }
+
+    for path in args.models:
+        start = time.perf_counter()
+        model = OnnxEmotionModel(path, threads=args.threads)
+        load_s = time.perf_counter() - start
+        predicted = model.analyze(crops)
+        dominant = np.mean([p[0]["dominant_emotion"] == r[0]["dominant_emotion"] for p, r in zip(predicted, reference)])
+        learner = np.mean([deepface_emotion(p, "Engaged") == deepface_emotion(r, "Engaged")
+                           for p, r in zip(predicted, reference)])
+        difference = np.mean([np.abs(probabilities(p) - probabilities(r)).mean() for p, r in zip(predicted, reference)])
+        batches = [crops[i:i + args.batch] for i in range(0, len(crops), args.batch)]
+        results["onnx"][path] = {
+            "size_mb": round(os.path.getsize(path) / 1e6, 3),
+            "load_s": round(load_s, 3),
+            "dominant_agreement": round(float(dominant), 4),
+            "learner_emotion_agreement": round(float(learner), 4),
+            "mean_abs_probability_diff_pct": round(float(difference), 4),
+            "per_face_ms": round(latency(lambda face: model.analyze([face]), crops, args.repeats) * 1000, 3),
+            "batched_per_face_ms": round(latency(model.analyze, batches, args.repeats) * 1000 / args.batch, 3),
+        }
+    return results
+
+
+def print_table(results):
+    print(f"{results['faces']} faces; DeepFace: import {results['deepface']['import_s']} s, "
+          f"{results['deepface']['per_face_ms']} ms per face")
+    print(f"{'model':<32} {'MB':>7} {'dominant':>9} {'learner':>8} {'|dp| %':>7} {'ms/face':>8} {'batched':>8}")
+    for path, r in results["onnx"].items():
+        print(f"{os.path.basename(path):<32} {r['size_mb']:>7} {r['dominant_agreement']:>9} "
+              f"{r['learner_emotion_agreement']:>8} {r['mean_abs_probability_diff_pct']:>7} "
+              f"{r['per_face_ms']:>8} {r['batched_per_face_ms']:>8}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export the emotion model to ONNX and compare it with DeepFace.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    exporter = commands.add_parser("export", help="Convert DeepFace's emotion model to ONNX")
+    exporter.add_argument("--output", default="emotion_model.onnx", help="Where to write the ONNX model")
+    exporter.add_argument("--int8", help="Also write an int8-quantized model here")
+    exporter.add_argument("--calibration", help="Face crops for static int8 calibration (default: dynamic)")
+    exporter.add_argument("--opset", type=int, default=13)
+
+    comparer = commands.add_parser("compare", help="Check ONNX models against DeepFace.analyze on face crops")
+    comparer.add_argument("--faces", required=True, help="Folder of .jpg/.png face crops")
+    comparer.add_argument("--models", nargs="+", default=["emotion_model.onnx"], help="ONNX models to compare")
+    comparer.add_argument("--limit", type=int, default=None, help="Use at most this many faces")
+    comparer.add_argument("--repeats", type=int, default=3, help="Timing passes (the median is reported)")
+    comparer.add_argument("--batch", type=int, default=8, help="Batch size for the batched ONNX timing")
+    comparer.add_argument("--threads", type=int, default=1, help="onnxruntime intra-op threads")
+    comparer.add_argument("--output", default="emotion_backends.json", help="Where to write the JSON results")
+    args = parser.parse_args()
+
+    if args.command == "export":
+        export(args)
+        return
+    results = compare(args)
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    print_table(results)
+    print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,15 @@
-from fastapi import FastAPI
+from fastapi import Depends, FastAPI, Header, HTTPException, Request, Response, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import HTMLResponse
+from fastapi.responses import HTMLResponse, StreamingResponse
+from starlette.concurrency import run_in_threadpool
 from pydantic import BaseModel
+from typing import Optional
 import uvicorn
-import json
-import os
-import threading
-import time
-from modules.emotion_combiner import get_combined_emotion, update_detectors
+from modules.emotion_combiner import get_combined_emotion, update_detectors, start_fusion_loop, stop_fusion_loop, shutdown_session
+from modules.emotion_history import parse_time, query_history
+from modules.emotion_stream import encode_event
+from modules.metrics import registry as metrics_registry
+from modules.session_registry import session_registry, DeviceBusyError, SessionLimitError, DEFAULT_SESSION_ID
 
 app = FastAPI()
 
@@ -18,90 +20,105 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Emotion-Version", "X-Next-Cursor"],
 )
 
-# Global flags to track sensor states and emotion detection
-emotion_detection_running = False
-emotion_thread = None
-camera_enabled = False
-microphone_enabled = False
+# Sensor and detection flags live on each learner session (see modules/session_registry.py).
+# Every route takes ?session_id=... (or an X-Session-Id header) and defaults to the "default" session.
 
 # Pydantic model for AI Tutor requests
 class TopicRequest(BaseModel):
     topic: str
 
-def get_latest_emotion_data():
-    """Get the latest emotion data from the JSON log file"""
+def lookup_session(session_id: Optional[str]):
+    """Resolve a session id to a LearnerSession, mapping registry errors to HTTP errors"""
     try:
-        json_file = "emotion_log.json"
-        if os.path.exists(json_file):
-            with open(json_file, "r") as f:
-                data = json.load(f)
-                if data:
-                    return data[-1]  # Return the latest entry
-        return None
-    except Exception as e:
-        print(f"Error reading emotion log: {e}")
-        return None
+        session = session_registry.get(session_id or DEFAULT_SESSION_ID)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except SessionLimitError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    session.touch()
+    return session
 
-def start_emotion_detection():
-    """Start continuous emotion detection in a separate thread"""
-    global emotion_detection_running, emotion_thread
-    
-    if not emotion_detection_running:
-        emotion_detection_running = True
+def current_session(session_id: Optional[str] = None, x_session_id: Optional[str] = Header(None)):
+    """FastAPI dependency: the learner session addressed by the request"""
+    return lookup_session(session_id or x_session_id)
+
+def claim_sensor(session, sensor, enabling):
+    """Reserve the server camera or microphone before a session turns it on; 409 if another session has it"""
+    if not enabling:
+        return
+    try:
+        session_registry.claim_device(session, sensor)
+    except DeviceBusyError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+def get_latest_emotion_data(session):
+    """Get the latest emotion data from the session's in-memory snapshot (no disk access)"""
+    _, data = session.snapshot.get()
+    return data
+
+def sensor_status(session):
+    """Sensor and detection flags reported by the sensor routes"""
+    return {
+        "camera_enabled": session.camera_enabled,
+        "microphone_enabled": session.microphone_enabled,
+        "detection_running": session.detection_running,
+        "facial_fps": session.facial_state.get("frame_rate")
+    }
+
+def start_emotion_detection(session):
+    """Start event-driven emotion fusion in the combiner's background thread"""
+    if not session.detection_running:
+        session.detection_running = True
         
-        def emotion_detection_loop():
-            while emotion_detection_running:
-                try:
-                    # Update detectors based on current sensor states
-                    update_detectors(camera_enabled, microphone_enabled)
-                    
-                    # Only run detection if at least one sensor is enabled
-                    if camera_enabled or microphone_enabled:
-                        # Get combined emotion (this updates the JSON file)
-                        emotion = get_combined_emotion()
-                        print(f"Detected emotion: {emotion} (Camera: {camera_enabled}, Mic: {microphone_enabled})")
-                    else:
-                        # If no sensors are enabled, just sleep
-                        print("No sensors enabled, skipping emotion detection")
-                    
-                    time.sleep(5)  # Update every 5 seconds
-                except Exception as e:
-                    print(f"Error in emotion detection loop: {e}")
-                    time.sleep(5)
+        # Make sure the detectors match the current sensor states before fusing
+        update_detectors(session.camera_enabled, session.microphone_enabled, session)
         
-        emotion_thread = threading.Thread(target=emotion_detection_loop, daemon=True)
-        emotion_thread.start()
-        print("Emotion detection started in background")
+        # Only fuse if at least one sensor is enabled; detectors wake the combiner on change
+        start_fusion_loop(lambda: session.camera_enabled or session.microphone_enabled, session)
+        print(f"Emotion detection started in background (session {session.id})")
 
-def stop_emotion_detection():
+def stop_emotion_detection(session):
     """Stop continuous emotion detection"""
-    global emotion_detection_running
-    emotion_detection_running = False
-    print("Emotion detection stopped")
+    session.detection_running = False
+    stop_fusion_loop(session)
+    print(f"Emotion detection stopped (session {session.id})")
 
 @app.on_event("startup")
 async def startup_event():
     """Start emotion detection when the server starts"""
+    # Seed the snapshot so /api/emotion/* can answer before the first fusion
+    session = session_registry.get()
+    try:
+        session.snapshot.seed(session.emotion_log.read_latest())
+    except Exception as e:
+        print(f"Error seeding emotion snapshot: {e}")
+    session_registry.start_sweeper()
     # Don't start detection automatically - wait for frontend to enable sensors
     print("Server started - waiting for frontend to enable sensors")
 
 @app.on_event("shutdown")
 async def shutdown_event():
     """Stop emotion detection when the server shuts down"""
-    stop_emotion_detection()
+    session_registry.stop_sweeper()
+    for session in session_registry.all():
+        shutdown_session(session)
+    from modules.frame_upload import frame_upload_service
+    frame_upload_service.stop()
 
 @app.get("/api/emotion")
-def get_emotion():
+def get_emotion(session=Depends(current_session)):
     """Get the latest combined emotion (triggers detection if needed)"""
-    emotion = get_combined_emotion()
+    emotion = get_combined_emotion(session)
     return {"emotion": emotion}
 
 @app.get("/api/emotion/latest")
-def get_latest_emotion():
+def get_latest_emotion(response: Response, session=Depends(current_session)):
     """Get the latest emotion data with all fields"""
-    latest_data = get_latest_emotion_data()
+    version, latest_data = session.snapshot.get()
+    response.headers["X-Emotion-Version"] = str(version)
     if latest_data:
         return latest_data
     return {
@@ -114,128 +131,266 @@ def get_latest_emotion():
     }
 
 @app.get("/api/emotion/interaction")
-def get_interaction_emotion():
+def get_interaction_emotion(session=Depends(current_session)):
     """Get emotion based on interaction only"""
-    latest_data = get_latest_emotion_data()
+    latest_data = get_latest_emotion_data(session)
     if latest_data:
         return {"emotion": latest_data.get("interaction_emotion", "Unknown")}
     return {"emotion": "Unknown"}
 
 @app.get("/api/emotion/facial")
-def get_facial_emotion():
+def get_facial_emotion(session=Depends(current_session)):
     """Get emotion based on facial detection only"""
-    latest_data = get_latest_emotion_data()
+    latest_data = get_latest_emotion_data(session)
     if latest_data:
         return {"emotion": latest_data.get("facial_emotion", "Unknown")}
     return {"emotion": "Unknown"}
 
 @app.get("/api/emotion/voice")
-def get_voice_emotion():
+def get_voice_emotion(session=Depends(current_session)):
     """Get emotion based on voice detection only"""
-    latest_data = get_latest_emotion_data()
+    latest_data = get_latest_emotion_data(session)
     if latest_data:
         return {"emotion": latest_data.get("voice_emotion", "Unknown")}
     return {"emotion": "Unknown"}
 
 @app.get("/api/emotion/combined")
-def get_combined_emotion_endpoint():
+def get_combined_emotion_endpoint(session=Depends(current_session)):
     """Get the combined/final emotion"""
-    latest_data = get_latest_emotion_data()
+    latest_data = get_latest_emotion_data(session)
     if latest_data:
         return {"emotion": latest_data.get("final_emotion", "Unknown")}
     return {"emotion": "Unknown"}
 
+def subscribe_emotion_stream(session, since: Optional[int]):
+    """Subscribe to the session's hub, starting from the current snapshot if there is no history"""
+    version, data = session.snapshot.get()
+    current = dict(data, version=version) if data else None
+    return session.hub.subscribe(since=since, current=current)
+
+@app.get("/api/emotion/stream")
+async def stream_emotion(request: Request, since: Optional[int] = None, session=Depends(current_session)):
+    """Server-sent events: one event per emotion change, with heartbeats while idle.
+    Resumes after `since` (or the Last-Event-ID header sent by reconnecting browsers)."""
+    last_event_id = request.headers.get("last-event-id")
+    if since is None and last_event_id and last_event_id.isdigit():
+        since = int(last_event_id)
+    subscription = subscribe_emotion_stream(session, since)
+
+    async def event_source():
+        try:
+            while True:
+                event = await subscription.next_event()
+                if await request.is_disconnected():
+                    break
+                if event is None:
+                    yield ": heartbeat\n\n"
+                else:
+                    yield f"id: {event['version']}\nevent: emotion\ndata: {encode_event(event)}\n\n"
+        finally:
+            subscription.close()
+
+    return StreamingResponse(
+        event_source(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@app.websocket("/api/emotion/ws")
+async def emotion_websocket(websocket: WebSocket, since: Optional[int] = None, session_id: Optional[str] = None):
+    """WebSocket variant of /api/emotion/stream"""
+    try:
+        session = lookup_session(session_id or websocket.headers.get("x-session-id"))
+    except HTTPException:
+        await websocket.close(code=1008)
+        return
+    await websocket.accept()
+    subscription = subscribe_emotion_stream(session, since)
+    try:
+        while True:
+            event = await subscription.next_event()
+            if event is None:
+                await websocket.send_text('{"type":"heartbeat"}')
+            else:
+                await websocket.send_text(encode_event(dict(event, type="emotion")))
+    except WebSocketDisconnect:
+        pass
+    except Exception as e:
+        print(f"Emotion WebSocket closed: {e}")
+    finally:
+        subscription.close()
+
+@app.post("/api/landmarks")
+async def post_landmarks(request: Request, session=Depends(current_session)):
+    """Classify a binary batch of FaceMesh landmarks computed in the browser (FACIAL_SOURCE=browser).
+    The body is application/octet-stream in the format of modules/landmark_batch.py."""
+    from modules.facial_emotion import ingest_landmark_batch
+    from modules.landmark_batch import MAX_BATCH_BYTES
+    from modules.sensor_sources import BROWSER_SOURCE
+    state = session.facial_state
+    if state["source"] != BROWSER_SOURCE or not state["running"]:
+        raise HTTPException(status_code=409, detail="Facial detection is not running with the browser source")
+    length = request.headers.get("content-length")
+    if length and length.isdigit() and int(length) > MAX_BATCH_BYTES:
+        raise HTTPException(status_code=413, detail=f"Landmark batches are limited to {MAX_BATCH_BYTES} bytes")
+    data = await request.body()
+    try:
+        frames = await run_in_threadpool(ingest_landmark_batch, state, data)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"frames": frames, "emotion": state["last_emotion"]}
+
+# HTTP status for each reason a frame upload is rejected
+UPLOAD_REJECTION_STATUS = {"too_large": 413, "throttled": 429, "overloaded": 503}
+
+@app.post("/api/frames", status_code=202)
+async def post_frame(request: Request, session=Depends(current_session)):
+    """Queue one JPEG frame for server-side facial analysis (FACIAL_SOURCE=upload).
+    Frames are classified asynchronously in batches; the reply carries the current facial emotion."""
+    from modules.frame_upload import FRAME_UPLOAD_MAX_BYTES, FrameUploadRejected, frame_upload_service
+    from modules.sensor_sources import UPLOAD_SOURCE
+    state = session.facial_state
+    if state["source"] != UPLOAD_SOURCE or not state["running"]:
+        raise HTTPException(status_code=409, detail="Facial detection is not running with the upload source")
+    length = request.headers.get("content-length")
+    if length and length.isdigit() and int(length) > FRAME_UPLOAD_MAX_BYTES:
+        raise HTTPException(status_code=413, detail=f"Frames are limited to {FRAME_UPLOAD_MAX_BYTES} bytes")
+    data = await request.body()
+    try:
+        frame_upload_service.submit(state, data)
+    except FrameUploadRejected as e:
+        raise HTTPException(status_code=UPLOAD_REJECTION_STATUS[e.reason], detail=str(e),
+                            headers={"Retry-After": "1"} if e.reason != "too_large" else None)
+    return {"accepted": True, "emotion": state["last_emotion"]}
+
 @app.post("/api/sensors/camera")
-def toggle_camera():
-    """Toggle camera state"""
-    global camera_enabled, emotion_detection_running
-    camera_enabled = not camera_enabled
+def toggle_camera(session=Depends(current_session)):
+    """Toggle camera state (409 while another session is using the server camera)"""
+    claim_sensor(session, "camera", not session.camera_enabled)
+    session.camera_enabled = not session.camera_enabled
     
-    print(f"🔄 Camera toggled: {camera_enabled}")
-    print(f"📊 Current state - Camera: {camera_enabled}, Mic: {microphone_enabled}, Detection: {emotion_detection_running}")
+    print(f"🔄 Camera toggled: {session.camera_enabled} (session {session.id})")
+    print(f"📊 Current state - Camera: {session.camera_enabled}, Mic: {session.microphone_enabled}, Detection: {session.detection_running}")
     
     # Update detectors based on new camera state
-    update_detectors(camera_enabled, microphone_enabled)
+    update_detectors(session.camera_enabled, session.microphone_enabled, session)
     
     # Start emotion detection if any sensor is enabled
-    if (camera_enabled or microphone_enabled) and not emotion_detection_running:
+    if (session.camera_enabled or session.microphone_enabled) and not session.detection_running:
         print("🚀 Starting emotion detection...")
-        start_emotion_detection()
-    elif not camera_enabled and not microphone_enabled and emotion_detection_running:
+        start_emotion_detection(session)
+    elif not session.camera_enabled and not session.microphone_enabled and session.detection_running:
         print("🛑 Stopping emotion detection...")
-        stop_emotion_detection()
+        stop_emotion_detection(session)
     
-    print(f"✅ Final state - Camera: {camera_enabled}, Mic: {microphone_enabled}, Detection: {emotion_detection_running}")
+    print(f"✅ Final state - Camera: {session.camera_enabled}, Mic: {session.microphone_enabled}, Detection: {session.detection_running}")
     
-    return {
-        "camera_enabled": camera_enabled,
-        "microphone_enabled": microphone_enabled,
-        "detection_running": emotion_detection_running
-    }
+    if not session.camera_enabled:
+        session_registry.release_device(session, "camera")
+    return sensor_status(session)
 
 @app.post("/api/sensors/microphone")
-def toggle_microphone():
-    """Toggle microphone state"""
-    global microphone_enabled, emotion_detection_running
-    microphone_enabled = not microphone_enabled
+def toggle_microphone(session=Depends(current_session)):
+    """Toggle microphone state (409 while another session is using the server microphone)"""
+    claim_sensor(session, "microphone", not session.microphone_enabled)
+    session.microphone_enabled = not session.microphone_enabled
     
-    print(f"Microphone toggled: {microphone_enabled}")
+    print(f"Microphone toggled: {session.microphone_enabled} (session {session.id})")
     
     # Update detectors based on new microphone state
-    update_detectors(camera_enabled, microphone_enabled)
+    update_detectors(session.camera_enabled, session.microphone_enabled, session)
     
     # Start emotion detection if any sensor is enabled
-    if (camera_enabled or microphone_enabled) and not emotion_detection_running:
-        start_emotion_detection()
-    elif not camera_enabled and not microphone_enabled and emotion_detection_running:
-        stop_emotion_detection()
+    if (session.camera_enabled or session.microphone_enabled) and not session.detection_running:
+        start_emotion_detection(session)
+    elif not session.camera_enabled and not session.microphone_enabled and session.detection_running:
+        stop_emotion_detection(session)
     
-    return {
-        "camera_enabled": camera_enabled,
-        "microphone_enabled": microphone_enabled,
-        "detection_running": emotion_detection_running
-    }
+    if not session.microphone_enabled:
+        session_registry.release_device(session, "microphone")
+    return sensor_status(session)
 
 @app.get("/api/sensors/status")
-def get_sensor_status():
+def get_sensor_status(session=Depends(current_session)):
     """Get current sensor and detection status"""
-    return {
-        "camera_enabled": camera_enabled,
-        "microphone_enabled": microphone_enabled,
-        "detection_running": emotion_detection_running
-    }
+    return sensor_status(session)
 
 @app.post("/api/emotion/start")
-def start_detection():
+def start_detection(session=Depends(current_session)):
     """Manually start emotion detection"""
-    start_emotion_detection()
+    start_emotion_detection(session)
     return {"message": "Emotion detection started"}
 
 @app.post("/api/emotion/stop")
-def stop_detection():
+def stop_detection(session=Depends(current_session)):
     """Manually stop emotion detection"""
-    stop_emotion_detection()
+    stop_emotion_detection(session)
     return {"message": "Emotion detection stopped"}
 
 @app.get("/api/emotion/status")
-def get_detection_status():
+def get_detection_status(session=Depends(current_session)):
     """Get the status of emotion detection"""
-    return {"running": emotion_detection_running}
+    return {"running": session.detection_running, "facial_fps": session.facial_state.get("frame_rate")}
+
+@app.get("/api/sessions")
+def list_sessions():
+    """List active learner sessions"""
+    return [
+        {
+            "session_id": session.id,
+            "last_seen": session.last_seen,
+            "subscribers": session.hub.subscriber_count(),
+            **sensor_status(session)
+        }
+        for session in session_registry.all()
+    ]
+
+@app.delete("/api/sessions/{session_id}")
+def end_session(session_id: str):
+    """Stop a learner session's detectors and release its state"""
+    if session_id == DEFAULT_SESSION_ID:
+        raise HTTPException(status_code=400, detail="The default session cannot be ended")
+    return {"evicted": session_registry.evict(session_id)}
 
 @app.get("/api/emotion/all")
-def get_all_emotions():
-    """Get all emotion data from the JSON file"""
+def get_all_emotions(response: Response, start: Optional[str] = None, end: Optional[str] = None,
+                     cursor: Optional[int] = None, limit: Optional[int] = None,
+                     resolution: Optional[float] = None, tail: bool = False,
+                     session=Depends(current_session)):
+    """Get one page of emotion history (archived and live records, oldest first).
+
+    start/end bound the time range, limit sets the page size, and resolution (seconds)
+    downsamples into buckets. When more records remain, the X-Next-Cursor header holds
+    the cursor for the next page. tail=true returns the newest records of the range.
+    """
     try:
-        json_file = "emotion_log.json"
-        if os.path.exists(json_file):
-            with open(json_file, "r") as f:
-                data = json.load(f)
-                return data
-        return []
+        start_ms, end_ms = parse_time(start), parse_time(end)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    try:
+        records, next_cursor = query_history(session.emotion_log, session.archive, start_ms, end_ms,
+                                             cursor, limit, resolution, tail)
+        if next_cursor is not None:
+            response.headers["X-Next-Cursor"] = str(next_cursor)
+        return records
     except Exception as e:
         print(f"Error reading all emotion data: {e}")
         return []
 
+@app.get("/api/emotion/rollups")
+def get_emotion_rollups(level: str = "minute", start: Optional[str] = None, end: Optional[str] = None,
+                        session=Depends(current_session)):
+    """Get per-minute/hour/day emotion aggregates (seconds and samples per emotion, mean value)"""
+    try:
+        return session.rollups.query(level, parse_time(start), parse_time(end))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.get("/metrics")
+def get_metrics():
+    """Prometheus text exposition of detector, fusion and queue metrics"""
+    return Response(content=metrics_registry.render(), media_type="text/plain; version=0.0.4")
+
 @app.get("/games/{emotion}/{game_name}")
 def serve_game(emotion: str, game_name: str):
     """Serve simple HTML games or a Coming Soon page."""
@@ -838,22 +993,24 @@ def explain_topic(request: TopicRequest):
     }
 
 @app.get("/api/sensors/camera/status")
-def get_camera_status():
+def get_camera_status(session=Depends(current_session)):
     """Get detailed camera status including if it's being accessed"""
     try:
-        from modules.facial_emotion import check_camera_availability
-        camera_available = check_camera_availability()
+        from modules.facial_emotion import camera_status
+        device = camera_status(session.facial_state)
+        camera_available = device.pop("available")
         return {
-            "camera_enabled": camera_enabled,
+            "camera_enabled": session.camera_enabled,
             "camera_available": camera_available,
-            "detection_running": emotion_detection_running,
-            "status": "Camera is accessible" if camera_available else "Camera not accessible"
+            "detection_running": session.detection_running,
+            "status": "Camera is accessible" if camera_available else "Camera not accessible",
+            "device": device
         }
     except Exception as e:
         return {
-            "camera_enabled": camera_enabled,
+            "camera_enabled": session.camera_enabled,
             "camera_available": False,
-            "detection_running": emotion_detection_running,
+            "detection_running": session.detection_running,
             "status": f"Error checking camera: {str(e)}"
         }
 
@@ -0,0 +1,155 @@
+import logging
+import threading
+import time
+import traceback
+
+from modules.frame_capture import FrameCapture
+from modules.sensor_sources import FACIAL_SOURCE, frame_source_from_spec
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# --- Camera Manager Configuration ---
+PROBE_INTERVAL = 10.0      # Seconds a probe result of a closed device is trusted
+FRAME_STALE_SECONDS = 2.0  # An open device without a frame for this long is reported unavailable
+
+
+class _Device:
+    def __init__(self, spec):
+        self.spec = spec
+        self.capture = None
+        self.users = 0
+        self.opened_at = None
+        self.last_error = None
+        self.probe_result = None
+        self.probe_time = 0.0
+        self.closing = False  # Capture stopping and source releasing, outside the manager lock
+
+
+class CameraManager:
+    """Single owner of each live frame source (camera:<n>, or a real-time file).
+
+    acquire() opens the device on first use and hands every caller (calibration, the
+    detection loop of any session) its own FrameReader over one shared capture thread;
+    the device is closed when the last reader is released. available() answers from
+    the open device's health (recent frames) and never reopens a device that is in use.
+    A device that is still closing is waited for before it is opened (or probed) again.
+    Finite unthrottled sources (fast file replays) are not shared: each caller gets its own.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.closed = threading.Condition(self.lock)  # Notified when a device has finished closing
+        self.devices = {}
+
+    def _device(self, spec):
+        device = self.devices.get(spec)
+        if device is None:
+            device = self.devices[spec] = _Device(spec)
+        return device
+
+    def _wait_closed(self, device):
+        # Called with the lock held; a camera cannot be reopened until its last holder lets go
+        while device.closing:
+            self.closed.wait()
+
+    def acquire(self, spec=None):
+        """A frame reader for `spec` (default FACIAL_SOURCE), or None if the device cannot be opened."""
+        spec = spec or FACIAL_SOURCE
+        with self.lock:
+            device = self._device(spec)
+            self._wait_closed(device)
+            if device.capture is None or not device.capture.running:
+                source = frame_source_from_spec(spec)
+                try:
+                    opened = source.open()
+                except Exception as e:
+                    logger.error(f"Error opening frame source {spec}: {str(e)}")
+                    logger.debug(traceback.format_exc())
+                    opened = False
+                if not opened:
+                    source.release()
+                    device.last_error = f"Failed to open {spec}"
+                    device.probe_result, device.probe_time = False, time.monotonic()
+                    return None
+                if not source.realtime:
+                    return source
+                device.capture = FrameCapture(source).start()
+                device.opened_at = time.monotonic()
+                device.last_error = None
+                logger.info(f"Opened frame source {spec}")
+            device.users += 1
+            return device.capture.add_reader(on_release=lambda reader: self._release(spec))
+
+    def _release(self, spec):
+        with self.lock:
+            device = self.devices.get(spec)
+            if device is None or device.capture is None:
+                return
+            device.users -= 1
+            if device.users > 0:
+                return
+            capture, device.capture, device.users = device.capture, None, 0
+            device.closing = True
+        try:
+            capture.stop()
+            capture.source.release()
+            logger.info(f"Closed frame source {spec}")
+        finally:
+            with self.lock:
+                device.closing = False
+                self.closed.notify_all()
+
+    def available(self, spec=None):
+        """Whether `spec` can deliver frames: health of the open device, else a cached probe."""
+        spec = spec or FACIAL_SOURCE
+        with self.lock:
+            device = self._device(spec)
+            capture = device.capture
+            if capture is None:
+                if not spec.startswith("camera"):
+                    return frame_source_from_spec(spec).available()
+                if device.probe_result is not None and time.monotonic() - device.probe_time < PROBE_INTERVAL:
+                    return device.probe_result
+        if capture is not None:
+            return self._healthy(device, capture)
+        # Closed camera: open it briefly (under the lock, so no reader can open it meanwhile)
+        with self.lock:
+            self._wait_closed(device)
+            if device.capture is not None:
+                return self._healthy(device, device.capture)
+            try:
+                device.probe_result = frame_source_from_spec(spec).available()
+            except Exception as e:
+                logger.error(f"Error probing frame source {spec}: {str(e)}")
+                device.probe_result = False
+            device.probe_time = time.monotonic()
+            return device.probe_result
+
+    def _healthy(self, device, capture):
+        age = capture.frame_age()
+        if age is None:
+            # Just opened: give the first frame time to arrive
+            return capture.running and time.monotonic() - device.opened_at < FRAME_STALE_SECONDS
+        return capture.running and age < FRAME_STALE_SECONDS
+
+    def status(self, spec=None):
+        """Device state for the status routes."""
+        spec = spec or FACIAL_SOURCE
+        with self.lock:
+            device = self._device(spec)
+            capture = device.capture
+            users = device.users
+            error = device.last_error
+        age = capture.frame_age() if capture is not None else None
+        return {
+            "source": spec,
+            "open": capture is not None,
+            "users": users,
+            "last_frame_age": round(age, 3) if age is not None else None,
+            "last_error": error,
+        }
+
+
+# Process-wide camera owner (in FACIAL_DETECTOR_MODE=process the worker process has its own)
+camera_manager = CameraManager()
@@ -0,0 +1,55 @@
+import threading
+import time
+from datetime import datetime
+
+# --- Detector Clocks ---
+# Detector timing rules (eyes-closed, yawn, no-face and idle durations, emotion locks, silence
+# timeouts) and loop pacing read time through a clock kept in the detector state, so they can
+# run against simulated time. Metrics keep using time.perf_counter(): they measure real cost.
+
+
+class SystemClock:
+    """Wall-clock time; what the detectors use unless told otherwise."""
+
+    def time(self):
+        return time.time()
+
+    def sleep(self, seconds):
+        time.sleep(seconds)
+
+    def now(self):
+        return datetime.fromtimestamp(self.time())
+
+
+class VirtualClock:
+    """Simulated time that only moves when something sleeps on it or calls advance().
+
+    sleep() returns immediately after moving the clock forward, so a loop driven from one
+    thread replays hours of behaviour in seconds. Several threads sleeping on the same clock
+    would each push it forward, so drive a virtual clock from a single thread.
+    """
+
+    def __init__(self, start=None):
+        self.lock = threading.Lock()
+        self.current = time.time() if start is None else float(start)
+
+    def time(self):
+        with self.lock:
+            return self.current
+
+    def advance(self, seconds):
+        if seconds < 0:
+            raise ValueError("A clock cannot go backwards")
+        with self.lock:
+            self.current += seconds
+            return self.current
+
+    def sleep(self, seconds):
+        self.advance(max(0.0, seconds))
+
+    def now(self):
+        return datetime.fromtimestamp(self.time())
+
+
+# Shared by every detector state that is not given its own clock
+system_clock = SystemClock()
@@ -0,0 +1,90 @@
+import logging
+import threading
+import time
+import traceback
+
+from modules.metrics import FRAMES_DROPPED
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+SUPERSEDED = FRAMES_DROPPED.labels("deepface", "superseded")
+
+
+class DeepFaceWorker:
+    """Runs a slow frame analysis (DeepFace) off the capture loop.
+
+    The loop hands over frames with submit() and never waits: only the newest submitted
+    frame is kept, and it is analysed at most `max_rate` times per second. latest()
+    returns the most recent result together with its age, measured from when its frame
+    was submitted, so callers can ignore results that are too old to trust.
+    """
+
+    def __init__(self, analyze, max_rate=4.0, name="DeepFaceWorker"):
+        self.analyze = analyze  # frame -> result (should not raise)
+        self.min_interval = 1.0 / max_rate if max_rate > 0 else 0.0
+        self.name = name
+        self.condition = threading.Condition()
+        self.pending = None  # (frame, submitted_at) waiting for analysis
+        self.result = None
+        self.result_time = None
+        self.running = False
+        self.thread = None
+
+    def start(self):
+        with self.condition:
+            if self.running:
+                return
+            self.running = True
+        self.thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+        self.thread.start()
+
+    def stop(self, timeout=2.0):
+        with self.condition:
+            self.running = False
+            self.pending = None
+            self.condition.notify_all()
+        if self.thread is not None and self.thread is not threading.current_thread():
+            self.thread.join(timeout)
+        self.thread = None
+
+    def submit(self, frame):
+        """Queue `frame` for analysis, replacing any frame still waiting. The frame must not be modified afterwards."""
+        with self.condition:
+            if self.pending is not None:
+                SUPERSEDED.inc()
+            self.pending = (frame, time.monotonic())
+            self.condition.notify()
+
+    def latest(self):
+        """(result, age in seconds) of the newest analysis, or (None, None) before the first one."""
+        with self.condition:
+            if self.result_time is None:
+                return None, None
+            return self.result, time.monotonic() - self.result_time
+
+    def _run(self):
+        last_start = 0.0
+        while True:
+            with self.condition:
+                while self.running and self.pending is None:
+                    self.condition.wait()
+                if not self.running:
+                    return
+                delay = last_start + self.min_interval - time.monotonic()
+                if delay > 0:
+                    # Rate limit; a newer frame may replace the pending one meanwhile
+                    self.condition.wait(delay)
+                    continue
+                frame, submitted_at = self.pending
+                self.pending = None
+            last_start = time.monotonic()
+            try:
+                result = self.analyze(frame)
+            except Exception as e:
+                logger.error(f"{self.name} analysis failed: {str(e)}")
+                logger.error(traceback.format_exc())
+                result = e
+            with self.condition:
+                self.result = result
+                self.result_time = submitted_at
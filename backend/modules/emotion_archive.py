@@ -0,0 +1,240 @@
+import json
+import logging
+import os
+import shutil
+import threading
+import traceback
+from datetime import datetime
+
+import numpy as np
+
+from modules.emotion_codes import decode_emotion, encode_emotion
+from modules.emotion_store import TIME_FORMAT, record_timestamp_ms
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# --- Archive Configuration ---
+ARCHIVE_VERSION = 1
+CHUNK_RECORDS = 65536  # Max records per chunk file set
+COMPACT_THRESHOLD = int(os.environ.get("EMOTION_COMPACT_THRESHOLD", 5000))  # Live records that trigger compaction
+COMPACT_KEEP = int(os.environ.get("EMOTION_COMPACT_KEEP", 1000))            # Recent records left in the live log
+
+# Column name -> (record field, dtype). Timestamps are epoch ms, emotions are emotion_codes values.
+COLUMNS = {
+    "ts": ("time", np.int64),
+    "facial": ("facial_emotion", np.uint8),
+    "voice": ("voice_emotion", np.uint8),
+    "interaction": ("interaction_emotion", np.uint8),
+    "final": ("final_emotion", np.uint8),
+    "value": ("value", np.float32),
+}
+EMOTION_COLUMNS = ("facial", "voice", "interaction", "final")
+
+
+def decode_record(columns, i):
+    """Row i of a chunk's columns as a record dict in the live log's JSON shape."""
+    record = {"time": datetime.fromtimestamp(int(columns["ts"][i]) / 1000).strftime(TIME_FORMAT)}
+    for column in EMOTION_COLUMNS:
+        record[COLUMNS[column][0]] = decode_emotion(columns[column][i])
+    record["value"] = round(float(columns["value"][i]), 4)
+    return record
+
+
+class EmotionArchive:
+    """Columnar, chunked archive of fused emotion records.
+
+    Each chunk is a directory of .npy files, one per column, opened with mmap_mode="r" so
+    reads are zero-copy slices of the page cache. manifest.json lists the chunks and the
+    sequence number up to which the live log has been archived (archived_through).
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.manifest_path = os.path.join(directory, "manifest.json")
+        self.lock = threading.Lock()
+        self.manifest = None
+        self._mapped = {}  # chunk name -> {column: memmap}
+
+    # --- Manifest ---
+
+    def _load_manifest(self):
+        if self.manifest is not None:
+            return self.manifest
+        self.manifest = {"version": ARCHIVE_VERSION, "archived_through": 0, "chunks": []}
+        if os.path.exists(self.manifest_path):
+            try:
+                with open(self.manifest_path, "r") as f:
+                    self.manifest = json.load(f)
+            except Exception as e:
+                logger.error(f"Error reading {self.manifest_path}: {str(e)}")
+        return self.manifest
+
+    def _save_manifest(self, manifest):
+        tmp_path = self.manifest_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(manifest, f, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.manifest_path)
+        self.manifest = manifest
+
+    def archived_through(self):
+        """Sequence number of the first record not yet in the archive."""
+        with self.lock:
+            return self._load_manifest()["archived_through"]
+
+    def chunks(self):
+        with self.lock:
+            return list(self._load_manifest()["chunks"])
+
+    def count(self):
+        return sum(chunk["count"] for chunk in self.chunks())
+
+    # --- Writing ---
+
+    def _write_chunk(self, first_seq, records):
+        name = f"chunk_{first_seq:012d}"
+        final_dir = os.path.join(self.directory, name)
+        tmp_dir = final_dir + ".tmp"
+        for stale in (tmp_dir, final_dir):
+            # Left behind by a compaction that crashed before its manifest update
+            if os.path.exists(stale):
+                shutil.rmtree(stale)
+        os.makedirs(tmp_dir)
+
+        ts = np.fromiter((record_timestamp_ms(r) for r in records), dtype=np.int64, count=len(records))
+        for column, (field, dtype) in COLUMNS.items():
+            if column == "ts":
+                values = ts
+            elif column in EMOTION_COLUMNS:
+                values = np.fromiter((encode_emotion(r.get(field)) for r in records), dtype=dtype, count=len(records))
+            else:
+                values = np.fromiter((r.get(field) or 0.0 for r in records), dtype=dtype, count=len(records))
+            with open(os.path.join(tmp_dir, column + ".npy"), "wb") as f:
+                np.save(f, values)
+                f.flush()
+                os.fsync(f.fileno())
+        os.rename(tmp_dir, final_dir)
+        return {
+            "name": name,
+            "first_seq": first_seq,
+            "count": len(records),
+            "start_ms": int(ts.min()),
+            "end_ms": int(ts.max()),
+        }
+
+    def append(self, first_seq, records, end_seq=None):
+        """Archive records numbered first_seq.. and advance archived_through to end_seq.
+
+        end_seq defaults to first_seq + len(records); it is larger when unreadable
+        lines were skipped while reading the live log.
+        """
+        if not records:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        with self.lock:
+            manifest = self._load_manifest()
+            if first_seq != manifest["archived_through"]:
+                raise ValueError(f"Archive expects seq {manifest['archived_through']}, got {first_seq}")
+            chunks = list(manifest["chunks"])
+            for start in range(0, len(records), CHUNK_RECORDS):
+                batch = records[start:start + CHUNK_RECORDS]
+                chunks.append(self._write_chunk(first_seq + start, batch))
+            self._save_manifest(dict(manifest, chunks=chunks,
+                                     archived_through=end_seq or first_seq + len(records)))
+
+    # --- Reading ---
+
+    def load_chunk(self, chunk):
+        """Return {column: read-only memmap} for a manifest chunk entry."""
+        with self.lock:
+            columns = self._mapped.get(chunk["name"])
+            if columns is None:
+                chunk_dir = os.path.join(self.directory, chunk["name"])
+                columns = {column: np.load(os.path.join(chunk_dir, column + ".npy"), mmap_mode="r")
+                           for column in COLUMNS}
+                self._mapped[chunk["name"]] = columns
+            return columns
+
+    def slices(self, start_ms=None, end_ms=None):
+        """Yield (chunk, {column: array view}) for records with start_ms <= ts < end_ms.
+
+        Views are slices of the memory maps; nothing is copied until the caller does so.
+        Timestamps are assumed non-decreasing within a chunk (they are in append order).
+        """
+        for chunk in self.chunks():
+            if start_ms is not None and chunk["end_ms"] < start_ms:
+                continue
+            if end_ms is not None and chunk["start_ms"] >= end_ms:
+                continue
+            columns = self.load_chunk(chunk)
+            ts = columns["ts"]
+            lo = 0 if start_ms is None else int(np.searchsorted(ts, start_ms, side="left"))
+            hi = len(ts) if end_ms is None else int(np.searchsorted(ts, end_ms, side="left"))
+            if lo < hi:
+                yield chunk, {column: values[lo:hi] for column, values in columns.items()}
+
+    def seq_for_time(self, ts_ms):
+        """Sequence number of the first archived record at or after ts_ms (archived_through if none)."""
+        for chunk in self.chunks():
+            if chunk["end_ms"] >= ts_ms:
+                ts = self.load_chunk(chunk)["ts"]
+                return chunk["first_seq"] + int(np.searchsorted(ts, ts_ms, side="left"))
+        return self.archived_through()
+
+    def iter_records(self, start_seq, end_seq):
+        """Yield (seq, ts_ms, record) for archived records numbered start_seq..end_seq-1."""
+        for chunk in self.chunks():
+            first = chunk["first_seq"]
+            if first + chunk["count"] <= start_seq:
+                continue
+            if first >= end_seq:
+                break
+            columns = self.load_chunk(chunk)
+            for i in range(max(start_seq - first, 0), min(end_seq - first, chunk["count"])):
+                yield first + i, int(columns["ts"][i]), decode_record(columns, i)
+
+    def read_records(self, start_ms=None, end_ms=None):
+        """Decode archived records back into the JSON record shape used by the live log."""
+        records = []
+        for _, columns in self.slices(start_ms, end_ms):
+            records.extend(decode_record(columns, i) for i in range(len(columns["ts"])))
+        return records
+
+    def close(self):
+        with self.lock:
+            self._mapped.clear()
+
+
+# --- Compaction ---
+
+def compact(store, archive, threshold=COMPACT_THRESHOLD, keep=COMPACT_KEEP):
+    """Move all but the newest `keep` live records into the archive once the log exceeds `threshold`.
+
+    Order matters for crash safety: chunks first, then the manifest, then the live log is
+    trimmed. A crash before the trim leaves records in both places; readers skip live
+    records below archived_through, and the next compaction resumes from there.
+    Returns the number of records archived.
+    """
+    try:
+        first, end = store.seq_range()
+        start = max(first, archive.archived_through())
+        stop = end - keep
+        if end - first <= threshold or stop <= start:
+            if first < start:
+                store.drop_before(start)  # Finish a trim interrupted by a crash
+            return 0
+        records = store.read_seq_range(start, stop)
+        archive.append(start, records, end_seq=stop)
+        store.drop_before(stop)
+        logger.info(f"Archived {len(records)} emotion records from {store.path}")
+        return len(records)
+    except Exception as e:
+        logger.error(f"Error compacting {store.path}: {str(e)}")
+        logger.error(traceback.format_exc())
+        return 0
+
+
+# Process-wide archive paired with emotion_store.emotion_log
+emotion_archive = EmotionArchive("emotion_archive")
@@ -0,0 +1,20 @@
+# Compact integer codes for emotion labels, shared by the detectors and the history archive.
+# Kept free of heavy imports so storage and analytics code can use it without loading cv2/DeepFace.
+
+# Emotion index mapping used by the facial detector (keep as is)
+emotion_index = {"Engaged": 0, "Confused": 1, "Frustrated": 2, "Bored": 3, "Sleepy": 4, "Unknown": 5}
+
+# Archive codes: the facial mapping plus labels that only appear in fused records.
+# Codes are persisted on disk, so only ever append new labels.
+EMOTION_CODES = dict(emotion_index, **{"Face Not Detected": 6})
+EMOTION_NAMES = {code: name for name, code in EMOTION_CODES.items()}
+UNKNOWN_CODE = EMOTION_CODES["Unknown"]
+
+
+def encode_emotion(name):
+    """Label -> uint8 code; labels without a code are stored as "Unknown"."""
+    return EMOTION_CODES.get(name, UNKNOWN_CODE)
+
+
+def decode_emotion(code):
+    return EMOTION_NAMES.get(int(code), "Unknown")
@@ -1,97 +1,112 @@
 from modules.facial_emotion import get_facial_emotion, start_facial_emotion_detection, stop_facial_emotion_detection
 from modules.speech_emotion import get_speech_emotion, start_speech_emotion_detection, stop_speech_emotion_detection
 from modules.mouse_emotion import get_mouse_emotion, start_mouse_emotion_detection, stop_mouse_emotion_detection
+from modules.session_registry import session_registry
+from modules.metrics import FUSIONS, STAGE_SECONDS
 
 import logging
-from datetime import datetime
-import json
-import os
+import threading
 import time
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Track which detectors are running
-detectors_running = {
-    "facial": False,
-    "speech": False,
-    "mouse": False
-}
+# Event-driven fusion: fuse as soon as a detector reports a change
+FUSION_DEBOUNCE = 0.05    # Seconds to coalesce a burst of changes into one fusion
+FUSION_KEEPALIVE = 30.0   # Fuse at least this often so the log keeps a heartbeat while idle
 
-json_log_file = "emotion_log.json"
+# Track which detectors are running (default session; other sessions carry their own)
+detectors_running = session_registry.get().detectors_running
+fusion_state = session_registry.get().fusion
 
-def start_detector(detector_type: str):
+FUSION_SECONDS = STAGE_SECONDS.labels("combiner", "get_combined_emotion")
+
+def resolve_session(session=None):
+    """Return the given learner session, or the default one"""
+    return session if session is not None else session_registry.get()
+
+def start_detector(detector_type: str, session=None):
     """Start a specific detector"""
-    global detectors_running
+    session = resolve_session(session)
+    running = session.detectors_running
     try:
-        if detector_type == "facial" and not detectors_running["facial"]:
-            start_facial_emotion_detection()
-            detectors_running["facial"] = True
-            logger.info("Facial emotion detection started")
-        elif detector_type == "speech" and not detectors_running["speech"]:
-            start_speech_emotion_detection()
-            detectors_running["speech"] = True
-            logger.info("Speech emotion detection started")
-        elif detector_type == "mouse" and not detectors_running["mouse"]:
-            start_mouse_emotion_detection()
-            detectors_running["mouse"] = True
-            logger.info("Mouse emotion detection started")
+        if detector_type == "facial" and not running["facial"]:
+            start_facial_emotion_detection(session.facial_state)
+            running["facial"] = True
+            logger.info(f"Facial emotion detection started (session {session.id})")
+        elif detector_type == "speech" and not running["speech"]:
+            start_speech_emotion_detection(session.speech_state)
+            running["speech"] = True
+            logger.info(f"Speech emotion detection started (session {session.id})")
+        elif detector_type == "mouse" and not running["mouse"]:
+            start_mouse_emotion_detection(session.mouse_state)
+            running["mouse"] = True
+            logger.info(f"Mouse emotion detection started (session {session.id})")
     except Exception as e:
         logger.error(f"Failed to start {detector_type} detector: {e}")
 
-def stop_detector(detector_type: str):
+def stop_detector(detector_type: str, session=None):
     """Stop a specific detector"""
-    global detectors_running
+    session = resolve_session(session)
+    running = session.detectors_running
     try:
-        if detector_type == "facial" and detectors_running["facial"]:
-            stop_facial_emotion_detection()
-            detectors_running["facial"] = False
-            logger.info("Facial emotion detection stopped")
-        elif detector_type == "speech" and detectors_running["speech"]:
-            stop_speech_emotion_detection()
-            detectors_running["speech"] = False
-            logger.info("Speech emotion detection stopped")
-        elif detector_type == "mouse" and detectors_running["mouse"]:
-            stop_mouse_emotion_detection()
-            detectors_running["mouse"] = False
-            logger.info("Mouse emotion detection stopped")
+        if detector_type == "facial" and running["facial"]:
+            stop_facial_emotion_detection(session.facial_state)
+            running["facial"] = False
+            logger.info(f"Facial emotion detection stopped (session {session.id})")
+        elif detector_type == "speech" and running["speech"]:
+            stop_speech_emotion_detection(session.speech_state)
+            running["speech"] = False
+            logger.info(f"Speech emotion detection stopped (session {session.id})")
+        elif detector_type == "mouse" and running["mouse"]:
+            stop_mouse_emotion_detection(session.mouse_state)
+            running["mouse"] = False
+            logger.info(f"Mouse emotion detection stopped (session {session.id})")
     except Exception as e:
         logger.error(f"Failed to stop {detector_type} detector: {e}")
 
-def update_detectors(camera_enabled: bool, microphone_enabled: bool):
+def update_detectors(camera_enabled: bool, microphone_enabled: bool, session=None):
     """Update which detectors should be running based on sensor states"""
-    logger.info(f"Updating detectors - Camera: {camera_enabled}, Microphone: {microphone_enabled}")
-    logger.info(f"Current detector states: {detectors_running}")
+    session = resolve_session(session)
+    running = session.detectors_running
+    logger.info(f"Updating detectors ({session.id}) - Camera: {camera_enabled}, Microphone: {microphone_enabled}")
+    logger.info(f"Current detector states: {running}")
     
     # Always keep mouse detection running for interaction-based emotion
-    if not detectors_running["mouse"]:
+    if not running["mouse"]:
         logger.info("Starting mouse emotion detection")
-        start_detector("mouse")
+        start_detector("mouse", session)
     
     # Start/stop facial detection based on camera state
-    if camera_enabled and not detectors_running["facial"]:
+    if camera_enabled and not running["facial"]:
         logger.info("Starting facial emotion detection")
-        start_detector("facial")
-    elif not camera_enabled and detectors_running["facial"]:
+        start_detector("facial", session)
+    elif not camera_enabled and running["facial"]:
         logger.info("Stopping facial emotion detection")
-        stop_detector("facial")
+        stop_detector("facial", session)
     
     # Start/stop speech detection based on microphone state
-    if microphone_enabled and not detectors_running["speech"]:
+    if microphone_enabled and not running["speech"]:
         logger.info("Starting speech emotion detection")
-        start_detector("speech")
-    elif not microphone_enabled and detectors_running["speech"]:
+        start_detector("speech", session)
+    elif not microphone_enabled and running["speech"]:
         logger.info("Stopping speech emotion detection")
-        stop_detector("speech")
+        stop_detector("speech", session)
     
-    logger.info(f"Updated detector states: {detectors_running}")
+    logger.info(f"Updated detector states: {running}")
+
+    # Sensor changes alter which modalities contribute, so re-fuse right away
+    session.changes.notify("detectors")
 
-def get_combined_emotion():
+def get_combined_emotion(session=None):
+    session = resolve_session(session)
+    running = session.detectors_running
+    fusion_start = time.perf_counter()
     try:
         # Get emotions from running detectors only
-        facial = get_facial_emotion() if detectors_running["facial"] else "Unknown"
-        speech = get_speech_emotion() if detectors_running["speech"] else "Unknown"
-        mouse = get_mouse_emotion() if detectors_running["mouse"] else "Unknown"
+        facial = get_facial_emotion(session.facial_state) if running["facial"] else "Unknown"
+        speech = get_speech_emotion(session.speech_state) if running["speech"] else "Unknown"
+        mouse = get_mouse_emotion(session.mouse_state) if running["mouse"] else "Unknown"
 
         # Debug logging to see what each detector is returning
         logger.info(f"DEBUG - Facial emotion: {facial}")
@@ -118,7 +133,7 @@ def get_combined_emotion():
             "Unknown": 0.2
         }
         value = emotion_weights.get(final, 0.0)
-        now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        now = session.clock.now().strftime("%Y-%m-%d %H:%M:%S")
 
         log_entry = {
             "time": now,
@@ -129,35 +144,84 @@ def get_combined_emotion():
             "value": value
         }
 
-        # Append to emotion_log.json
+        # Publish to in-memory readers first, then append to the emotion log (O(1), never rewrites history)
+        version = session.snapshot.update(log_entry)
+        session.hub.publish(version, log_entry)
         try:
-            if os.path.exists(json_log_file):
-                with open(json_log_file, "r") as f:
-                    data = json.load(f)
-            else:
-                data = []
-
-            data.append(log_entry)
-
-            with open(json_log_file, "w") as f:
-                json.dump(data, f, indent=2)
-
+            seq = session.emotion_log.append(log_entry)
+            session.rollups.add(seq, log_entry)
             logger.info(f"[Combined Emotion] {log_entry}")
         except Exception as e:
-            logger.error(f"Error writing to emotion_log.json: {e}")
+            logger.error(f"Error writing to emotion log: {e}")
 
+        FUSIONS.inc()
+        FUSION_SECONDS.observe(time.perf_counter() - fusion_start)
         return final
 
     except Exception as e:
         logger.error(f"Error in get_combined_emotion: {e}")
         return "Engaged"
 
+def fusion_loop(session, should_fuse):
+    """Fuse on every detector change (debounced), with a low-rate keepalive while idle."""
+    fusion_state = session.fusion
+    me = threading.current_thread()
+    # A stop followed by a quick restart hands over to the new thread
+    while fusion_state["running"] and fusion_state["thread"] is me:
+        try:
+            changed = session.changes.wait(FUSION_KEEPALIVE)
+            if not fusion_state["running"] or fusion_state["thread"] is not me:
+                break
+            if changed:
+                # Let simultaneous transitions from other modalities land in the same fusion
+                time.sleep(FUSION_DEBOUNCE)
+                changed |= session.changes.wait(0)
+                logger.debug(f"Fusing after change in: {sorted(changed)}")
+            if should_fuse():
+                get_combined_emotion(session)
+                fusion_state["last_fusion_time"] = time.time()
+        except Exception as e:
+            logger.error(f"Error in fusion loop: {e}")
+            time.sleep(1)
+
+def start_fusion_loop(should_fuse=lambda: True, session=None):
+    """Start the event-driven fusion thread; `should_fuse` gates each fusion"""
+    session = resolve_session(session)
+    fusion_state = session.fusion
+    if fusion_state["running"]:
+        return
+    fusion_state["running"] = True
+    fusion_state["thread"] = threading.Thread(target=fusion_loop, args=(session, should_fuse), daemon=True)
+    fusion_state["thread"].start()
+    logger.info(f"Event-driven fusion started (session {session.id})")
+
+def stop_fusion_loop(session=None):
+    """Stop the fusion thread"""
+    session = resolve_session(session)
+    fusion_state = session.fusion
+    if not fusion_state["running"]:
+        return
+    fusion_state["running"] = False
+    session.changes.notify("stop")
+    logger.info(f"Event-driven fusion stopped (session {session.id})")
+
+def shutdown_session(session):
+    """Stop fusion and every detector of a session (used when it is evicted)"""
+    stop_fusion_loop(session)
+    for detector_type in ("facial", "speech", "mouse"):
+        stop_detector(detector_type, session)
+    session.detection_running = False
+    session.rollups.save()
+
+session_registry.on_evict = shutdown_session
+
 if __name__ == "__main__":
     print("🧠 Starting Combined Emotion Check...")
+    update_detectors(camera_enabled=True, microphone_enabled=True)
+    start_fusion_loop()
     try:
         while True:
-            emotion = get_combined_emotion()
-            print(f"[Combined Emotion]: {emotion}")
-            time.sleep(5)
+            time.sleep(1)
     except KeyboardInterrupt:
+        stop_fusion_loop()
         print("🛑 Stopping combined emotion check.")
\ No newline at end of file
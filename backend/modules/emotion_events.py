@@ -0,0 +1,45 @@
+import logging
+import threading
+
+from modules.metrics import TRANSITIONS
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+
+class ChangeNotifier:
+    """Wake-up channel from the detectors to the combiner.
+
+    Detectors call notify() when their smoothed emotion changes; the fusion loop blocks in
+    wait() and therefore uses no CPU while nothing is happening.
+    """
+
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.pending = set()
+
+    def notify(self, source):
+        """Record that `source` changed and wake any waiting fusion loop."""
+        with self.condition:
+            self.pending.add(source)
+            self.condition.notify_all()
+
+    def wait(self, timeout=None):
+        """Block until at least one change is pending (or timeout) and return the changed sources."""
+        with self.condition:
+            if not self.pending:
+                self.condition.wait(timeout)
+            changed = self.pending
+            self.pending = set()
+            return changed
+
+
+# Process-wide notifier shared by the facial, speech and mouse detectors
+emotion_changes = ChangeNotifier()
+
+
+def publish_change(source, emotion, notifier=emotion_changes):
+    """Announce a detector state transition to the combiner of the detector's session."""
+    logger.debug(f"{source} emotion changed to {emotion}")
+    TRANSITIONS.labels(source).inc()
+    notifier.notify(source)
@@ -0,0 +1,115 @@
+import logging
+from collections import Counter
+from datetime import datetime
+from itertools import islice
+
+from modules.emotion_store import TIME_FORMAT, record_timestamp_ms
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# --- Query Configuration ---
+DEFAULT_PAGE_SIZE = 500
+MAX_PAGE_SIZE = 5000
+LIVE_READ_BATCH = 1000  # Records read from the live log per step while iterating
+EMOTION_FIELDS = ("facial_emotion", "voice_emotion", "interaction_emotion", "final_emotion")
+
+
+def parse_time(value):
+    """Parse a query time ("YYYY-MM-DD HH:MM:SS", ISO 8601 or epoch ms) into epoch ms."""
+    if value is None or value == "":
+        return None
+    if value.isdigit():
+        return int(value)
+    for parse in (lambda v: datetime.strptime(v, TIME_FORMAT), datetime.fromisoformat):
+        try:
+            return int(parse(value).timestamp() * 1000)
+        except ValueError:
+            pass
+    raise ValueError(f"Invalid time '{value}': use 'YYYY-MM-DD HH:MM:SS', ISO 8601 or epoch milliseconds")
+
+
+# --- Sequence-addressed Reads ---
+# A session's history is the archive (sequence numbers below archived_through) followed by the
+# live log. Both are indexed by timestamp, so locating a time or cursor costs O(log n).
+
+def seq_for_time(store, archive, ts_ms):
+    """Sequence number of the first record at or after ts_ms."""
+    archived = archive.archived_through()
+    seq = archive.seq_for_time(ts_ms)
+    if seq < archived:
+        return seq
+    return max(store.seq_for_time(ts_ms), archived)
+
+
+def iter_history(store, archive, start_seq=0, end_seq=None):
+    """Yield (seq, ts_ms, record) from start_seq up to end_seq, reading only those rows."""
+    archived = archive.archived_through()
+    if start_seq < archived:
+        yield from archive.iter_records(start_seq, archived if end_seq is None else min(end_seq, archived))
+    seq = max(start_seq, archived)
+    while end_seq is None or seq < end_seq:
+        stop = seq + LIVE_READ_BATCH if end_seq is None else min(seq + LIVE_READ_BATCH, end_seq)
+        records = store.read_seq_range(seq, stop)
+        if not records:
+            break
+        for record in records:
+            yield seq, record_timestamp_ms(record), record
+            seq += 1
+
+
+def read_history(store, archive):
+    """Every record of a session in order (archive first, then the live log)."""
+    return [record for _, _, record in iter_history(store, archive)]
+
+
+# --- Paged Queries ---
+
+def summarize_bucket(bucket_ms, records):
+    """One downsampled point: the most frequent label per field and the mean value."""
+    summary = {"time": datetime.fromtimestamp(bucket_ms / 1000).strftime(TIME_FORMAT)}
+    for field in EMOTION_FIELDS:
+        summary[field] = Counter(r.get(field) for r in records).most_common(1)[0][0]
+    summary["value"] = round(sum(r.get("value") or 0.0 for r in records) / len(records), 4)
+    summary["count"] = len(records)
+    return summary
+
+
+def query_history(store, archive, start_ms=None, end_ms=None, cursor=None,
+                  limit=None, resolution=None, tail=False):
+    """Return (records, next_cursor) for one page of a session's history.
+
+    start_ms/end_ms bound the time range (end exclusive). cursor is the next_cursor of a
+    previous page. With `resolution` (seconds) records are downsampled into buckets and
+    `limit` counts buckets; a bucket is never split across pages. With `tail` the page is
+    the last `limit` raw records of the range instead of the first.
+    """
+    limit = max(1, min(limit or DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE))
+    start_seq = 0 if start_ms is None else seq_for_time(store, archive, start_ms)
+    if cursor is not None:
+        start_seq = max(start_seq, cursor)
+    end_seq = store.seq_range()[1] if end_ms is None else seq_for_time(store, archive, end_ms)
+    if start_seq >= end_seq:
+        return [], None
+
+    if not resolution:
+        if tail:
+            start_seq = max(start_seq, end_seq - limit)
+        stop = min(end_seq, start_seq + limit)
+        records = [record for _, _, record in islice(iter_history(store, archive, start_seq, stop), limit)]
+        return records, (stop if stop < end_seq and not tail else None)
+
+    bucket_size = max(int(resolution * 1000), 1)
+    buckets = []
+    current_key = None
+    next_cursor = None
+    for seq, ts_ms, record in iter_history(store, archive, start_seq, end_seq):
+        key = ts_ms // bucket_size
+        if key != current_key:
+            if len(buckets) == limit:
+                next_cursor = seq
+                break
+            current_key = key
+            buckets.append((key * bucket_size, []))
+        buckets[-1][1].append(record)
+    return [summarize_bucket(start, records) for start, records in buckets], next_cursor
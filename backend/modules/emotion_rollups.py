@@ -0,0 +1,219 @@
+import json
+import logging
+import os
+import threading
+import traceback
+from datetime import datetime
+
+from modules.emotion_store import TIME_FORMAT, record_timestamp_ms
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# --- Rollup Configuration ---
+ROLLUP_VERSION = 1
+# Level -> (bucket size in seconds, retention in seconds)
+ROLLUP_LEVELS = {
+    "minute": (60, 2 * 24 * 3600),
+    "hour": (3600, 90 * 24 * 3600),
+    "day": (24 * 3600, 5 * 365 * 24 * 3600),
+}
+# A sample's emotion is assumed to last until the next sample, but no longer than this.
+# Fusion keeps a 30 s heartbeat while detection runs, so longer gaps mean detection was off.
+MAX_SAMPLE_GAP = 60.0
+DAY_MARGIN_MS = 12 * 3600 * 1000  # Past the next local midnight whatever the DST shift
+
+
+def bucket_start(level, ts_ms):
+    """Start (epoch ms) of the bucket containing ts_ms; day buckets start at local midnight."""
+    if level == "day":
+        midnight = datetime.fromtimestamp(ts_ms / 1000).replace(hour=0, minute=0, second=0, microsecond=0)
+        return int(midnight.timestamp() * 1000)
+    size_ms = ROLLUP_LEVELS[level][0] * 1000
+    return ts_ms - ts_ms % size_ms
+
+
+def bucket_end(level, start_ms):
+    """End (epoch ms) of the bucket starting at start_ms; local days last 23-25 hours across DST changes."""
+    size_ms = ROLLUP_LEVELS[level][0] * 1000
+    if level == "day":
+        return bucket_start(level, start_ms + size_ms + DAY_MARGIN_MS)
+    return start_ms + size_ms
+
+
+def new_bucket():
+    return {"seconds": {}, "samples": {}, "value_sum": 0.0, "count": 0}
+
+
+class EmotionRollups:
+    """Per-minute/hour/day aggregates of the fused emotion, updated as each sample is logged.
+
+    Each bucket holds the time spent in each final emotion, the number of samples per
+    emotion and the value sum. Buckets older than their level's retention are dropped.
+    The tables are saved as JSON together with the sequence number of the last sample
+    folded in; on load, samples logged after it (e.g. before a crash) are replayed from
+    the history, so the rollups never miss or double-count a sample.
+
+    Loading can take a while with a long history, so start_loading() does it on a
+    background thread; samples added meanwhile are queued and folded in once it is done,
+    so fusion never waits for the replay.
+    """
+
+    def __init__(self, path, history=None):
+        self.path = path
+        self.history = history  # start_seq -> iterable of (seq, ts_ms, record)
+        self.lock = threading.Lock()
+        self.levels = None
+        self.last = None  # {"seq", "ts", "emotion"} of the last sample folded in
+        self.dirty = False
+        self.pending_lock = threading.Lock()
+        self.pending = []     # (seq, record) added before loading finished
+        self.ready = False    # Loaded, with the pending samples folded in
+        self.loader = None
+
+    # --- Loading and Saving ---
+
+    def _ensure_loaded(self):
+        if self.levels is not None:
+            return
+        self.levels = {level: {} for level in ROLLUP_LEVELS}
+        if os.path.exists(self.path):
+            try:
+                with open(self.path, "r") as f:
+                    data = json.load(f)
+                for level, buckets in data.get("levels", {}).items():
+                    if level in self.levels:
+                        self.levels[level] = {int(start): bucket for start, bucket in buckets.items()}
+                self.last = data.get("last")
+            except Exception as e:
+                logger.error(f"Error reading {self.path}, rebuilding rollups: {str(e)}")
+                self.levels = {level: {} for level in ROLLUP_LEVELS}
+                self.last = None
+        if self.history is not None:
+            replayed = 0
+            for seq, ts_ms, record in self.history(self.last["seq"] + 1 if self.last else 0):
+                self._add_unlocked(seq, ts_ms, record)
+                replayed += 1
+            if replayed:
+                logger.info(f"Folded {replayed} logged samples into {self.path}")
+
+    def _load(self):
+        """Load and replay the tables, then fold in the samples queued meanwhile (idempotent)."""
+        if self.ready:
+            return
+        with self.lock:
+            self._ensure_loaded()
+            with self.pending_lock:
+                for seq, record in self.pending:
+                    self._add_unlocked(seq, record_timestamp_ms(record), record)
+                self.pending = []
+                self.ready = True
+
+    def _load_in_background(self):
+        try:
+            self._load()
+        except Exception as e:
+            logger.error(f"Error loading rollups {self.path}: {str(e)}")
+            logger.error(traceback.format_exc())
+
+    def start_loading(self):
+        """Load and replay the tables on a background thread (once)."""
+        with self.pending_lock:
+            if self.ready or self.loader is not None:
+                return
+            self.loader = threading.Thread(target=self._load_in_background, name="RollupsLoader", daemon=True)
+        self.loader.start()
+
+    def save(self):
+        """Write the tables if they changed since the last save (atomic replace)."""
+        with self.lock:
+            if not self.dirty:
+                return
+            data = {
+                "version": ROLLUP_VERSION,
+                "last": self.last,
+                "levels": {level: {str(start): bucket for start, bucket in buckets.items()}
+                           for level, buckets in self.levels.items()},
+            }
+            self.dirty = False
+        try:
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(data, f, separators=(",", ":"))
+            os.replace(tmp_path, self.path)
+        except Exception as e:
+            self.dirty = True
+            logger.error(f"Error saving {self.path}: {str(e)}")
+            logger.error(traceback.format_exc())
+
+    # --- Updating ---
+
+    def _attribute(self, emotion, start_ms, stop_ms):
+        """Add the interval [start_ms, stop_ms) spent in `emotion`, split across bucket boundaries."""
+        for level, buckets in self.levels.items():
+            t = start_ms
+            while t < stop_ms:
+                start = bucket_start(level, t)
+                end = bucket_end(level, start)
+                assert end > t, f"{level} bucket at {start} ends at {end}, before {t}"
+                end = min(stop_ms, end)
+                bucket = buckets.setdefault(start, new_bucket())
+                bucket["seconds"][emotion] = round(bucket["seconds"].get(emotion, 0.0) + (end - t) / 1000, 3)
+                t = end
+
+    def _add_unlocked(self, seq, ts_ms, record):
+        if self.last is not None and seq <= self.last["seq"]:
+            return
+        emotion = record.get("final_emotion", "Unknown")
+        if self.last is not None and ts_ms > self.last["ts"]:
+            gap_ms = min(ts_ms - self.last["ts"], int(MAX_SAMPLE_GAP * 1000))
+            self._attribute(self.last["emotion"], self.last["ts"], self.last["ts"] + gap_ms)
+        for level, buckets in self.levels.items():
+            bucket = buckets.setdefault(bucket_start(level, ts_ms), new_bucket())
+            bucket["samples"][emotion] = bucket["samples"].get(emotion, 0) + 1
+            bucket["value_sum"] += record.get("value") or 0.0
+            bucket["count"] += 1
+            # Retention: buckets are created in time order, so the oldest come first
+            horizon = ts_ms - ROLLUP_LEVELS[level][1] * 1000
+            while buckets:
+                oldest = next(iter(buckets))
+                if oldest >= horizon:
+                    break
+                del buckets[oldest]
+        self.last = {"seq": seq, "ts": ts_ms, "emotion": emotion}
+        self.dirty = True
+
+    def add(self, seq, record):
+        """Fold one fused sample (as appended to the emotion log under `seq`) into every level."""
+        with self.pending_lock:
+            queued = not self.ready
+            if queued:
+                self.pending.append((seq, record))
+        if queued:
+            self.start_loading()  # No-op once started
+            return
+        with self.lock:
+            self._add_unlocked(seq, record_timestamp_ms(record), record)
+
+    # --- Reading ---
+
+    def query(self, level, start_ms=None, end_ms=None):
+        """Buckets of `level` that start in [start_ms, end_ms), oldest first."""
+        if level not in ROLLUP_LEVELS:
+            raise ValueError(f"Unknown rollup level '{level}': use one of {', '.join(ROLLUP_LEVELS)}")
+        self._load()
+        with self.lock:
+            rows = []
+            for start, bucket in self.levels[level].items():
+                if start_ms is not None and start < bucket_start(level, start_ms):
+                    continue
+                if end_ms is not None and start >= end_ms:
+                    continue
+                rows.append({
+                    "start": datetime.fromtimestamp(start / 1000).strftime(TIME_FORMAT),
+                    "seconds": dict(bucket["seconds"]),
+                    "samples": dict(bucket["samples"]),
+                    "mean_value": round(bucket["value_sum"] / bucket["count"], 4) if bucket["count"] else None,
+                    "count": bucket["count"],
+                })
+            return rows
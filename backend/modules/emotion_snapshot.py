@@ -0,0 +1,47 @@
+import logging
+import threading
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+
+class EmotionSnapshot:
+    """Process-wide cache of the latest fused emotion record.
+
+    The combiner calls update() after every fusion; API reads are O(1) and never touch
+    the disk. The version counter increases by one on every update, so clients can tell
+    whether anything changed since their last read.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self._version = 0
+        self._data = None
+
+    def seed(self, record):
+        """Load the last persisted record at startup without bumping the version."""
+        with self.lock:
+            if self._data is None and record is not None:
+                self._data = record
+                logger.info("Emotion snapshot seeded from the emotion log")
+
+    def update(self, record):
+        """Replace the cached record and return the new version."""
+        with self.lock:
+            self._version += 1
+            self._data = record
+            return self._version
+
+    def get(self):
+        """Return (version, record); record is None until the first fusion or seed."""
+        with self.lock:
+            return self._version, self._data
+
+    @property
+    def version(self):
+        with self.lock:
+            return self._version
+
+
+# Process-wide snapshot updated by the combiner and read by the API
+emotion_snapshot = EmotionSnapshot()
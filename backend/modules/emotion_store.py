@@ -0,0 +1,344 @@
+import json
+import logging
+import os
+import struct
+import threading
+import traceback
+from datetime import datetime
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# --- On-disk Format ---
+# The log is newline-delimited JSON: one fused record per line, appended and never rewritten.
+# A sidecar index holds a fixed-size entry per record (byte offset, timestamp in ms) behind a
+# small header, so the latest record and time ranges can be found without scanning the log.
+INDEX_MAGIC = b"EMIX"
+INDEX_VERSION = 1
+INDEX_HEADER = struct.Struct("<4sIQ")  # magic, version, base sequence number
+INDEX_ENTRY = struct.Struct("<qq")     # byte offset in the log, timestamp (epoch ms)
+
+TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+FSYNC_WRITES = os.environ.get("EMOTION_LOG_FSYNC", "0") == "1"
+
+
+def record_timestamp_ms(record):
+    """Return the epoch-millisecond timestamp of a record's "time" field (0 if missing)."""
+    try:
+        return int(datetime.strptime(record["time"], TIME_FORMAT).timestamp() * 1000)
+    except Exception:
+        return 0
+
+
+class EmotionLogStore:
+    """Append-only emotion log with an offset/timestamp index.
+
+    Appends cost O(1) regardless of history length. A crash can at worst leave a torn
+    final line or a short index, both of which are repaired the next time the store opens.
+    Every record has a sequence number that survives compaction: the index header holds
+    the sequence number of the first record still in the log (see drop_before).
+    """
+
+    def __init__(self, path, legacy_path=None, fsync=FSYNC_WRITES):
+        self.path = path
+        self.index_path = path + ".idx"
+        self.legacy_path = legacy_path
+        self.fsync = fsync
+        self.lock = threading.Lock()
+        self._log = None
+        self._index = None
+        self._size = 0
+        self._count = 0
+        self._base_seq = 0
+
+    # --- Opening and Recovery ---
+
+    def _ensure_open(self):
+        if self._log is not None:
+            return
+        migrate = (self.legacy_path and os.path.exists(self.legacy_path)
+                   and not os.path.exists(self.path))
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        if self._finish_drop():
+            logger.info(f"Completed interrupted compaction of {self.path}")
+        self._log = open(self.path, "ab")
+        self._repair_log_tail()
+        self._open_index()
+        if migrate:
+            self._migrate_legacy()
+
+    def _repair_log_tail(self):
+        """Drop a torn final line left behind by a crash mid-append."""
+        size = os.path.getsize(self.path)
+        if size == 0:
+            self._size = 0
+            return
+        with open(self.path, "rb") as f:
+            f.seek(size - 1)
+            if f.read(1) == b"\n":
+                self._size = size
+                return
+            pos = size
+            keep = 0
+            while pos > 0:
+                step = min(4096, pos)
+                pos -= step
+                f.seek(pos)
+                chunk = f.read(step)
+                newline = chunk.rfind(b"\n")
+                if newline != -1:
+                    keep = pos + newline + 1
+                    break
+        logger.warning(f"Truncating torn record at end of {self.path} ({size - keep} bytes)")
+        self._log.truncate(keep)
+        self._size = keep
+
+    def _open_index(self):
+        valid = False
+        if os.path.exists(self.index_path) and os.path.getsize(self.index_path) >= INDEX_HEADER.size:
+            with open(self.index_path, "rb") as f:
+                magic, version, base_seq = INDEX_HEADER.unpack(f.read(INDEX_HEADER.size))
+            valid = magic == INDEX_MAGIC and version == INDEX_VERSION
+        if not valid:
+            self._rebuild_index()
+            return
+
+        self._base_seq = base_seq
+        self._index = open(self.index_path, "r+b")
+        entries = (os.path.getsize(self.index_path) - INDEX_HEADER.size) // INDEX_ENTRY.size
+        # Drop a partial trailing entry and any entries pointing past the (repaired) log end
+        while entries > 0 and self._read_index_entry(entries - 1)[0] >= self._size:
+            entries -= 1
+        self._index.truncate(INDEX_HEADER.size + entries * INDEX_ENTRY.size)
+        self._index.seek(0, os.SEEK_END)
+        self._count = entries
+
+        # Index records that reached the log but not the index before a crash
+        scan_from = 0
+        if entries:
+            scan_from = self._line_end(self._read_index_entry(entries - 1)[0])
+        if scan_from < self._size:
+            self._index_range(scan_from)
+
+    def _rebuild_index(self):
+        if self._size:
+            logger.info(f"Rebuilding index for {self.path}")
+        self._index = open(self.index_path, "w+b")
+        self._index.write(INDEX_HEADER.pack(INDEX_MAGIC, INDEX_VERSION, self._base_seq))
+        self._count = 0
+        self._index_range(0)
+
+    def _index_range(self, start):
+        """Append index entries for every complete line in the log from byte `start`."""
+        with open(self.path, "rb") as f:
+            f.seek(start)
+            offset = start
+            for line in f:
+                if offset + len(line) > self._size:
+                    break
+                try:
+                    ts_ms = record_timestamp_ms(json.loads(line))
+                except Exception:
+                    ts_ms = 0
+                self._index.write(INDEX_ENTRY.pack(offset, ts_ms))
+                self._count += 1
+                offset += len(line)
+        self._index.flush()
+
+    def _migrate_legacy(self):
+        """Import the records of a legacy whole-file JSON log, then set the old file aside."""
+        try:
+            with open(self.legacy_path, "r") as f:
+                data = json.load(f)
+            for record in data:
+                self._append_unlocked(record)
+            self._sync()
+            os.replace(self.legacy_path, self.legacy_path + ".migrated")
+            logger.info(f"Migrated {len(data)} records from {self.legacy_path} to {self.path}")
+        except Exception as e:
+            logger.error(f"Error migrating {self.legacy_path}: {str(e)}")
+            logger.error(traceback.format_exc())
+
+    def _finish_drop(self):
+        """Roll a committed drop_before forward (returns True), or discard one that never committed."""
+        next_log = self.path + ".next"
+        next_index = self.index_path + ".next"
+        if os.path.exists(next_log):
+            if os.path.exists(next_index):
+                os.replace(next_index, self.index_path)
+            os.replace(next_log, self.path)
+            return True
+        for leftover in (next_index, self.path + ".tmp"):
+            if os.path.exists(leftover):
+                os.remove(leftover)
+        return False
+
+    def _read_index_entry(self, i):
+        self._index.seek(INDEX_HEADER.size + i * INDEX_ENTRY.size)
+        entry = INDEX_ENTRY.unpack(self._index.read(INDEX_ENTRY.size))
+        self._index.seek(0, os.SEEK_END)
+        return entry
+
+    def _line_end(self, offset):
+        with open(self.path, "rb") as f:
+            f.seek(offset)
+            return offset + len(f.readline())
+
+    # --- Writing ---
+
+    def _append_unlocked(self, record):
+        data = (json.dumps(record, separators=(",", ":")) + "\n").encode("utf-8")
+        offset = self._size
+        # Log first, index second: a crash in between is repaired by _open_index
+        self._log.write(data)
+        self._log.flush()
+        self._size += len(data)
+        self._index.write(INDEX_ENTRY.pack(offset, record_timestamp_ms(record)))
+        self._index.flush()
+        self._count += 1
+
+    def _sync(self):
+        os.fsync(self._log.fileno())
+        os.fsync(self._index.fileno())
+
+    def drop_before(self, seq):
+        """Remove every record numbered below `seq` (already archived elsewhere).
+
+        The remaining tail is copied to new files which replace the old ones. Renaming the
+        new log to <path>.next is the commit point; _finish_drop completes or discards an
+        interrupted drop when the store next opens. Returns the number of records removed.
+        """
+        with self.lock:
+            self._ensure_open()
+            skip = min(seq - self._base_seq, self._count)
+            if skip <= 0:
+                return 0
+            cut = self._read_index_entry(skip)[0] if skip < self._count else self._size
+
+            self._index.seek(INDEX_HEADER.size + skip * INDEX_ENTRY.size)
+            tail = self._index.read((self._count - skip) * INDEX_ENTRY.size)
+            self._index.seek(0, os.SEEK_END)
+            with open(self.index_path + ".next", "wb") as f:
+                f.write(INDEX_HEADER.pack(INDEX_MAGIC, INDEX_VERSION, self._base_seq + skip))
+                for offset, ts_ms in INDEX_ENTRY.iter_unpack(tail):
+                    f.write(INDEX_ENTRY.pack(offset - cut, ts_ms))
+                f.flush()
+                os.fsync(f.fileno())
+
+            with open(self.path, "rb") as src, open(self.path + ".tmp", "wb") as dst:
+                src.seek(cut)
+                remaining = self._size - cut
+                while remaining > 0:
+                    chunk = src.read(min(1 << 20, remaining))
+                    if not chunk:
+                        break
+                    dst.write(chunk)
+                    remaining -= len(chunk)
+                dst.flush()
+                os.fsync(dst.fileno())
+            os.replace(self.path + ".tmp", self.path + ".next")
+
+            self._log.close()
+            self._index.close()
+            self._log = None
+            self._index = None
+            self._finish_drop()
+            self._ensure_open()
+            logger.info(f"Dropped {skip} archived records from {self.path}")
+            return skip
+
+    def append(self, record):
+        """Append one record and return its sequence number. Cost is independent of history length."""
+        with self.lock:
+            self._ensure_open()
+            seq = self._base_seq + self._count
+            self._append_unlocked(record)
+            if self.fsync:
+                self._sync()
+            return seq
+
+    # --- Reading ---
+
+    def count(self):
+        with self.lock:
+            self._ensure_open()
+            return self._count
+
+    def seq_range(self):
+        """Return (first, end) sequence numbers of the records currently in the log."""
+        with self.lock:
+            self._ensure_open()
+            return self._base_seq, self._base_seq + self._count
+
+    def seq_for_time(self, ts_ms):
+        """Sequence number of the first live record at or after ts_ms (binary search over the index)."""
+        with self.lock:
+            self._ensure_open()
+            lo, hi = 0, self._count
+            while lo < hi:
+                mid = (lo + hi) // 2
+                if self._read_index_entry(mid)[1] < ts_ms:
+                    lo = mid + 1
+                else:
+                    hi = mid
+            return self._base_seq + lo
+
+    def read_latest(self):
+        """Return the most recent record, or None if the log is empty."""
+        with self.lock:
+            self._ensure_open()
+            if self._count == 0:
+                return None
+            offset, _ = self._read_index_entry(self._count - 1)
+            end = self._size
+            # Opened under the lock so a concurrent drop_before can't swap the file underneath
+            f = open(self.path, "rb")
+        with f:
+            f.seek(offset)
+            return json.loads(f.read(end - offset))
+
+    def read_all(self):
+        """Return every record in append order."""
+        return self.read_seq_range(0)
+
+    def read_seq_range(self, start_seq, end_seq=None):
+        """Return the records numbered start_seq (inclusive) to end_seq (exclusive) still in the log."""
+        with self.lock:
+            self._ensure_open()
+            first = max(start_seq - self._base_seq, 0)
+            last = self._count if end_seq is None else min(end_seq - self._base_seq, self._count)
+            if first >= last:
+                return []
+            start = self._read_index_entry(first)[0]
+            end = self._read_index_entry(last)[0] if last < self._count else self._size
+            f = open(self.path, "rb")
+        records = []
+        with f:
+            f.seek(start)
+            offset = start
+            for line in f:
+                offset += len(line)
+                if offset > end:
+                    break
+                try:
+                    records.append(json.loads(line))
+                except Exception:
+                    logger.warning(f"Skipping unreadable record in {self.path}")
+        return records
+
+    def close(self):
+        with self.lock:
+            for handle in (self._log, self._index):
+                if handle is not None:
+                    try:
+                        handle.close()
+                    except Exception as e:
+                        logger.error(f"Error closing {self.path}: {str(e)}")
+            self._log = None
+            self._index = None
+
+
+# Process-wide store used by the combiner and the API
+emotion_log = EmotionLogStore("emotion_log.jsonl", legacy_path="emotion_log.json")
@@ -0,0 +1,121 @@
+import asyncio
+import json
+import logging
+import threading
+from collections import deque
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# --- Stream Configuration ---
+STREAM_HISTORY_LENGTH = 256   # Recent events kept for resume-from-version
+SUBSCRIBER_QUEUE_SIZE = 16    # Per-subscriber backlog before the oldest event is dropped
+HEARTBEAT_INTERVAL = 15.0     # Seconds between keepalives on an idle stream
+
+# Fields compared to decide whether a fused record is worth pushing
+CHANGE_FIELDS = ("final_emotion", "facial_emotion", "voice_emotion", "interaction_emotion")
+
+
+def encode_event(event):
+    """Serialize an event as compact JSON."""
+    return json.dumps(event, separators=(",", ":"))
+
+
+class Subscription:
+    """One subscriber's view of the hub, bound to the asyncio loop that consumes it."""
+
+    def __init__(self, hub, loop):
+        self.hub = hub
+        self.loop = loop
+        self.queue = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        self.dropped = 0
+
+    def _deliver(self, event):
+        # Every event carries the full current state, so a slow client only needs the newest
+        if self.queue.full():
+            self.queue.get_nowait()
+            self.dropped += 1
+        self.queue.put_nowait(event)
+
+    def push(self, event):
+        """Thread-safe hand-off from the publishing thread to the subscriber's loop."""
+        try:
+            self.loop.call_soon_threadsafe(self._deliver, event)
+        except RuntimeError:
+            # Loop already closed; the subscriber is gone
+            self.hub.unsubscribe(self)
+
+    async def next_event(self, timeout=HEARTBEAT_INTERVAL):
+        """Wait for the next event; returns None when it's time for a heartbeat."""
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    def close(self):
+        self.hub.unsubscribe(self)
+
+
+class EmotionHub:
+    """Fan-out hub: one fusion result is published once and delivered to every subscriber.
+
+    Only records whose combined or per-modality emotion differs from the previous event are
+    published. Recent events are retained so reconnecting clients can resume from a version.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.history = deque(maxlen=STREAM_HISTORY_LENGTH)
+        self.subscribers = set()
+
+    def publish(self, version, record):
+        """Publish a fused record; returns True if it changed state and was sent."""
+        if record is None:
+            return False
+        with self.lock:
+            last = self.history[-1] if self.history else None
+            if last is not None and all(last.get(k) == record.get(k) for k in CHANGE_FIELDS):
+                return False
+            event = dict(record, version=version)
+            self.history.append(event)
+            subscribers = list(self.subscribers)
+        for subscription in subscribers:
+            subscription.push(event)
+        return True
+
+    def subscribe(self, since=None, current=None):
+        """Register a subscriber on the running loop and queue its starting events.
+
+        With `since`, every retained event newer than that version is replayed. If `since`
+        is missing or older than the retained history, the client gets the current state.
+        """
+        subscription = Subscription(self, asyncio.get_running_loop())
+        with self.lock:
+            backlog = []
+            resumable = (since is not None and self.history
+                         and since <= self.history[-1]["version"]
+                         and (len(self.history) < self.history.maxlen or since >= self.history[0]["version"]))
+            if resumable:
+                backlog = [e for e in self.history if e["version"] > since]
+            elif self.history:
+                backlog = [self.history[-1]]
+            elif current is not None:
+                backlog = [current]
+            self.subscribers.add(subscription)
+        for event in backlog[-SUBSCRIBER_QUEUE_SIZE:]:
+            subscription._deliver(event)
+        logger.info(f"Emotion stream subscriber added ({len(self.subscribers)} active)")
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self.lock:
+            self.subscribers.discard(subscription)
+        logger.info(f"Emotion stream subscriber removed ({len(self.subscribers)} active)")
+
+    def subscriber_count(self):
+        with self.lock:
+            return len(self.subscribers)
+
+
+# Process-wide hub fed by the combiner and consumed by the SSE/WebSocket routes
+emotion_hub = EmotionHub()
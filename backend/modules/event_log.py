@@ -0,0 +1,150 @@
+import atexit
+import csv
+import logging
+import os
+import queue
+import threading
+import time
+import traceback
+
+from modules.metrics import CSV_ROWS, track_queue
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# --- Sink Configuration ---
+# Union of the columns written by the facial, speech and mouse detectors
+CSV_FIELDS = ["timestamp", "emotion", "text", "pitch", "pitch_std", "zcr", "source"]
+
+EVENT_QUEUE_SIZE = int(os.environ.get("EMOTION_CSV_QUEUE_SIZE", 10000))   # Rows buffered in memory at most
+FLUSH_BATCH_SIZE = int(os.environ.get("EMOTION_CSV_BATCH_SIZE", 64))      # Flush once this many rows are waiting
+FLUSH_INTERVAL = float(os.environ.get("EMOTION_CSV_FLUSH_INTERVAL", 1.0))  # ...or once the oldest row is this old
+# "never": leave durability to the OS, "batch": fsync after each batch, "always": fsync after every row
+FSYNC_POLICY = os.environ.get("EMOTION_CSV_FSYNC", "batch")
+
+
+class CsvEventSink:
+    """Shared, non-blocking CSV writer for detector transitions.
+
+    Detectors call write(), which only enqueues the row; a background flusher groups rows
+    by file and appends them in batches. When the queue is full, rows are dropped and
+    counted rather than stalling the detector thread.
+    """
+
+    def __init__(self, maxsize=EVENT_QUEUE_SIZE, batch_size=FLUSH_BATCH_SIZE,
+                 flush_interval=FLUSH_INTERVAL, fsync_policy=FSYNC_POLICY):
+        self.queue = queue.Queue(maxsize=maxsize)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.fsync_policy = fsync_policy
+        self.fieldnames = {}  # path -> columns of that file's header
+        self.dropped = 0
+        self.written = 0
+        self.lock = threading.Lock()
+        self.write_lock = threading.Lock()  # Serializes the flusher thread and flush()
+        self.flusher = None
+
+    # --- Producer Side ---
+
+    def write(self, path, row):
+        """Queue one row for `path`; returns False if it had to be dropped."""
+        self._ensure_flusher()
+        try:
+            self.queue.put_nowait((path, row))
+            return True
+        except queue.Full:
+            self.dropped += 1
+            CSV_ROWS.labels("dropped").inc()
+            if self.dropped % 1000 == 1:
+                logger.warning(f"Emotion CSV queue full; {self.dropped} rows dropped so far")
+            return False
+
+    def write_many(self, path, rows):
+        for row in rows:
+            self.write(path, row)
+
+    def depth(self):
+        return self.queue.qsize()
+
+    # --- Flusher ---
+
+    def _ensure_flusher(self):
+        if self.flusher is not None:
+            return
+        with self.lock:
+            if self.flusher is None:
+                self.flusher = threading.Thread(target=self._flush_loop, name="CsvEventSink", daemon=True)
+                self.flusher.start()
+
+    def _flush_loop(self):
+        while True:
+            batch = [self.queue.get()]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self.queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._write_batch(batch)
+
+    def _columns_for(self, path):
+        """Columns for `path`: the existing header if the file has one, else CSV_FIELDS."""
+        if path not in self.fieldnames:
+            columns = CSV_FIELDS
+            if os.path.exists(path) and os.path.getsize(path) > 0:
+                with open(path, newline="") as f:
+                    header = next(csv.reader(f), None)
+                if header:
+                    columns = header
+            self.fieldnames[path] = columns
+        return self.fieldnames[path]
+
+    def _write_batch(self, batch):
+        by_path = {}
+        for path, row in batch:
+            by_path.setdefault(path, []).append(row)
+        with self.write_lock:
+            for path, rows in by_path.items():
+                self._write_rows(path, rows)
+
+    def _write_rows(self, path, rows):
+        try:
+            columns = self._columns_for(path)
+            new_file = not os.path.exists(path) or os.path.getsize(path) == 0
+            with open(path, "a", newline="") as f:
+                writer = csv.DictWriter(f, fieldnames=columns, extrasaction="ignore")
+                if new_file:
+                    writer.writeheader()
+                for row in rows:
+                    writer.writerow(row)
+                    if self.fsync_policy == "always":
+                        f.flush()
+                        os.fsync(f.fileno())
+                if self.fsync_policy == "batch":
+                    f.flush()
+                    os.fsync(f.fileno())
+            self.written += len(rows)
+            CSV_ROWS.labels("written").inc(len(rows))
+        except Exception as e:
+            logger.error(f"Error writing {len(rows)} rows to {path}: {str(e)}")
+            logger.error(traceback.format_exc())
+
+    def flush(self):
+        """Synchronously write everything queued so far (used at shutdown)."""
+        batch = []
+        while True:
+            try:
+                batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        if batch:
+            self._write_batch(batch)
+
+
+# Process-wide sink shared by all detectors
+event_sink = CsvEventSink()
+track_queue("csv_events", event_sink.depth)
+atexit.register(event_sink.flush)
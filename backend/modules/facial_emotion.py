@@ -1,15 +1,26 @@
 import cv2
 import mediapipe as mp
 import numpy as np
-from deepface import DeepFace
 import time
-import pandas as pd
-from datetime import datetime
 import threading
+from datetime import datetime
 import logging
 import os
 from collections import deque
 import traceback
+from modules.emotion_events import emotion_changes, publish_change
+from modules.event_log import event_sink
+from modules.emotion_codes import emotion_index  # Emotion index mapping, shared with the history archive
+from modules.metrics import FACEMESH_SKIPPED, FRAMES, FRAMES_DROPPED, MOTION_GATE_CHECKS, STAGE_SECONDS
+from modules.sensor_sources import FACIAL_SOURCE, REMOTE_SOURCES
+from modules.clock import system_clock
+from modules.deepface_worker import DeepFaceWorker
+from modules.camera_manager import camera_manager
+from modules.frame_governor import LANDMARK_MOTION_THRESHOLD, FrameRateGovernor, landmark_motion
+from modules.landmark_batch import parse_landmark_batch
+from modules.landmark_classifier import get_landmark_classifier
+from modules.onnx_emotion import get_onnx_emotion_model
+from modules.motion_gate import MOTION_GATE, MotionGate
 
 # Suppress TensorFlow warnings
 os.environ['TF_ENABLE_ONEDNN_OPTS'] = '0'
@@ -19,18 +30,35 @@ logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(
 logger = logging.getLogger(__name__)
 
 # --- Shared State and Constants ---
-STATE = {
-    "running": False,
-    "last_emotion": "Engaged",
-    "lock": threading.Lock(),
-    "log_data": [],
-    "emotion_history": deque(maxlen=15),  # Aligned with mouse_emotion.py for smoothing
-    "camera_available": False,
-    "last_camera_check": 0
-}
-
-# Emotion index mapping (keep as is)
-emotion_index = {"Engaged": 0, "Confused": 1, "Frustrated": 2, "Bored": 3, "Sleepy": 4, "Unknown": 5}
+def new_state(log_path="emotion_log.csv", notifier=emotion_changes, source=None, clock=None):
+    """Create an independent facial detector state (one per learner session).
+
+    `source` is a frame source spec (see modules/sensor_sources.py); defaults to FACIAL_SOURCE.
+    `clock` times the detection rules (see modules/clock.py); defaults to the system clock.
+    """
+    return {
+        "running": False,
+        "last_emotion": "Engaged",
+        "lock": threading.Lock(),
+        "log_data": [],
+        "emotion_history": deque(maxlen=15),  # Aligned with mouse_emotion.py for smoothing
+        "source": source or FACIAL_SOURCE,
+        "cap": None,
+        "face_mesh": None,
+        "log_path": log_path,
+        "changes": notifier,
+        "clock": clock or system_clock,
+        "deepface": None,  # DeepFaceWorker while the detection loop runs asynchronously
+        "frame_rate": None,  # Frames per second the governor currently allows (None when not running)
+        "remote_tracker": None,  # Frame tracker of posted landmarks or frames (FACIAL_SOURCE=browser/upload)
+        "remote_lock": threading.Lock(),  # Serializes classification of posted landmarks and frames
+        "upload": None,  # Per-session slot of the frame upload service (see modules/frame_upload.py)
+        "worker": None,
+        "thread": None  # Thread running facial_emotion_loop; only it may run the loop
+    }
+
+# State of the default (single-learner) session
+STATE = new_state()
 
 # Constants for emotion detection thresholds (tuned for less sensitivity)
 FRUSTRATION_PROB_THRESHOLD = 0.40  # Increased from 0.35 to 0.40 for even less sensitivity
@@ -43,161 +71,249 @@ NO_FACE_DURATION_BORED = 4.0      # Increased from 3.0 to 4.0 seconds for 'Bored
 GAZE_AWAY_THRESHOLD = 45          # Increased from 30 for less sensitivity to gaze shifts
 HEAD_TILT_THRESHOLD = 0.12        # Increased from 0.1 for less sensitivity to head tilts
 EMOTION_LOCK_DURATION = 5         # Aligned with previous update for stability
-CAMERA_RETRY_INTERVAL = 10        # Retry camera access every 10 seconds
+
+# DeepFace runs in its own thread on the newest frame, so landmark rules keep camera rate
+DEEPFACE_ASYNC = os.environ.get("DEEPFACE_ASYNC", "1") == "1"
+DEEPFACE_MAX_RATE = float(os.environ.get("DEEPFACE_MAX_RATE", 4.0))              # Analyses per second
+DEEPFACE_MAX_RESULT_AGE = float(os.environ.get("DEEPFACE_MAX_RESULT_AGE", 1.5))  # Seconds a result stays usable
+# Send DeepFace only the aligned face found by FaceMesh (its own detector is skipped)
+DEEPFACE_FACE_CROP = os.environ.get("DEEPFACE_FACE_CROP", "1") == "1"
+FACE_ROI_MARGIN = 0.15  # Extra context around the landmark bounding box, per side
+FACE_ROI_SIZE = 224     # Largest side of the crop handed to DeepFace (it downsizes further itself)
+# "deepface" (DeepFace only), "landmarks" (landmark classifier only, see modules/landmark_classifier.py)
+# or "hybrid" (the classifier, with DeepFace consulted when it is unsure)
+FACIAL_CLASSIFIER = os.environ.get("FACIAL_CLASSIFIER", "deepface")
+FAST_PATH_MIN_CONFIDENCE = float(os.environ.get("FAST_PATH_MIN_CONFIDENCE", 0.6))  # Hybrid: lower confidence asks DeepFace
+# Posted landmarks and frames calibrate the neutral eye level on their first face frames (like calibrate())
+LANDMARK_CALIBRATION_FRAMES = 50
+LANDMARK_STALE_SECONDS = 5.0  # Without a post for this long the client's camera is reported unavailable
+LOOP_STOP_TIMEOUT = 6.0  # Seconds stop waits for the loop thread to exit (outlasts its 5 s camera retry)
+
+# Expression model behind run_deepface on face crops: "deepface" (TensorFlow) or "onnx" (onnxruntime CPU,
+# see modules/onnx_emotion.py). Full frames, which need DeepFace's face detector, always use DeepFace.
+EMOTION_MODEL_BACKEND = os.environ.get("EMOTION_MODEL_BACKEND", "deepface")
+
+# Per-stage timers and frame counters (see modules/metrics.py)
+CAPTURE_SECONDS = STAGE_SECONDS.labels("facial", "capture")
+LATENCY_SECONDS = STAGE_SECONDS.labels("facial", "capture_to_result")  # Frame grab until its analysis is done
+FACE_MESH_SECONDS = STAGE_SECONDS.labels("facial", "face_mesh")
+MOTION_GATE_SECONDS = STAGE_SECONDS.labels("facial", "motion_gate")
+DEEPFACE_SECONDS = STAGE_SECONDS.labels("facial", "deepface")
+DEEPFACE_BATCH_SECONDS = STAGE_SECONDS.labels("facial", "deepface_batch")  # One DeepFace call on several face crops
+ONNX_EMOTION_SECONDS = STAGE_SECONDS.labels("facial", "onnx_emotion")  # One ONNX model call (one or more face crops)
+LANDMARK_CLASSIFIER_SECONDS = STAGE_SECONDS.labels("facial", "landmark_classifier")
+FAST_PATH_FRAMES = FRAMES.labels("facial_fast_path")  # Frames the landmark classifier decided without DeepFace
+FRAME_SECONDS = STAGE_SECONDS.labels("facial", "frame")
+LANDMARK_BATCH_SECONDS = STAGE_SECONDS.labels("facial", "landmark_batch")  # Parsing and classifying one posted batch
+FACIAL_FRAMES = FRAMES.labels("facial")
+
+# "thread" runs the loop inside the API process; "process" runs it in a supervised worker process
+FACIAL_DETECTOR_MODE = os.environ.get("FACIAL_DETECTOR_MODE", "thread")
+
+# DeepFace imports TensorFlow, which takes seconds and hundreds of MB: only load it when it is used
+DeepFace = None
+
+def load_deepface():
+    """The DeepFace module, imported on first use."""
+    global DeepFace
+    if DeepFace is None:
+        from deepface import DeepFace as deepface_module
+        DeepFace = deepface_module
+    return DeepFace
 
 # --- MediaPipe Setup ---
 mp_face_mesh = mp.solutions.face_mesh
-face_mesh = mp_face_mesh.FaceMesh(
-    max_num_faces=1,
-    min_detection_confidence=0.7  # Increased detection confidence
-)
-cap = None
+
+def create_face_mesh():
+    """Create a FaceMesh instance; each running detector owns one since they keep tracking state."""
+    return mp_face_mesh.FaceMesh(
+        max_num_faces=1,
+        min_detection_confidence=0.7  # Increased detection confidence
+    )
+
+def close_face_mesh(state):
+    """Close and forget the detector's FaceMesh instance."""
+    if state["face_mesh"] is not None:
+        try:
+            state["face_mesh"].close()
+            logger.info("MediaPipe FaceMesh closed.")
+        except Exception as e:
+            logger.error(f"Error closing FaceMesh: {str(e)}")
+        state["face_mesh"] = None
 
 # --- Camera Management Functions ---
 
-def check_camera_availability():
-    """Check if camera is available without blocking other processes."""
-    global cap
+def check_camera_availability(source=None):
+    """Check if camera (or the configured frame source) is available without blocking other processes.
+
+    Answered by the camera manager: from the health of the open device if someone is using it,
+    otherwise from a probe cached for a few seconds.
+    """
     try:
-        # Only check camera availability every 10 seconds to reduce conflicts
-        current_time = time.time()
-        if current_time - STATE["last_camera_check"] < CAMERA_RETRY_INTERVAL:
-            return STATE["camera_available"]
-        
-        STATE["last_camera_check"] = current_time
-        
-        # Try to open camera briefly
-        test_cap = cv2.VideoCapture(0)
-        if test_cap.isOpened():
-            ret, frame = test_cap.read()
-            test_cap.release()
-            if ret:
-                STATE["camera_available"] = True
-                return True
-            else:
-                STATE["camera_available"] = False
-                return False
-        else:
-            STATE["camera_available"] = False
-            return False
+        return camera_manager.available(source or FACIAL_SOURCE)
     except Exception as e:
         logger.debug(f"Camera availability check failed: {str(e)}")
-        STATE["camera_available"] = False
         return False
 
-def safe_camera_release():
+def camera_status(state=STATE):
+    """Camera health for the status routes, without reopening a device that is in use."""
+    if state["source"] in REMOTE_SOURCES:
+        # The camera is the learner's: "available" means landmarks or frames are arriving
+        tracker = state["remote_tracker"]
+        age = None if tracker is None or tracker["received_at"] is None else time.monotonic() - tracker["received_at"]
+        return {"source": state["source"], "available": age is not None and age < LANDMARK_STALE_SECONDS,
+                "open": False, "users": None, "last_frame_age": round(age, 3) if age is not None else None,
+                "last_error": None}
+    worker = state["worker"]
+    if worker is not None and worker.running:
+        # The worker process owns the camera; its liveness and frame rate stand in for device health
+        alive = worker.is_alive()
+        return {"source": state["source"], "available": alive and state["frame_rate"] is not None,
+                "open": alive, "users": None, "last_frame_age": None, "last_error": None}
+    status = camera_manager.status(state["source"])
+    status["available"] = check_camera_availability(state["source"])
+    return status
+
+def safe_camera_release(state=STATE):
     """Safely release camera resources."""
-    global cap
-    if cap is not None:
+    if state["cap"] is not None:
         try:
-            cap.release()
-            cap = None
+            state["cap"].release()
+            state["cap"] = None
         except Exception as e:
             logger.debug(f"Error releasing camera: {str(e)}")
 
 # --- Facial Metric Calculation Functions ---
-
-def calculate_ear(points, landmarks, w, h):
-    """Calculate Eye Aspect Ratio (EAR) for an eye."""
-    try:
-        coords = [(int(landmarks.landmark[p].x * w), int(landmarks.landmark[p].y * h)) for p in points]
-        A = np.linalg.norm(np.array(coords[1]) - np.array(coords[5]))
-        B = np.linalg.norm(np.array(coords[2]) - np.array(coords[4]))
-        C = np.linalg.norm(np.array(coords[0]) - np.array(coords[3]))
-        return (A + B) / (2.0 * C) if C != 0 else 0
-    except Exception as e:
-        logger.error(f"Error calculating EAR: {str(e)}")
-        logger.debug(traceback.format_exc())
-        return 0
-
-def calculate_mar(points, landmarks, w, h):
-    """Calculate Mouth Aspect Ratio (MAR)."""
-    try:
-        coords = [(int(landmarks.landmark[p].x * w), int(landmarks.landmark[p].y * h)) for p in points]
-        A = np.linalg.norm(np.array(coords[2]) - np.array(coords[6]))
-        B = np.linalg.norm(np.array(coords[0]) - np.array(coords[4]))
-        return A / B if B != 0 else 0
-    except Exception as e:
-        logger.error(f"Error calculating MAR: {str(e)}")
-        logger.debug(traceback.format_exc())
-        return 0
-
-def calculate_pitch(landmarks):
-    """Calculate head pitch (up/down rotation).
-    Using nose tip (1) and chin (152) for more robust pitch estimation.
-    A positive value generally means looking down, negative means looking up.
+# FaceMesh landmarks are copied into one (468, 3) array per frame, and every geometric feature
+# is computed from it with precomputed index arrays in a single vectorized pass.
+
+LEFT_EYE_LANDMARKS = [33, 160, 158, 133, 153, 144]
+RIGHT_EYE_LANDMARKS = [362, 385, 387, 263, 373, 380]
+MOUTH_LANDMARKS = [61, 291, 0, 17, 405, 185, 13]
+
+# Landmark pairs whose pixel distances the features need, in this order:
+# left eye vertical x2 and horizontal, right eye vertical x2 and horizontal, mouth vertical and horizontal
+DISTANCE_PAIRS = np.array([
+    [160, 144], [158, 153], [33, 133],
+    [385, 380], [387, 373], [362, 263],
+    [0, 13], [61, 405],
+])
+
+# Feature vector layout returned by compute_features (also the column order for logs and models)
+FEATURE_NAMES = ("ear", "mar", "pitch", "head_roll", "eye_y", "left_ear", "right_ear")
+EAR, MAR, PITCH, HEAD_ROLL, EYE_Y, LEFT_EAR, RIGHT_EAR = range(len(FEATURE_NAMES))
+
+def landmarks_to_array(landmarks):
+    """FaceMesh landmarks as a float32 (N, 3) array of normalized x, y, z."""
+    points = landmarks.landmark
+    array = np.empty((len(points), 3), dtype=np.float32)
+    # One list per coordinate is the cheapest way through the protobuf repeated field
+    array[:, 0] = [p.x for p in points]
+    array[:, 1] = [p.y for p in points]
+    array[:, 2] = [p.z for p in points]
+    return array
+
+def compute_features(points, w, h):
+    """Geometric features of one face from its landmark array, as a float32 vector (see FEATURE_NAMES).
+
+    ear/left_ear/right_ear: Eye Aspect Ratios; mar: Mouth Aspect Ratio; pitch: nose tip minus chin Y
+    (positive generally means looking down); head_roll: |Y difference| of the temples; eye_y: mean
+    eye-corner Y used for gaze. Distances are taken on whole-pixel coordinates.
     """
-    try:
-        # Using normalized coordinates for pitch calculation
-        nose_tip_y = landmarks.landmark[1].y
-        chin_y = landmarks.landmark[152].y
-        # A simple difference can indicate pitch. Adjust sensitivity as needed.
-        return nose_tip_y - chin_y
-    except Exception as e:
-        logger.error(f"Error calculating pitch: {str(e)}")
-        logger.debug(traceback.format_exc())
-        return 0
-
-def is_head_tilted(landmarks):
-    """Check if head is tilted left or right (roll)."""
-    try:
-        # Using left (234) and right (454) temples or ears for roll detection
-        # Increased threshold for less sensitivity
-        return abs(landmarks.landmark[234].y - landmarks.landmark[454].y) > HEAD_TILT_THRESHOLD
-    except Exception as e:
-        logger.error(f"Error checking head tilt: {str(e)}")
-        logger.debug(traceback.format_exc())
-        return False
+    pixels = (points[:, :2] * np.array([w, h], dtype=np.float32)).astype(np.int32).astype(np.float32)
+    d = np.linalg.norm(pixels[DISTANCE_PAIRS[:, 0]] - pixels[DISTANCE_PAIRS[:, 1]], axis=1)
+    left_ear = (d[0] + d[1]) / (2.0 * d[2]) if d[2] else 0.0
+    right_ear = (d[3] + d[4]) / (2.0 * d[5]) if d[5] else 0.0
+    y = points[:, 1]
+    return np.array([
+        (left_ear + right_ear) / 2,
+        d[6] / d[7] if d[7] else 0.0,
+        y[1] - y[152],
+        abs(y[234] - y[454]),
+        (y[33] + y[263]) / 2.0,
+        left_ear,
+        right_ear,
+    ], dtype=np.float32)
+
+def face_roi(frame, points, w, h):
+    """Square crop of the face, rotated so the eyes are level, taken from a landmark array.
+
+    Cropping, alignment and downscaling are a single warpAffine, which only computes the
+    output pixels. Returns None if the landmarks do not span a usable box.
+    """
+    xs = points[:, 0] * w
+    ys = points[:, 1] * h
+    x_min, x_max, y_min, y_max = float(xs.min()), float(xs.max()), float(ys.min()), float(ys.max())
+    side = max(x_max - x_min, y_max - y_min) * (1 + 2 * FACE_ROI_MARGIN)
+    if side < 8:
+        return None
+    center = ((x_max + x_min) / 2, (y_max + y_min) / 2)
+    # Eye corners 33 and 263: rotate by the angle of the line between them
+    angle = np.degrees(np.arctan2(ys[263] - ys[33], xs[263] - xs[33]))
+    scale = min(1.0, FACE_ROI_SIZE / side)
+    size = max(1, int(round(side * scale)))
+    matrix = cv2.getRotationMatrix2D(center, angle, scale)
+    matrix[0, 2] += size / 2 - center[0]
+    matrix[1, 2] += size / 2 - center[1]
+    return cv2.warpAffine(frame, matrix, (size, size), flags=cv2.INTER_LINEAR, borderMode=cv2.BORDER_REPLICATE)
 
 # --- Calibration and Smoothing Functions ---
 
-def calibrate():
-    """Calibrate neutral eye position for gaze detection."""
+def eye_levels(face_mesh, frame):
+    """Average eye-center Y of every face in a BGR frame (calibration samples)."""
+    rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+    result = face_mesh.process(rgb_frame)
+    levels = []
+    if result.multi_face_landmarks:
+        for face_landmarks in result.multi_face_landmarks:
+            # Using the average Y of both eye centers for calibration
+            left_eye_center_y = face_landmarks.landmark[33].y
+            right_eye_center_y = face_landmarks.landmark[263].y
+            levels.append((left_eye_center_y + right_eye_center_y) / 2.0)
+    return levels
+
+def calibrate(state=STATE):
+    """Calibrate neutral eye position for gaze detection.
+
+    Reads from state["cap"] when the detection loop already holds the camera, otherwise
+    borrows a reader from the camera manager for the duration of the calibration.
+    """
     logger.info("Calibrating facial emotion detection baseline...")
-    global cap
-    
-    # Check if camera is available first
-    if not check_camera_availability():
-        logger.warning("Camera not available for calibration, using default values")
-        return 0.5
     
+    borrowed = state["cap"] is None
     try:
-        cap = cv2.VideoCapture(0)
-        if not cap.isOpened():
-            raise Exception("Failed to open webcam during calibration.")
-        cap.set(cv2.CAP_PROP_FRAME_WIDTH, 640)
-        cap.set(cv2.CAP_PROP_FRAME_HEIGHT, 480)
-        start_time = time.time()
+        cap = state["cap"] if not borrowed else camera_manager.acquire(state["source"])
+        if cap is None:
+            logger.warning("Camera not available for calibration, using default values")
+            return 0.5
+        if borrowed:
+            state["cap"] = cap
+        clock = state["clock"]
+        start_time = clock.time()
         eye_samples = []
         frame_count = 0
         max_frames = 50  # Limit calibration frames
         
-        while time.time() - start_time < 5 and STATE["running"] and frame_count < max_frames:
+        while clock.time() - start_time < 5 and state["running"] and frame_count < max_frames:
             ret, frame = cap.read()
             if not ret:
                 logger.debug("Failed to read frame during calibration, retrying...")
-                time.sleep(0.2)  # Increased sleep to reduce camera conflicts
+                clock.sleep(0.2)  # Increased sleep to reduce camera conflicts
                 continue
             
             frame_count += 1
-            rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-            result = face_mesh.process(rgb_frame)
-            if result.multi_face_landmarks:
-                for face_landmarks in result.multi_face_landmarks:
-                    # Using the average Y of both eye centers for calibration
-                    left_eye_center_y = face_landmarks.landmark[33].y
-                    right_eye_center_y = face_landmarks.landmark[263].y
-                    avg_eye_y = (left_eye_center_y + right_eye_center_y) / 2.0
-                    eye_samples.append(avg_eye_y)
-            time.sleep(0.1)  # Increased sleep for more stable calibration
+            eye_samples.extend(eye_levels(state["face_mesh"], frame))
+            if cap.realtime:
+                clock.sleep(0.1)  # Increased sleep for more stable calibration
         
-        safe_camera_release()
         return np.mean(eye_samples) if eye_samples else 0.5
     except Exception as e:
         logger.error(f"Calibration error: {str(e)}")
         logger.debug(traceback.format_exc())
-        safe_camera_release()
         return 0.5
+    finally:
+        if borrowed:
+            safe_camera_release(state)
 
 def get_majority_emotion(history_deque):
     """Return the most frequent emotion in the history deque."""
@@ -213,45 +329,393 @@ def get_majority_emotion(history_deque):
         logger.debug(traceback.format_exc())
         return "Engaged"
 
+def onnx_model():
+    """The ONNX expression model when EMOTION_MODEL_BACKEND=onnx and it loads, else None."""
+    return get_onnx_emotion_model() if EMOTION_MODEL_BACKEND == "onnx" else None
+
+def run_deepface(frame, detector_backend="opencv"):
+    """DeepFace emotion analysis of one frame or face crop; returns the exception instead of raising.
+
+    With detector_backend="skip" the whole image is taken to be the face (see face_roi), and the
+    ONNX model answers instead when EMOTION_MODEL_BACKEND=onnx.
+    """
+    try:
+        model = onnx_model() if detector_backend == "skip" else None
+        if model is not None:
+            with ONNX_EMOTION_SECONDS.time():
+                return model.analyze([frame])[0]
+        with DEEPFACE_SECONDS.time():
+            return load_deepface().analyze(frame, actions=['emotion'], enforce_detection=False, silent=True,
+                                           detector_backend=detector_backend)
+    except Exception as e:
+        return e
+
+def run_deepface_batch(faces):
+    """run_deepface() on several face crops (see face_roi) in one model call; one result per crop."""
+    if len(faces) == 1:
+        return [run_deepface(faces[0], "skip")]
+    try:
+        model = onnx_model()
+        if model is not None:
+            with ONNX_EMOTION_SECONDS.time():
+                return model.analyze(faces)
+        with DEEPFACE_BATCH_SECONDS.time():
+            return load_deepface().analyze(list(faces), actions=['emotion'], enforce_detection=False, silent=True,
+                                           detector_backend="skip")
+    except Exception as e:
+        # DeepFace releases without list input: analyse the crops one at a time
+        logger.debug(f"Batched DeepFace analysis failed, analysing crops one by one: {str(e)}")
+        return [run_deepface(face, "skip") for face in faces]
+
+def landmark_analysis(points, w, h):
+    """The landmark classifier's DeepFace-shaped analysis of one face, or None when DeepFace should decide.
+
+    None with FACIAL_CLASSIFIER=deepface, without a classifier file, or in hybrid mode when the
+    classifier is less than FAST_PATH_MIN_CONFIDENCE sure.
+    """
+    if FACIAL_CLASSIFIER not in ("landmarks", "hybrid"):
+        return None
+    model = get_landmark_classifier()
+    if model is None:
+        return None
+    with LANDMARK_CLASSIFIER_SECONDS.time():
+        analysis, confidence = model.analyze(points, w, h)
+    if analysis is None or (FACIAL_CLASSIFIER == "hybrid" and confidence < FAST_PATH_MIN_CONFIDENCE):
+        return None
+    FAST_PATH_FRAMES.inc()
+    return analysis
+
+def deepface_emotion(analysis, last_emotion):
+    """Map a run_deepface() result to a learner emotion ("Unknown" when it is not conclusive)."""
+    if isinstance(analysis, Exception):
+        # DeepFace can fail if face is not clear enough.
+        # In this case, we rely on non-DeepFace metrics or previous state.
+        logger.debug(f"DeepFace analysis error or no face detected by DeepFace: {str(analysis)}")
+        # If DeepFace fails, retain the last known robust emotion, or default to Engaged
+        return last_emotion if last_emotion != "Unknown" else "Engaged"
+    dom_emotion = analysis[0]['dominant_emotion']
+    emotion_probabilities = analysis[0]['emotion']
+
+    if (emotion_probabilities.get('angry', 0) > FRUSTRATION_PROB_THRESHOLD or
+        emotion_probabilities.get('disgust', 0) > FRUSTRATION_PROB_THRESHOLD or
+        dom_emotion in ['angry', 'disgust']):  # Stronger frustration condition
+        return "Frustrated"
+    elif dom_emotion in ['neutral', 'happy']:
+        return "Engaged"
+    elif dom_emotion in ['sad', 'fear']:  # Sad/Fear can also indicate confusion
+        return "Confused"
+    # If DeepFace detects something else but not strong enough for frustration/confusion,
+    # or if it's "surprise" or "neutral" not meeting "engaged" criteria, keep it as unknown for now.
+    return "Unknown"  # Let smoothing handle it or default to engaged if no strong signal
+
+def new_frame_tracker(calibrated_eye_y=0.5):
+    """Timers and counters carried from frame to frame by analyze_frame (one per detection run)."""
+    return {
+        "calibrated_eye_y": calibrated_eye_y,
+        "emotion_lock_time": 0,
+        "gaze_away_counter": 0,
+        "eyes_closed_start": None,
+        "yawn_start": None,
+        "no_face_start": None,
+        "features": None,  # compute_features() vector of the last face seen
+        "points": None,  # landmarks_to_array() of the last frame's face (None if it had none)
+        "rule_decided": False,  # The last face frame was decided by a landmark rule, before any emotion model
+        "motion_gate": MotionGate() if MOTION_GATE else None  # Skips FaceMesh on unchanged frames (analyze_frame)
+    }
+
+def rule_timing(tracker, now):
+    """True while a duration rule (eyes closed, yawn, no face) is counting toward its threshold."""
+    for start, duration in ((tracker["eyes_closed_start"], EYES_CLOSED_DURATION_SLEEPY),
+                            (tracker["yawn_start"], YAWN_DURATION_BORED),
+                            (tracker["no_face_start"], NO_FACE_DURATION_BORED)):
+        if start is not None and now - start <= duration:
+            return True
+    return False
+
+def analyze_frame(state, frame, tracker):
+    """Classify one BGR frame and apply the result to the detector state.
+
+    This is the per-frame body of facial_emotion_loop, usable on frames from any source.
+    Returns the frame's raw (unsmoothed) emotion.
+    """
+    frame_start = time.perf_counter()
+    FACIAL_FRAMES.inc()
+    now = state["clock"].time()
+    gate = tracker["motion_gate"]
+    changed = True
+    if gate is not None:
+        MOTION_GATE_CHECKS.inc()
+        with MOTION_GATE_SECONDS.time():
+            changed = gate.changed(frame, now)
+    h, w, _ = frame.shape
+    if changed:
+        with FACE_MESH_SECONDS.time():
+            rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+            results = state["face_mesh"].process(rgb_frame)
+        faces = [landmarks_to_array(face) for face in results.multi_face_landmarks or []]
+    else:
+        # Nothing moved since FaceMesh last ran: same face (or none), and the rules still advance their timers
+        FACEMESH_SKIPPED.inc()
+        faces = [tracker["points"]] if tracker["points"] is not None else []
+    current_emotion = classify_landmarks(state, tracker, faces, w, h, frame, now)
+    FRAME_SECONDS.observe(time.perf_counter() - frame_start)
+    return current_emotion
+
+def classify_landmarks(state, tracker, faces, w, h, frame=None, now=None, analysis=None):
+    """Run the landmark rules and smoothing for one frame's faces and apply the result to the state.
+
+    `faces` holds a landmarks_to_array() array per detected face (empty when there is none);
+    w and h are the frame size the landmarks are normalized to. `analysis` is a DeepFace result
+    the caller already has for this frame (batched inference); otherwise DeepFace only runs when
+    the frame itself is given. `now` is the frame's time (default: the state's clock).
+    Returns the frame's raw (unsmoothed) emotion.
+    """
+    now = state["clock"].time() if now is None else now
+    current_emotion = "Unknown"  # Default for this frame
+
+    if faces:
+        tracker["no_face_start"] = None  # Reset no face timer
+        for points in faces:
+            # The motion gate hands back the previous frame's landmarks: their features are known
+            if points is tracker["points"] and tracker["features"] is not None:
+                features = tracker["features"]
+            else:
+                features = compute_features(points, w, h)
+            tracker["points"] = points
+            tracker["features"] = features
+            ear = features[EAR]
+            mar = features[MAR]
+            eye_y = features[EYE_Y]  # Recalculated from the current frame's landmarks
+            pitch = features[PITCH]
+
+            # --- Emotion Detection Logic (Prioritized) ---
+
+            # 1. Sleepy
+            if ear < EAR_THRESHOLD_SLEEPY:
+                if tracker["eyes_closed_start"] is None:
+                    tracker["eyes_closed_start"] = now
+                elif now - tracker["eyes_closed_start"] > EYES_CLOSED_DURATION_SLEEPY:
+                    current_emotion = "Sleepy"
+                    # If sleepy, reset other counters
+                    tracker["yawn_start"] = None
+                    tracker["gaze_away_counter"] = 0
+            else:
+                tracker["eyes_closed_start"] = None  # Reset eyes closed timer
+
+            # 2. Bored (Yawning or Gaze Away)
+            if current_emotion != "Sleepy":  # Only check for bored if not already sleepy
+                if mar > MAR_THRESHOLD_YAWN:  # and pitch < PITCH_NEUTRAL_RANGE[1]: Removed pitch constraint for yawning, focus on mouth
+                    if tracker["yawn_start"] is None:
+                        tracker["yawn_start"] = now
+                    elif now - tracker["yawn_start"] > YAWN_DURATION_BORED:
+                        current_emotion = "Bored"
+                        tracker["eyes_closed_start"] = None  # Reset sleepy timer if bored by yawning
+                else:
+                    tracker["yawn_start"] = None
+
+                # Gaze Away for Boredom
+                # Only if not already identified as sleepy or yawning
+                if current_emotion not in ["Sleepy", "Bored"]:
+                    if abs(eye_y - tracker["calibrated_eye_y"]) > 0.07:  # Keeping original gaze deviation logic
+                        tracker["gaze_away_counter"] += 1
+                    else:
+                        tracker["gaze_away_counter"] = max(0, tracker["gaze_away_counter"] - 2)  # Decays faster
+
+                    if tracker["gaze_away_counter"] > GAZE_AWAY_THRESHOLD:
+                        current_emotion = "Bored"
+                        tracker["gaze_away_counter"] = 0  # Reset counter once bored is detected
+
+            # 3. Confused (Head Tilt)
+            if current_emotion not in ["Sleepy", "Bored"]:  # Check for confused if not sleepy or bored
+                if features[HEAD_ROLL] > HEAD_TILT_THRESHOLD:
+                    current_emotion = "Confused"
+                    tracker["eyes_closed_start"] = None
+                    tracker["yawn_start"] = None
+                    tracker["gaze_away_counter"] = 0
+
+            # 4. DeepFace Emotions (Frustrated, Engaged) - Lower priority
+            # Only run DeepFace if no other strong emotion has been detected yet
+            # The landmark classifier answers first when configured (FACIAL_CLASSIFIER)
+            tracker["rule_decided"] = current_emotion != "Unknown"
+            face_analysis = None
+            if current_emotion == "Unknown":
+                face_analysis = analysis if analysis is not None else landmark_analysis(points, w, h)
+            if face_analysis is not None:
+                current_emotion = deepface_emotion(face_analysis, state["last_emotion"])
+            # Needs the pixels: skipped for landmarks that arrive without their frame
+            elif current_emotion == "Unknown" and frame is not None:
+                worker = state["deepface"]
+                face = face_roi(frame, points, w, h) if DEEPFACE_FACE_CROP else None
+                if face is None:
+                    # The full frame may be a capture ring buffer, reused after this frame: the worker needs a copy
+                    face, backend = (frame if worker is None else frame.copy()), "opencv"
+                else:
+                    backend = "skip"
+                if worker is None:
+                    current_emotion = deepface_emotion(run_deepface(face, backend), state["last_emotion"])
+                else:
+                    # Never wait for DeepFace: hand over this frame and use the latest result if it is recent
+                    worker.submit((face, backend))
+                    latest, age = worker.latest()
+                    if latest is not None and age <= DEEPFACE_MAX_RESULT_AGE:
+                        current_emotion = deepface_emotion(latest, state["last_emotion"])
+
+            # If still 'Unknown' after all checks, default to Engaged if conditions allow
+            if current_emotion == "Unknown":
+                 # If no specific negative emotion, assume engaged, especially if pitch is neutral
+                if pitch >= PITCH_NEUTRAL_RANGE[0] and pitch <= PITCH_NEUTRAL_RANGE[1]:
+                    current_emotion = "Engaged"
+                else:
+                    # If head is not neutral, and no other specific emotion, keep previous or default to engaged
+                    current_emotion = state["last_emotion"] if state["last_emotion"] != "Unknown" else "Engaged"
+
+            # Ensure "Engaged" overrides boredom if the person comes back into focus and is neutral/happy
+            # This rule is important for quick recovery from bored state
+            if state["last_emotion"] == "Bored" and current_emotion in ["Engaged", "Confused", "Frustrated"]:
+                 # If they are no longer exhibiting bored characteristics, allow a quick switch
+                if current_emotion != "Bored":  # The previous logic was "dom_emotion in ['happy', 'neutral']" which is too narrow.
+                    pass  # Let the determined current emotion stand
+
+            # --- State Update and Smoothing ---
+            state["emotion_history"].append(current_emotion)
+            smoothed_emotion = get_majority_emotion(state["emotion_history"])
+
+            with state["lock"]:
+                # Apply EMOTION_LOCK_DURATION for stability
+                if smoothed_emotion != state["last_emotion"] and now - tracker["emotion_lock_time"] > EMOTION_LOCK_DURATION:
+                    state["last_emotion"] = smoothed_emotion
+                    tracker["emotion_lock_time"] = now
+                    timestamp = datetime.fromtimestamp(now).strftime("%Y-%m-%d %H:%M:%S")
+                    state["log_data"].append({"timestamp": timestamp, "emotion": state["last_emotion"], "source": "facial"})
+                    publish_change("facial", state["last_emotion"], state["changes"])
+                elif smoothed_emotion == state["last_emotion"]:
+                    # If emotion is stable, reset lock time to allow quick changes if a new strong emotion appears
+                    tracker["emotion_lock_time"] = now
+
+    else:  # No face detected
+        tracker["points"] = None
+        tracker["rule_decided"] = False
+        tracker["eyes_closed_start"] = None
+        tracker["yawn_start"] = None
+        tracker["gaze_away_counter"] = 0
+
+        if tracker["no_face_start"] is None:
+            tracker["no_face_start"] = now
+        elif now - tracker["no_face_start"] > NO_FACE_DURATION_BORED:
+            # After NO_FACE_DURATION_BORED, set to Bored if still no face
+            with state["lock"]:
+                if state["last_emotion"] != "Bored":
+                    state["last_emotion"] = "Bored"
+                    tracker["emotion_lock_time"] = now
+                    timestamp = datetime.fromtimestamp(now).strftime("%Y-%m-%d %H:%M:%S")
+                    state["log_data"].append({"timestamp": timestamp, "emotion": "Bored", "source": "facial - no face (prolonged)"})
+                    publish_change("facial", "Bored", state["changes"])
+        else:
+            # Immediately "Face Not Detected" if no face and not yet bored by duration
+            current_emotion = "Face Not Detected"
+            with state["lock"]:
+                 # Allow immediate update for Face Not Detected
+                if state["last_emotion"] != "Face Not Detected":
+                    state["last_emotion"] = "Face Not Detected"
+                    tracker["emotion_lock_time"] = now  # Reset lock for immediate state
+                    timestamp = datetime.fromtimestamp(now).strftime("%Y-%m-%d %H:%M:%S")
+                    state["log_data"].append({"timestamp": timestamp, "emotion": "Face Not Detected", "source": "facial - no face (instant)"})
+                    publish_change("facial", "Face Not Detected", state["changes"])
+
+    return current_emotion
+
+def remote_tracker(state):
+    """Frame tracker for landmarks or frames posted by the client (call with state["remote_lock"] held)."""
+    tracker = state["remote_tracker"]
+    if tracker is None:
+        tracker = state["remote_tracker"] = new_frame_tracker()
+        tracker.update({"calibration_samples": [], "last_time": None, "received_at": None,
+                        "deepface": None, "deepface_time": None})
+    return tracker
+
+def classify_remote_frame(state, tracker, faces, w, h, timestamp, analysis=None):
+    """classify_landmarks() for one posted frame, calibrating the eye level on the first face frames.
+
+    Frames not newer than the last one classified (a retried upload) are skipped: returns False.
+    """
+    if tracker["last_time"] is not None and timestamp <= tracker["last_time"]:
+        return False
+    tracker["last_time"] = timestamp
+    samples = tracker["calibration_samples"]
+    if faces and len(samples) < LANDMARK_CALIBRATION_FRAMES:
+        # Neutral eye level: running mean until enough face frames have been seen
+        samples.append(float((faces[0][33, 1] + faces[0][263, 1]) / 2.0))
+        tracker["calibrated_eye_y"] = float(np.mean(samples))
+    FACIAL_FRAMES.inc()
+    classify_landmarks(state, tracker, faces, w, h, now=timestamp, analysis=analysis)
+    tracker["received_at"] = time.monotonic()
+    return True
+
+def ingest_landmark_batch(state, data):
+    """Classify a batch of browser-computed FaceMesh landmarks (see modules/landmark_batch.py).
+
+    Frames run through the same rules and smoothing as camera frames, timed by their own
+    timestamps; frames not newer than the last one ingested (a retried upload) are skipped.
+    Raises ValueError for a malformed batch. Returns the number of frames classified.
+    """
+    batch = parse_landmark_batch(data)
+    with state["remote_lock"], LANDMARK_BATCH_SECONDS.time():
+        tracker = remote_tracker(state)
+        classified = 0
+        for timestamp, faces in batch["frames"]:
+            if classify_remote_frame(state, tracker, faces, batch["width"], batch["height"], timestamp):
+                classified += 1
+    return classified
+
 # --- Main Emotion Detection Loop ---
 
-def facial_emotion_loop():
-    """Core loop for facial emotion detection."""
-    global cap
+def facial_emotion_loop(state=STATE):
+    """Core loop for facial emotion detection.
+
+    Runs while detection is enabled and this thread is still state["thread"]: a stop followed
+    by a quick restart hands the camera and FaceMesh over to the new thread.
+    """
+    me = threading.current_thread()
+    cap = None
     try:
-        calibrated_eye_y = calibrate()
-        logger.info(f"Calibration complete. Calibrated Eye Y: {calibrated_eye_y:.3f}")
-        
-        # Check camera availability before starting main loop
-        if not check_camera_availability():
+        if state["face_mesh"] is None:
+            state["face_mesh"] = create_face_mesh()
+
+        # One camera handle (shared through the camera manager) serves calibration and detection.
+        # Live sources are read on a capture thread that always serves the newest frame, so latency stays bounded.
+        cap = state["cap"] = camera_manager.acquire(state["source"])
+        while cap is None and state["running"] and state["thread"] is me:
             logger.warning("Camera not available, facial detection will use fallback values")
-            while STATE["running"]:
-                time.sleep(5)  # Sleep longer when camera unavailable
-                if check_camera_availability():
-                    break
-        
-        cap = cv2.VideoCapture(0)
-        if not cap.isOpened():
-            raise Exception("Failed to open webcam for main detection loop.")
-        cap.set(cv2.CAP_PROP_FRAME_WIDTH, 640)
-        cap.set(cv2.CAP_PROP_FRAME_HEIGHT, 480)
-
-        emotion_lock_time = 0
-        gaze_away_counter = 0
-        eyes_closed_start = None
-        yawn_start = None
-        no_face_start = None
+            time.sleep(5)  # Sleep longer when camera unavailable
+            cap = state["cap"] = camera_manager.acquire(state["source"])
+        if cap is None:
+            return
+
+        calibrated_eye_y = calibrate(state)
+        logger.info(f"Calibration complete. Calibrated Eye Y: {calibrated_eye_y:.3f}")
+
+        tracker = new_frame_tracker(calibrated_eye_y)
+        governor = FrameRateGovernor()
+        previous_points = None
+        if DEEPFACE_ASYNC:
+            state["deepface"] = DeepFaceWorker(lambda item: run_deepface(*item), DEEPFACE_MAX_RATE)
+            state["deepface"].start()
         consecutive_failures = 0
         max_consecutive_failures = 10
         
-        while STATE["running"]:
+        while state["running"] and state["thread"] is me:
             try:
-                ret, frame = cap.read()
+                with CAPTURE_SECONDS.time():
+                    ret, frame = cap.read()
+                if not ret and cap.exhausted:
+                    logger.info(f"Frame source {state['source']} has no more frames; facial detection loop ending")
+                    break
                 if not ret:
+                    FRAMES_DROPPED.labels("facial", "read_failed").inc()
                     consecutive_failures += 1
                     if consecutive_failures > max_consecutive_failures:
                         logger.warning("Too many consecutive frame failures, checking camera availability")
-                        if not check_camera_availability():
+                        if not check_camera_availability(state["source"]):
                             logger.warning("Camera not available, using fallback emotion")
                             time.sleep(5)  # Sleep longer when camera unavailable
                             continue
@@ -262,157 +726,20 @@ def facial_emotion_loop():
                         continue
 
                 consecutive_failures = 0  # Reset failure counter on success
-                rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-                results = face_mesh.process(rgb_frame)
-                h, w, _ = frame.shape
-                current_emotion = "Unknown"  # Default for this frame
-
-                if results.multi_face_landmarks:
-                    no_face_start = None;  # Reset no face timer
-                    for face_landmarks in results.multi_face_landmarks:
-                        left_eye_landmarks = [33, 160, 158, 133, 153, 144]
-                        right_eye_landmarks = [362, 385, 387, 263, 373, 380]
-                        mouth_landmarks = [61, 291, 0, 17, 405, 185, 13]
-
-                        ear = (calculate_ear(left_eye_landmarks, face_landmarks, w, h) +
-                               calculate_ear(right_eye_landmarks, face_landmarks, w, h)) / 2
-                        mar = calculate_mar(mouth_landmarks, face_landmarks, w, h)
-                        # Recalculate eye_y based on the current frame's landmarks
-                        eye_y = (face_landmarks.landmark[33].y + face_landmarks.landmark[263].y) / 2.0
-                        pitch = calculate_pitch(face_landmarks)
-
-                        # --- Emotion Detection Logic (Prioritized) ---
-
-                        # 1. Sleepy
-                        if ear < EAR_THRESHOLD_SLEEPY:
-                            if eyes_closed_start is None:
-                                eyes_closed_start = time.time()
-                            elif time.time() - eyes_closed_start > EYES_CLOSED_DURATION_SLEEPY:
-                                current_emotion = "Sleepy"
-                                # If sleepy, reset other counters
-                                yawn_start = None
-                                gaze_away_counter = 0
-                        else:
-                            eyes_closed_start = None  # Reset eyes closed timer
-
-                        # 2. Bored (Yawning or Gaze Away)
-                        if current_emotion != "Sleepy":  # Only check for bored if not already sleepy
-                            if mar > MAR_THRESHOLD_YAWN:  # and pitch < PITCH_NEUTRAL_RANGE[1]: Removed pitch constraint for yawning, focus on mouth
-                                if yawn_start is None:
-                                    yawn_start = time.time()
-                                elif time.time() - yawn_start > YAWN_DURATION_BORED:
-                                    current_emotion = "Bored"
-                                    eyes_closed_start = None  # Reset sleepy timer if bored by yawning
-                            else:
-                                yawn_start = None
-
-                            # Gaze Away for Boredom
-                            # Only if not already identified as sleepy or yawning
-                            if current_emotion not in ["Sleepy", "Bored"]:
-                                if abs(eye_y - calibrated_eye_y) > 0.07:  # Keeping original gaze deviation logic
-                                    gaze_away_counter += 1
-                                else:
-                                    gaze_away_counter = max(0, gaze_away_counter - 2)  # Decays faster
-
-                                if gaze_away_counter > GAZE_AWAY_THRESHOLD:
-                                    current_emotion = "Bored"
-                                    gaze_away_counter = 0  # Reset counter once bored is detected
-
-                        # 3. Confused (Head Tilt)
-                        if current_emotion not in ["Sleepy", "Bored"]:  # Check for confused if not sleepy or bored
-                            if is_head_tilted(face_landmarks):
-                                current_emotion = "Confused"
-                                eyes_closed_start = None
-                                yawn_start = None
-                                gaze_away_counter = 0
-
-                        # 4. DeepFace Emotions (Frustrated, Engaged) - Lower priority
-                        # Only run DeepFace if no other strong emotion has been detected yet
-                        if current_emotion == "Unknown":  # or current_emotion == "Engaged" (to allow override from Engaged)
-                            try:
-                                deepface_result = DeepFace.analyze(frame, actions=['emotion'], enforce_detection=False, silent=True)
-                                dom_emotion = deepface_result[0]['dominant_emotion']
-                                emotion_probabilities = deepface_result[0]['emotion']
-
-                                if (emotion_probabilities.get('angry', 0) > FRUSTRATION_PROB_THRESHOLD or
-                                    emotion_probabilities.get('disgust', 0) > FRUSTRATION_PROB_THRESHOLD or
-                                    dom_emotion in ['angry', 'disgust']):  # Stronger frustration condition
-                                    current_emotion = "Frustrated"
-                                elif dom_emotion in ['neutral', 'happy']:
-                                    current_emotion = "Engaged"
-                                elif dom_emotion in ['sad', 'fear']:  # Sad/Fear can also indicate confusion
-                                    current_emotion = "Confused"
-                                else:
-                                    # If DeepFace detects something else but not strong enough for frustration/confusion,
-                                    # or if it's "surprise" or "neutral" not meeting "engaged" criteria, keep it as unknown for now.
-                                    pass  # Let smoothing handle it or default to engaged if no strong signal
-                            except Exception as e:
-                                # DeepFace can fail if face is not clear enough.
-                                # In this case, we rely on non-DeepFace metrics or previous state.
-                                logger.debug(f"DeepFace analysis error or no face detected by DeepFace: {str(e)}")
-                                # If DeepFace fails, retain the last known robust emotion, or default to Engaged
-                                current_emotion = STATE["last_emotion"] if STATE["last_emotion"] != "Unknown" else "Engaged"
-
-                        # If still 'Unknown' after all checks, default to Engaged if conditions allow
-                        if current_emotion == "Unknown":
-                             # If no specific negative emotion, assume engaged, especially if pitch is neutral
-                            if pitch >= PITCH_NEUTRAL_RANGE[0] and pitch <= PITCH_NEUTRAL_RANGE[1]:
-                                current_emotion = "Engaged"
-                            else:
-                                # If head is not neutral, and no other specific emotion, keep previous or default to engaged
-                                current_emotion = STATE["last_emotion"] if STATE["last_emotion"] != "Unknown" else "Engaged"
-
-                        # Ensure "Engaged" overrides boredom if the person comes back into focus and is neutral/happy
-                        # This rule is important for quick recovery from bored state
-                        if STATE["last_emotion"] == "Bored" and current_emotion in ["Engaged", "Confused", "Frustrated"]:
-                             # If they are no longer exhibiting bored characteristics, allow a quick switch
-                            if current_emotion != "Bored":  # The previous logic was "dom_emotion in ['happy', 'neutral']" which is too narrow.
-                                pass  # Let the determined current emotion stand
-
-                        # --- State Update and Smoothing ---
-                        STATE["emotion_history"].append(current_emotion)
-                        smoothed_emotion = get_majority_emotion(STATE["emotion_history"])
-
-                        now = time.time()
-                        with STATE["lock"]:
-                            # Apply EMOTION_LOCK_DURATION for stability
-                            if smoothed_emotion != STATE["last_emotion"] and now - emotion_lock_time > EMOTION_LOCK_DURATION:
-                                STATE["last_emotion"] = smoothed_emotion
-                                emotion_lock_time = now
-                                timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                                STATE["log_data"].append({"timestamp": timestamp, "emotion": STATE["last_emotion"], "source": "facial"})
-                            elif smoothed_emotion == STATE["last_emotion"]:
-                                # If emotion is stable, reset lock time to allow quick changes if a new strong emotion appears
-                                emotion_lock_time = now
-
-                else:  # No face detected
-                    eyes_closed_start = None
-                    yawn_start = None
-                    gaze_away_counter = 0
-
-                    if no_face_start is None:
-                        no_face_start = time.time()
-                    elif time.time() - no_face_start > NO_FACE_DURATION_BORED:
-                        # After NO_FACE_DURATION_BORED, set to Bored if still no face
-                        with STATE["lock"]:
-                            if STATE["last_emotion"] != "Bored":
-                                STATE["last_emotion"] = "Bored"
-                                emotion_lock_time = time.time()
-                                timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                                STATE["log_data"].append({"timestamp": timestamp, "emotion": "Bored", "source": "facial - no face (prolonged)"})
-                    else:
-                        # Immediately "Face Not Detected" if no face and not yet bored by duration
-                        current_emotion = "Face Not Detected"
-                        with STATE["lock"]:
-                             # Allow immediate update for Face Not Detected
-                            if STATE["last_emotion"] != "Face Not Detected":
-                                STATE["last_emotion"] = "Face Not Detected"
-                                emotion_lock_time = time.time()  # Reset lock for immediate state
-                                timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                                STATE["log_data"].append({"timestamp": timestamp, "emotion": "Face Not Detected", "source": "facial - no face (instant)"})
-
-                time.sleep(0.01)  # Small delay to prevent busy-waiting
+                started = time.perf_counter()
+                raw_emotion = analyze_frame(state, frame, tracker)
+                busy = time.perf_counter() - started
+                if cap.realtime:
+                    LATENCY_SECONDS.observe(time.monotonic() - cap.captured_at)
+                    # Slow down while nothing changes, speed up during transitions, within the CPU budget
+                    motion = landmark_motion(tracker["points"], previous_points)
+                    active = (raw_emotion != state["last_emotion"] or rule_timing(tracker, state["clock"].time())
+                              or (motion is not None and motion > LANDMARK_MOTION_THRESHOLD))
+                    state["frame_rate"] = round(governor.update(busy, active), 2)
+                    state["clock"].sleep(max(0.0, governor.interval() - (time.perf_counter() - started)))
+                previous_points = tracker["points"]
             except Exception as e:
+                FRAMES_DROPPED.labels("facial", "error").inc()
                 logger.error(f"Error in facial emotion loop frame processing: {str(e)}")
                 logger.debug(traceback.format_exc())
                 time.sleep(0.1)  # Longer sleep on error to recover
@@ -421,61 +748,82 @@ def facial_emotion_loop():
         logger.error(f"Fatal error in facial emotion detection loop: {str(e)}")
         logger.debug(traceback.format_exc())
     finally:
-        safe_camera_release()
-        try:
-            face_mesh.close()
-            logger.info("MediaPipe FaceMesh closed.")
-        except Exception as e:
-            logger.error(f"Error closing FaceMesh during cleanup: {str(e)}")
+        if state["thread"] is me or state["thread"] is None:
+            state["frame_rate"] = None
+            if state["deepface"] is not None:
+                state["deepface"].stop()
+                state["deepface"] = None
+            safe_camera_release(state)
+            close_face_mesh(state)
+        elif cap is not None and cap is not state["cap"]:
+            cap.release()  # Our reader only; the state's resources belong to the new thread
 
 # --- Control Functions (kept as is) ---
 
-def start_facial_emotion_detection():
-    """Start facial emotion detection in a daemon thread."""
+def start_facial_emotion_detection(state=STATE):
+    """Start facial emotion detection in a daemon thread (or a worker process, see FACIAL_DETECTOR_MODE)."""
     try:
-        with STATE["lock"]:
-            if not STATE["running"]:
-                STATE["running"] = True
-                threading.Thread(target=facial_emotion_loop, daemon=True).start()
-                logger.info("Facial emotion detection started successfully.")
-                logger.info(f"DEBUG - STATE['running'] set to: {STATE['running']}")
+        previous = state["thread"]
+        if previous is not None and previous.is_alive() and not state["running"]:
+            previous.join(LOOP_STOP_TIMEOUT)  # A stop still winding down: let it release the camera first
+        with state["lock"]:
+            if not state["running"]:
+                state["running"] = True
+                if state["source"] in REMOTE_SOURCES:
+                    # Nothing to run here: classification happens as landmarks or frames are posted
+                    state["remote_tracker"] = None
+                    logger.info(f"Facial emotion detection started; waiting for the client ({state['source']} source).")
+                    return
+                if FACIAL_DETECTOR_MODE == "process":
+                    from modules.facial_worker import FacialWorkerSupervisor
+                    state["worker"] = FacialWorkerSupervisor(state)
+                    state["worker"].start()
+                else:
+                    state["thread"] = threading.Thread(target=facial_emotion_loop, args=(state,),
+                                                       name="FacialEmotionLoop", daemon=True)
+                    state["thread"].start()
+                logger.info(f"Facial emotion detection started successfully ({FACIAL_DETECTOR_MODE} mode).")
+                logger.info(f"DEBUG - state['running'] set to: {state['running']}")
             else:
                 logger.info("Facial emotion detection is already running.")
-                logger.info(f"DEBUG - STATE['running'] already: {STATE['running']}")
+                logger.info(f"DEBUG - state['running'] already: {state['running']}")
     except Exception as e:
         logger.error(f"Failed to start facial detection: {str(e)}")
         logger.debug(traceback.format_exc())
-        with STATE["lock"]:
-            STATE["running"] = False
+        with state["lock"]:
+            state["running"] = False
 
-def stop_facial_emotion_detection():
+def stop_facial_emotion_detection(state=STATE):
     """Stop facial emotion detection and save log data."""
     try:
-        with STATE["lock"]:
-            if STATE["running"]:
-                STATE["running"] = False
+        with state["lock"]:
+            if state["running"]:
+                state["running"] = False
                 logger.info("Attempting to stop facial emotion detection...")
-        time.sleep(0.5)  # Give a moment for the loop to naturally exit
-        
-        safe_camera_release()
-        
-        try:
-            face_mesh.close()
-            logger.info("MediaPipe FaceMesh closed during stop.")
-        except Exception as e:
-            logger.error(f"Error closing FaceMesh during stop: {str(e)}")
+        thread = state["thread"]
+        if state["worker"] is not None:
+            state["worker"].stop()
+            state["worker"] = None
+        elif thread is not None and thread is not threading.current_thread():
+            # The loop may be in the governor's sleep or mid-frame; it releases its resources on exit
+            thread.join(LOOP_STOP_TIMEOUT)
+
+        if thread is not None and thread.is_alive():
+            logger.warning("Facial emotion loop is still finishing a frame; it will release the camera when it exits")
+        elif not state["running"]:
+            safe_camera_release(state)
+            close_face_mesh(state)
             
-        if STATE["log_data"]:
+        if state["log_data"]:
             try:
-                file_exists = os.path.exists("emotion_log.csv")
-                pd.DataFrame(STATE["log_data"]).to_csv("emotion_log.csv", mode='a', index=False, header=not file_exists)
-                logger.info(f"Emotion log saved to emotion_log.csv. Total entries: {len(STATE['log_data'])}.")
+                event_sink.write_many(state["log_path"], state["log_data"])
+                logger.info(f"Emotion log queued for {state['log_path']}. Total entries: {len(state['log_data'])}.")
             except Exception as e:
                 logger.error(f"Error saving facial log data: {str(e)}")
                 logger.debug(traceback.format_exc())
             finally:
                 # Clear log_data after saving to avoid duplicate entries on subsequent runs
-                STATE["log_data"].clear()
+                state["log_data"].clear()
         else:
             logger.info("No emotion data was collected to save.")
         logger.info("Facial emotion detection stopped.")
@@ -483,12 +831,12 @@ def stop_facial_emotion_detection():
         logger.error(f"Error stopping facial detection: {str(e)}")
         logger.debug(traceback.format_exc())
 
-def get_facial_emotion():
+def get_facial_emotion(state=STATE):
     """Retrieve the current smoothed facial emotion."""
     try:
-        with STATE["lock"]:
-            current_emotion = STATE["last_emotion"]
-            logger.info(f"DEBUG - Facial emotion detection running: {STATE['running']}")
+        with state["lock"]:
+            current_emotion = state["last_emotion"]
+            logger.info(f"DEBUG - Facial emotion detection running: {state['running']}")
             logger.info(f"DEBUG - Current facial emotion: {current_emotion}")
             return current_emotion
     except Exception as e:
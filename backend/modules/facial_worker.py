@@ -0,0 +1,202 @@
+import logging
+import multiprocessing as mp
+import threading
+import time
+import traceback
+
+from modules.emotion_events import publish_change
+from modules.metrics import TRANSITIONS, registry, snapshot_delta
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# --- Worker Configuration ---
+RESULT_POLL_INTERVAL = 0.5    # Seconds the supervisor waits on the pipe before checking worker health
+RESTART_BACKOFF_MIN = 1.0     # First restart delay after a crash
+RESTART_BACKOFF_MAX = 30.0    # Restart delay cap for a crash-looping worker
+STABLE_RUN_SECONDS = 60.0     # A worker alive this long resets the backoff
+STOP_TIMEOUT = 3.0            # Seconds to wait for a clean exit before terminating
+METRICS_INTERVAL = 2.0        # Seconds between metric updates sent by the worker
+# The parent counts facial transitions itself when it applies them (publish_change)
+WORKER_LOCAL_METRICS = (TRANSITIONS.name,)
+
+# Spawn rather than fork: the API process has live threads and TensorFlow state
+mp_context = mp.get_context("spawn")
+
+
+# --- Child Process ---
+
+class PipeNotifier:
+    """Stands in for the session's ChangeNotifier inside the worker: forwards transitions to the parent."""
+
+    def __init__(self, conn, state):
+        self.conn = conn
+        self.state = state
+
+    def notify(self, source):
+        # Called by facial_emotion_loop while it holds state["lock"], right after the transition
+        log_entry = self.state["log_data"][-1] if self.state["log_data"] else None
+        self.state["log_data"].clear()  # The parent keeps the log; don't grow it here too
+        try:
+            self.conn.send(("emotion", self.state["last_emotion"], log_entry))
+        except Exception as e:
+            logger.error(f"Facial worker could not send result: {str(e)}")
+
+
+def worker_main(conn, stop_event):
+    """Entry point of the detector process: run the facial loop and stream transitions back."""
+    from modules import facial_emotion
+
+    state = facial_emotion.new_state()
+    state["changes"] = PipeNotifier(conn, state)
+    state["running"] = True
+    loop = state["thread"] = threading.Thread(target=facial_emotion.facial_emotion_loop, args=(state,), daemon=True)
+    loop.start()
+    conn.send(("ready", None, None))
+    last_rate = None
+    sent_metrics = {}
+    metrics_due = time.monotonic() + METRICS_INTERVAL
+
+    def send_metrics():
+        # Counters and stage timings recorded here only reach /metrics through the parent's registry
+        nonlocal sent_metrics
+        current = registry.snapshot(exclude=WORKER_LOCAL_METRICS)
+        deltas = snapshot_delta(current, sent_metrics)
+        if deltas:
+            with state["lock"]:
+                conn.send(("metrics", deltas, None))
+        sent_metrics = current
+
+    while not stop_event.is_set() and loop.is_alive():
+        stop_event.wait(RESULT_POLL_INTERVAL)
+        # Report the governed frame rate when it changes (status endpoints read it in the parent)
+        rate = state["frame_rate"]
+        if rate != last_rate:
+            with state["lock"]:  # Serializes sends with PipeNotifier, which runs under this lock
+                conn.send(("rate", rate, None))
+            last_rate = rate
+        if time.monotonic() >= metrics_due:
+            send_metrics()
+            metrics_due = time.monotonic() + METRICS_INTERVAL
+    state["running"] = False
+    loop.join(STOP_TIMEOUT)
+    try:
+        send_metrics()  # What the loop recorded since the last update
+    except Exception as e:
+        logger.error(f"Facial worker could not send metrics: {str(e)}")
+    conn.close()
+    # A loop that ended on its own is a crash as far as the supervisor is concerned
+    raise SystemExit(0 if stop_event.is_set() else 1)
+
+
+# --- Parent Side ---
+
+class FacialWorkerSupervisor:
+    """Runs facial detection in a child process and mirrors its results into a detector state.
+
+    The child owns the camera, FaceMesh and DeepFace, so none of that work competes with the
+    API for the GIL. Only emotion transitions, the frame rate and metric deltas cross the pipe.
+    A worker that dies while detection is enabled is restarted with exponential backoff.
+    """
+
+    def __init__(self, state):
+        self.state = state
+        self.process = None
+        self.conn = None
+        self.stop_event = None
+        self.running = False
+        self.restarts = 0
+        self.started_at = 0.0
+        self.thread = None
+
+    def _spawn(self):
+        parent_conn, child_conn = mp_context.Pipe(duplex=False)
+        self.stop_event = mp_context.Event()
+        self.process = mp_context.Process(
+            target=worker_main, args=(child_conn, self.stop_event),
+            name="FacialDetectorWorker", daemon=True)
+        self.process.start()
+        child_conn.close()
+        self.conn = parent_conn
+        self.started_at = time.time()
+        logger.info(f"Facial detector worker started (pid {self.process.pid})")
+
+    def _apply(self, message):
+        kind, emotion, log_entry = message
+        if kind == "rate":
+            self.state["frame_rate"] = emotion
+            return
+        if kind == "metrics":
+            registry.merge(emotion)  # Totals recorded in the worker since its last update
+            return
+        if kind != "emotion":
+            return
+        with self.state["lock"]:
+            self.state["last_emotion"] = emotion
+            if log_entry:
+                self.state["log_data"].append(log_entry)
+            publish_change("facial", emotion, self.state["changes"])
+
+    def _supervise(self):
+        backoff = RESTART_BACKOFF_MIN
+        while self.running:
+            try:
+                if self.conn.poll(RESULT_POLL_INTERVAL):
+                    self._apply(self.conn.recv())
+                    continue
+            except (EOFError, OSError):
+                # Pipe closed: the worker is exiting, handled below once it's gone
+                self.process.join(RESULT_POLL_INTERVAL)
+            except Exception as e:
+                logger.error(f"Error reading facial worker result: {str(e)}")
+                logger.debug(traceback.format_exc())
+
+            if self.process.is_alive() or not self.running:
+                continue
+            if time.time() - self.started_at > STABLE_RUN_SECONDS:
+                backoff = RESTART_BACKOFF_MIN
+            logger.warning(f"Facial detector worker exited with code {self.process.exitcode}; "
+                           f"restarting in {backoff:.0f}s")
+            time.sleep(backoff)
+            backoff = min(backoff * 2, RESTART_BACKOFF_MAX)
+            if self.running:
+                self.restarts += 1
+                self._spawn()
+
+    def start(self):
+        if self.running:
+            return
+        self.running = True
+        self._spawn()
+        self.thread = threading.Thread(target=self._supervise, name="FacialWorkerSupervisor", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        if not self.running:
+            return
+        self.running = False
+        self.stop_event.set()
+        self.process.join(STOP_TIMEOUT)
+        if self.process.is_alive():
+            logger.warning("Facial detector worker did not exit in time; terminating")
+            self.process.terminate()
+            self.process.join(STOP_TIMEOUT)
+        if self.thread is not None:
+            self.thread.join(STOP_TIMEOUT)
+        try:
+            # The worker's last metric update arrives as it exits, after the supervisor stopped reading
+            while self.conn.poll(0):
+                message = self.conn.recv()
+                if message[0] == "metrics":
+                    self._apply(message)
+        except (EOFError, OSError):
+            pass
+        try:
+            self.conn.close()
+        except Exception:
+            pass
+        self.state["frame_rate"] = None
+        logger.info("Facial detector worker stopped")
+
+    def is_alive(self):
+        return self.running and self.process is not None and self.process.is_alive()
@@ -0,0 +1,174 @@
+import logging
+import threading
+import time
+import traceback
+
+from modules.metrics import FRAMES_DROPPED
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# --- Capture Configuration ---
+SPARE_SLOTS = 2               # Besides one per reader: the newest frame and the one being filled
+READ_FAILURE_BACKOFF = 0.05   # Seconds the capture thread waits after a failed grab
+
+STALE_FRAMES = FRAMES_DROPPED.labels("facial", "stale")
+
+
+def _after_removal(index, removed):
+    """A ring slot index once slot `removed` has been deleted (None stays None)."""
+    return index - 1 if index is not None and index > removed else index
+
+
+class FrameReader:
+    """One consumer's view of a FrameCapture.
+
+    read() returns the newest frame this reader has not seen yet. The array belongs to the
+    capture ring and stays valid until this reader's next read(): copy anything kept longer.
+    Exposes the same read()/realtime/exhausted/release() surface as a frame source.
+    """
+
+    def __init__(self, capture, on_release=None):
+        self.capture = capture
+        self.on_release = on_release
+        self.taken_id = 0        # Frame id last returned
+        self.in_use = None       # Ring slot holding that frame
+        self.captured_at = None  # time.monotonic() when that frame was grabbed
+        self.released = False
+
+    @property
+    def realtime(self):
+        return self.capture.source.realtime
+
+    @property
+    def exhausted(self):
+        return self.capture.exhausted
+
+    def read(self, timeout=1.0):
+        """(ok, frame); ok is False on timeout or once capture has ended."""
+        capture = self.capture
+        deadline = time.monotonic() + timeout
+        with capture.condition:
+            self.in_use = None  # Done with the previous frame
+            while capture.newest_id <= self.taken_id:
+                remaining = deadline - time.monotonic()
+                if not capture.running or remaining <= 0:
+                    return False, None
+                capture.condition.wait(remaining)
+            self.in_use = capture.newest
+            self.taken_id = capture.newest_id
+            self.captured_at = capture.newest_time
+            return True, capture.buffers[self.in_use]
+
+    def release(self):
+        with self.capture.condition:
+            if self.released:
+                return
+            self.released = True
+        self.capture.remove_reader(self)
+        if self.on_release is not None:
+            self.on_release(self)
+
+
+class FrameCapture:
+    """Grabs frames from a source on its own thread into a small ring of reused arrays.
+
+    Readers always get the newest frame, so however slow a consumer is, it never works on
+    a backlog; frames no reader had time for are dropped and counted as stale. Each reader
+    pins the slot it is working on, so the ring has one slot per reader plus SPARE_SLOTS.
+    """
+
+    def __init__(self, source):
+        self.source = source
+        self.buffers = [None] * SPARE_SLOTS  # Allocated by the first grab into each slot, then reused
+        self.readers = []
+        self.condition = threading.Condition()
+        self.newest = None       # Slot holding the newest complete frame
+        self.newest_id = 0       # Frames grabbed so far
+        self.newest_time = None  # time.monotonic() when the newest frame was grabbed
+        self.filling = None      # Slot the capture thread is grabbing into
+        self.exhausted = False
+        self.running = False
+        self.thread = None
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self._run, name="FrameCapture", daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self, timeout=2.0):
+        with self.condition:
+            self.running = False
+            self.condition.notify_all()
+        if self.thread is not None:
+            self.thread.join(timeout)
+            self.thread = None
+
+    def add_reader(self, on_release=None):
+        reader = FrameReader(self, on_release)
+        with self.condition:
+            self.readers.append(reader)
+            self.buffers.append(None)
+        return reader
+
+    def remove_reader(self, reader):
+        with self.condition:
+            if reader in self.readers:
+                self.readers.remove(reader)
+                reader.in_use = None
+            # Give back the departed reader's slot (a free one: slot indices are remapped)
+            while len(self.buffers) > len(self.readers) + SPARE_SLOTS:
+                slot = self._free_slot()
+                if slot is None:
+                    break
+                del self.buffers[slot]
+                self.newest = _after_removal(self.newest, slot)
+                self.filling = _after_removal(self.filling, slot)
+                for other in self.readers:
+                    other.in_use = _after_removal(other.in_use, slot)
+
+    def frame_age(self):
+        """Seconds since the last successful grab (None before the first)."""
+        with self.condition:
+            return None if self.newest_time is None else time.monotonic() - self.newest_time
+
+    def _free_slot(self):
+        pinned = {reader.in_use for reader in self.readers}
+        for i in range(len(self.buffers)):
+            if i != self.newest and i != self.filling and i not in pinned:
+                return i
+        return None
+
+    def _run(self):
+        try:
+            while self.running:
+                with self.condition:
+                    self.filling = self._free_slot()
+                    buffer = self.buffers[self.filling]
+                ret, frame = self.source.read(buffer)
+                if not ret:
+                    with self.condition:
+                        self.filling = None
+                    if self.source.exhausted:
+                        break
+                    time.sleep(READ_FAILURE_BACKOFF)
+                    continue
+                with self.condition:
+                    if self.newest_id and all(reader.taken_id < self.newest_id for reader in self.readers):
+                        STALE_FRAMES.inc()  # The previous newest frame was never read
+                    # Read self.filling again: a reader leaving meanwhile may have renumbered the slots
+                    self.buffers[self.filling] = frame
+                    self.newest = self.filling
+                    self.filling = None
+                    self.newest_id += 1
+                    self.newest_time = time.monotonic()
+                    self.condition.notify_all()
+        except Exception as e:
+            logger.error(f"Frame capture stopped: {str(e)}")
+            logger.error(traceback.format_exc())
+        finally:
+            with self.condition:
+                self.exhausted = self.exhausted or self.source.exhausted
+                self.running = False
+                self.condition.notify_all()
@@ -0,0 +1,53 @@
+import os
+import time
+
+import numpy as np
+
+# --- Governor Configuration ---
+FACIAL_MIN_FPS = float(os.environ.get("FACIAL_MIN_FPS", 2.0))        # Rate while the learner is still
+FACIAL_MAX_FPS = float(os.environ.get("FACIAL_MAX_FPS", 15.0))       # Rate while something is changing
+FACIAL_CPU_BUDGET = float(os.environ.get("FACIAL_CPU_BUDGET", 0.5))  # Share of one core the frame loop may use
+CALM_SECONDS = 2.0               # Quiet time before dropping back to the minimum rate
+LANDMARK_MOTION_THRESHOLD = 0.004  # Mean landmark movement between analysed frames (fraction of the frame)
+COST_SMOOTHING = 0.2             # Weight of the newest frame in the average processing cost
+
+
+def landmark_motion(points, previous):
+    """Mean absolute x/y movement between two landmark arrays (None when either is missing)."""
+    if points is None or previous is None or points.shape != previous.shape:
+        return None
+    return float(np.abs(points[:, :2] - previous[:, :2]).mean())
+
+
+class FrameRateGovernor:
+    """Chooses how often the facial loop analyses a frame.
+
+    Activity (an emotion transition under way, a duration rule timing, or landmarks that
+    moved) raises the target to max_fps; after CALM_SECONDS without activity it falls to
+    min_fps. The CPU budget caps the rate at budget / average processing cost per frame
+    and always wins, even below min_fps, so the loop stays within its share of the box.
+    """
+
+    def __init__(self, min_fps=FACIAL_MIN_FPS, max_fps=FACIAL_MAX_FPS, cpu_budget=FACIAL_CPU_BUDGET):
+        self.min_fps = min_fps
+        self.max_fps = max(max_fps, min_fps)
+        self.cpu_budget = cpu_budget
+        self.cost = None  # Smoothed seconds of processing per frame
+        self.last_active = None
+        self.rate = self.max_fps
+
+    def update(self, busy_seconds, active, now=None):
+        """Record one analysed frame; returns the rate (fps) to run at until the next one."""
+        now = time.monotonic() if now is None else now
+        self.cost = busy_seconds if self.cost is None else (
+            COST_SMOOTHING * busy_seconds + (1 - COST_SMOOTHING) * self.cost)
+        if active or self.last_active is None:
+            self.last_active = now
+        target = self.max_fps if now - self.last_active < CALM_SECONDS else self.min_fps
+        if self.cpu_budget > 0 and self.cost > 0:
+            target = min(target, self.cpu_budget / self.cost)
+        self.rate = target
+        return self.rate
+
+    def interval(self):
+        return 1.0 / self.rate if self.rate > 0 else 1.0
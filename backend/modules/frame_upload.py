@@ -0,0 +1,253 @@
+import logging
+import os
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+from modules import facial_emotion
+from modules.metrics import FRAMES_DROPPED, STAGE_SECONDS, track_queue
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# --- Upload Configuration ---
+FRAME_UPLOAD_MAX_FPS = float(os.environ.get("FRAME_UPLOAD_MAX_FPS", 5.0))       # Frames per second accepted per session
+FRAME_UPLOAD_MAX_BYTES = int(os.environ.get("FRAME_UPLOAD_MAX_BYTES", 512 * 1024))  # Largest JPEG accepted
+FRAME_UPLOAD_QUEUE = int(os.environ.get("FRAME_UPLOAD_QUEUE", 64))              # Frames decoding or waiting, all sessions
+FRAME_DECODE_WORKERS = int(os.environ.get("FRAME_DECODE_WORKERS", 2))           # JPEG decode threads
+FRAME_INFERENCE_WORKERS = int(os.environ.get("FRAME_INFERENCE_WORKERS", 1))     # Threads running batches (one FaceMesh each)
+FRAME_BATCH_SIZE = int(os.environ.get("FRAME_BATCH_SIZE", 8))                   # Frames (from different sessions) per batch
+FRAME_BATCH_WAIT = float(os.environ.get("FRAME_BATCH_WAIT", 0.02))              # Seconds a batch waits to fill up
+
+DECODE_SECONDS = STAGE_SECONDS.labels("upload", "decode")
+BATCH_SECONDS = STAGE_SECONDS.labels("upload", "batch")
+UPLOAD_FACE_MESH_SECONDS = STAGE_SECONDS.labels("upload", "face_mesh")
+
+
+class FrameUploadRejected(Exception):
+    """Raised by submit() when a frame is not accepted; `reason` is "too_large", "throttled" or "overloaded"."""
+
+    def __init__(self, reason, message):
+        super().__init__(message)
+        self.reason = reason
+
+
+def _new_slot():
+    return {
+        "last_accepted": None,  # time.monotonic() of the last accepted upload (rate limit)
+        "pending": None,        # (frame, timestamp) decoded and waiting for a batch
+        "in_flight": False,     # A batch is working on this session's previous frame
+    }
+
+
+class FrameUploadService:
+    """Classifies JPEG frames posted by clients that cannot run FaceMesh themselves.
+
+    submit() rate-limits each session and hands the JPEG to a decode pool. Each session keeps
+    only its newest decoded frame; inference threads collect up to FRAME_BATCH_SIZE frames of
+    different sessions, run FaceMesh on each and DeepFace on all face crops in one call, then
+    feed the results through the session's rules, smoothing and emotion lock. Frames are shed
+    (503) once FRAME_UPLOAD_QUEUE frames are outstanding, so the service degrades instead of
+    building a backlog.
+    """
+
+    def __init__(self, max_fps=FRAME_UPLOAD_MAX_FPS, queue_size=FRAME_UPLOAD_QUEUE,
+                 decode_workers=FRAME_DECODE_WORKERS, inference_workers=FRAME_INFERENCE_WORKERS,
+                 batch_size=FRAME_BATCH_SIZE, batch_wait=FRAME_BATCH_WAIT):
+        self.min_interval = 1.0 / max_fps if max_fps > 0 else 0.0
+        self.queue_size = queue_size
+        self.decode_workers = decode_workers
+        self.inference_workers = inference_workers
+        self.batch_size = batch_size
+        self.batch_wait = batch_wait
+        self.condition = threading.Condition()
+        self.outstanding = 0  # Frames accepted and not yet classified or dropped
+        self.ready = []       # States with a pending frame, oldest first
+        self.decoder = None
+        self.threads = []
+        self.running = False
+
+    def start(self):
+        with self.condition:
+            if self.running:
+                return
+            self.running = True
+            self.decoder = ThreadPoolExecutor(max_workers=self.decode_workers, thread_name_prefix="FrameDecode")
+            self.threads = [threading.Thread(target=self._run, name=f"FrameInference-{i}", daemon=True)
+                            for i in range(self.inference_workers)]
+        for thread in self.threads:
+            thread.start()
+        logger.info(f"Frame upload service started ({self.decode_workers} decoders, {self.inference_workers} inference threads)")
+
+    def stop(self, timeout=2.0):
+        with self.condition:
+            if not self.running:
+                return
+            self.running = False
+            self.condition.notify_all()
+        self.decoder.shutdown(wait=False)
+        for thread in self.threads:
+            thread.join(timeout)
+        self.threads = []
+
+    def depth(self):
+        return self.outstanding
+
+    def submit(self, state, data):
+        """Accept one JPEG for the session's facial detector, or raise FrameUploadRejected."""
+        if len(data) > FRAME_UPLOAD_MAX_BYTES:
+            FRAMES_DROPPED.labels("upload", "too_large").inc()
+            raise FrameUploadRejected("too_large", f"Frames are limited to {FRAME_UPLOAD_MAX_BYTES} bytes")
+        self.start()
+        timestamp = state["clock"].time()
+        with self.condition:
+            slot = state["upload"]
+            if slot is None:
+                slot = state["upload"] = _new_slot()
+            now = time.monotonic()
+            if slot["last_accepted"] is not None and now - slot["last_accepted"] < self.min_interval:
+                FRAMES_DROPPED.labels("upload", "throttled").inc()
+                raise FrameUploadRejected("throttled", f"At most {1 / self.min_interval:g} frames per second per session")
+            if self.outstanding >= self.queue_size:
+                FRAMES_DROPPED.labels("upload", "shed").inc()
+                raise FrameUploadRejected("overloaded", "Frame queue is full, retry later")
+            slot["last_accepted"] = now
+            self.outstanding += 1
+        self.decoder.submit(self._decode, state, data, timestamp)
+
+    def _decode(self, state, data, timestamp):
+        try:
+            with DECODE_SECONDS.time():
+                frame = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+        except Exception as e:
+            logger.debug(f"Frame decode failed: {str(e)}")
+            frame = None
+        with self.condition:
+            if frame is None:
+                FRAMES_DROPPED.labels("upload", "undecodable").inc()
+                self.outstanding -= 1
+                return
+            slot = state["upload"]
+            if slot["pending"] is not None:
+                # The session is ahead of inference: only its newest frame is worth classifying
+                FRAMES_DROPPED.labels("upload", "superseded").inc()
+                self.outstanding -= 1
+            elif not slot["in_flight"]:
+                self.ready.append(state)
+            slot["pending"] = (frame, timestamp)
+            self.condition.notify()
+
+    def _take_batch(self):
+        """Up to batch_size pending frames of different sessions; None once stopped."""
+        with self.condition:
+            while self.running and not self.ready:
+                self.condition.wait()
+            deadline = time.monotonic() + self.batch_wait
+            while self.running and len(self.ready) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self.condition.wait(remaining)
+            if not self.running:
+                return None
+            batch = []
+            for state in self.ready[:self.batch_size]:
+                slot = state["upload"]
+                frame, timestamp = slot["pending"]
+                slot["pending"] = None
+                slot["in_flight"] = True
+                batch.append((state, frame, timestamp))
+            del self.ready[:self.batch_size]
+            return batch
+
+    def _finish(self, state):
+        with self.condition:
+            slot = state["upload"]
+            slot["in_flight"] = False
+            self.outstanding -= 1
+            if slot["pending"] is not None:
+                self.ready.append(state)
+                self.condition.notify()
+
+    def _run(self):
+        # Frames of different sessions interleave, so FaceMesh runs in static image mode
+        face_mesh = facial_emotion.mp_face_mesh.FaceMesh(static_image_mode=True, max_num_faces=1,
+                                                         min_detection_confidence=0.7)
+        try:
+            while True:
+                batch = self._take_batch()
+                if batch is None:
+                    return
+                try:
+                    with BATCH_SECONDS.time():
+                        self._classify(face_mesh, batch)
+                except Exception as e:
+                    FRAMES_DROPPED.labels("upload", "error").inc(len(batch))
+                    logger.error(f"Error classifying uploaded frames: {str(e)}")
+                    logger.error(traceback.format_exc())
+                finally:
+                    for state, _, _ in batch:
+                        self._finish(state)
+        finally:
+            face_mesh.close()
+
+    def _classify(self, face_mesh, batch):
+        # 1. Landmarks, one frame at a time (MediaPipe has no batch API)
+        landmarks = []
+        for _, frame, _ in batch:
+            with UPLOAD_FACE_MESH_SECONDS.time():
+                results = face_mesh.process(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
+            landmarks.append([facial_emotion.landmarks_to_array(face) for face in results.multi_face_landmarks or []])
+
+        # 2. The landmark classifier where configured, then DeepFace on the face crops of every
+        #    session it could not decide and that is due for an analysis, in one call. Sessions
+        #    whose last face frame a rule decided (Sleepy, Bored, Confused) are left out: the
+        #    rules will most likely decide this frame too and ignore any analysis. If they do
+        #    not, the frame falls back to the session's last DeepFace result, or to the
+        #    classifier run by classify_landmarks, and the next frame gets a crop again.
+        min_interval = 1.0 / facial_emotion.DEEPFACE_MAX_RATE if facial_emotion.DEEPFACE_MAX_RATE > 0 else 0.0
+        fast, crops, owners = {}, [], []
+        for i, (state, frame, timestamp) in enumerate(batch):
+            if not landmarks[i]:
+                continue
+            with state["remote_lock"]:
+                tracker = facial_emotion.remote_tracker(state)
+                rule_decided, last = tracker["rule_decided"], tracker["deepface_time"]
+            if rule_decided:
+                continue
+            h, w = frame.shape[:2]
+            fast[i] = facial_emotion.landmark_analysis(landmarks[i][0], w, h)
+            if fast[i] is not None:
+                continue
+            if last is not None and timestamp - last < min_interval:
+                continue  # Rate limited like the camera loop's DeepFace worker
+            face = facial_emotion.face_roi(frame, landmarks[i][0], w, h)
+            if face is not None:
+                crops.append(face)
+                owners.append(i)
+        analyses = dict(zip(owners, facial_emotion.run_deepface_batch(crops))) if crops else {}
+
+        # 3. Rules, smoothing and emotion lock, per session in frame order
+        for i, (state, frame, timestamp) in enumerate(batch):
+            if not state["running"]:
+                FRAMES_DROPPED.labels("upload", "stopped").inc()
+                continue
+            h, w = frame.shape[:2]
+            with state["remote_lock"]:
+                tracker = facial_emotion.remote_tracker(state)
+                if i in analyses:
+                    tracker["deepface"], tracker["deepface_time"] = analyses[i], timestamp
+                analysis = fast.get(i)
+                if analysis is None and tracker["deepface"] is not None and (
+                        timestamp - tracker["deepface_time"] <= facial_emotion.DEEPFACE_MAX_RESULT_AGE):
+                    analysis = tracker["deepface"]
+                facial_emotion.classify_remote_frame(state, tracker, landmarks[i], w, h, timestamp, analysis)
+
+
+# Process-wide service shared by every session with FACIAL_SOURCE=upload (threads start on first use)
+frame_upload_service = FrameUploadService()
+track_queue("frame_uploads", frame_upload_service.depth)
@@ -0,0 +1,89 @@
+import struct
+
+import numpy as np
+
+# --- Landmark Batch Format ---
+# Browsers that run FaceMesh themselves POST batches of landmarks instead of frames
+# (see /api/landmarks). All integers are little-endian.
+#
+#   header  "EMLB", version (u8), flags (u8, reserved), landmarks per face (u16),
+#           frames (u16), frame width (u16), frame height (u16), base time (f64, epoch seconds)
+#   frame   offset from base time in ms (u32), faces (u8, 0 or 1),
+#           then per face: landmarks x (x, y) as u16, normalized coordinate * 65535
+#
+# Kept free of cv2/mediapipe imports so the format can be parsed (and produced by tools) anywhere.
+MAGIC = b"EMLB"
+VERSION = 1
+HEADER = struct.Struct("<4sBBHHHHd")
+FRAME_HEADER = struct.Struct("<IB")
+COORDINATE_SCALE = 65535.0
+MIN_LANDMARKS = 468     # FaceMesh's mesh
+MAX_LANDMARKS = 478     # The mesh with irises (refineLandmarks)
+MAX_BATCH_FRAMES = 600  # A minute at 10 fps; larger uploads are rejected
+# Largest valid batch: every frame with one face of MAX_LANDMARKS (bounds the request body)
+MAX_BATCH_BYTES = HEADER.size + MAX_BATCH_FRAMES * (FRAME_HEADER.size + MAX_LANDMARKS * 2 * 2)
+
+
+def parse_landmark_batch(data):
+    """Decode one batch; raises ValueError on anything malformed.
+
+    Returns {"width", "height", "frames"} where frames is a list of (timestamp, faces) and
+    faces a list of float32 (N, 3) arrays (normalized x, y; z is not sent and reads 0),
+    the same shape landmarks_to_array() gives for FaceMesh results on the server.
+    """
+    if len(data) < HEADER.size:
+        raise ValueError("Landmark batch is shorter than its header")
+    magic, version, _flags, landmarks, frame_count, width, height, base_time = HEADER.unpack_from(data)
+    if magic != MAGIC:
+        raise ValueError("Not a landmark batch")
+    if version != VERSION:
+        raise ValueError(f"Unsupported landmark batch version {version}")
+    if not MIN_LANDMARKS <= landmarks <= MAX_LANDMARKS:
+        raise ValueError(f"Faces need {MIN_LANDMARKS} to {MAX_LANDMARKS} landmarks, got {landmarks}")
+    if frame_count > MAX_BATCH_FRAMES:
+        raise ValueError(f"At most {MAX_BATCH_FRAMES} frames per batch, got {frame_count}")
+    if not width or not height:
+        raise ValueError("Frame size must be non-zero")
+
+    face_bytes = landmarks * 2 * 2
+    offset = HEADER.size
+    frames = []
+    previous = -1
+    for _ in range(frame_count):
+        if offset + FRAME_HEADER.size > len(data):
+            raise ValueError("Landmark batch ends inside a frame header")
+        offset_ms, face_count = FRAME_HEADER.unpack_from(data, offset)
+        offset += FRAME_HEADER.size
+        if face_count > 1:
+            raise ValueError("At most one face per frame")
+        if offset_ms < previous:
+            raise ValueError("Frame offsets must not decrease")
+        previous = offset_ms
+        faces = []
+        for _ in range(face_count):
+            if offset + face_bytes > len(data):
+                raise ValueError("Landmark batch ends inside a face")
+            quantized = np.frombuffer(data, dtype="<u2", count=landmarks * 2, offset=offset).reshape(landmarks, 2)
+            points = np.zeros((landmarks, 3), dtype=np.float32)
+            points[:, :2] = quantized
+            points[:, :2] /= COORDINATE_SCALE
+            faces.append(points)
+            offset += face_bytes
+        frames.append((base_time + offset_ms / 1000.0, faces))
+    if offset != len(data):
+        raise ValueError("Trailing bytes after the last frame")
+    return {"width": width, "height": height, "frames": frames}
+
+
+def encode_landmark_batch(frames, width, height, base_time=None):
+    """Inverse of parse_landmark_batch, for tools and replays: frames is a list of (timestamp, faces)."""
+    if base_time is None:
+        base_time = frames[0][0] if frames else 0.0
+    landmarks = next((len(faces[0]) for _, faces in frames if faces), MIN_LANDMARKS)
+    parts = [HEADER.pack(MAGIC, VERSION, 0, landmarks, len(frames), width, height, base_time)]
+    for timestamp, faces in frames:
+        parts.append(FRAME_HEADER.pack(int(round((timestamp - base_time) * 1000)), len(faces)))
+        for points in faces:
+            xy = np.clip(np.asarray(points, dtype=np.float32)[:, :2], 0.0, 1.0)
+            parts.append(np.round(xy * COORDINATE_SCALE).astype("<u2").tobytes())
+    return b"".join(parts)
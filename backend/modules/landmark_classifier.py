@@ -0,0 +1,141 @@
+import logging
+import os
+import threading
+import traceback
+
+import numpy as np
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# --- Landmark Classifier ---
+# A softmax regression over face geometry that imitates DeepFace's emotion model, so the facial
+# loop can tell Frustrated from Engaged without running TensorFlow on every frame. It is fitted on
+# DeepFace outputs recorded offline (see train_landmark_classifier.py) and predicts the same seven
+# probabilities, in DeepFace's percent scale, so deepface_emotion() reads its results unchanged.
+# Only numpy is needed here; recording the training data is what needs FaceMesh and DeepFace.
+LANDMARK_MODEL_PATH = os.environ.get("LANDMARK_MODEL_PATH", "landmark_classifier.npz")
+MODEL_VERSION = 1
+
+# DeepFace's emotion labels, in the order of its model's outputs
+DEEPFACE_LABELS = ("angry", "disgust", "fear", "happy", "sad", "surprise", "neutral")
+
+# Brows, eyelids, nose, mouth corners and lips: the points that move with expressions
+EXPRESSION_LANDMARKS = np.array([
+    70, 63, 105, 66, 107, 336, 296, 334, 293, 300,  # Brows (left, right)
+    159, 145, 33, 133, 386, 374, 362, 263,          # Eyelids and eye corners
+    1, 4, 98, 327,                                  # Nose tip and wings
+    61, 291, 0, 17, 13, 14, 39, 269, 181, 405,      # Mouth corners and lips
+    152,                                            # Chin
+])
+
+
+def landmark_inputs(points, w, h):
+    """Classifier input for one face: expression landmarks in an eye-aligned frame, as float32.
+
+    Coordinates are taken in pixels (so the aspect ratio is right), centred between the eye
+    corners, rotated so the eyes are level and scaled by the eye distance, which removes head
+    position, roll and distance from the camera.
+    """
+    xy = points[:, :2] * np.array([w, h], dtype=np.float32)
+    left, right = xy[33], xy[263]
+    axis = right - left
+    distance = float(np.hypot(axis[0], axis[1]))
+    if distance < 1e-6:
+        return None
+    cos, sin = axis / distance
+    rotation = np.array([[cos, -sin], [sin, cos]], dtype=np.float32)  # Row vectors times this undo the roll
+    aligned = (xy[EXPRESSION_LANDMARKS] - (left + right) / 2) @ rotation / distance
+    return aligned.ravel().astype(np.float32)
+
+
+def softmax(logits):
+    logits = logits - logits.max(axis=-1, keepdims=True)
+    exp = np.exp(logits)
+    return exp / exp.sum(axis=-1, keepdims=True)
+
+
+class LandmarkClassifier:
+    """Standardized inputs -> softmax over DeepFace's emotion labels."""
+
+    def __init__(self, weights, bias, mean, scale, labels=DEEPFACE_LABELS):
+        self.weights = np.asarray(weights, dtype=np.float32)  # (inputs, classes)
+        self.bias = np.asarray(bias, dtype=np.float32)
+        self.mean = np.asarray(mean, dtype=np.float32)
+        self.scale = np.asarray(scale, dtype=np.float32)
+        self.labels = tuple(labels)
+
+    def predict_proba(self, inputs):
+        """Class probabilities (rows sum to 1) for an (n, inputs) array, or one vector."""
+        return softmax(((inputs - self.mean) / self.scale) @ self.weights + self.bias)
+
+    def analyze(self, points, w, h):
+        """(analysis, confidence) for one face, the analysis shaped like DeepFace.analyze's; (None, 0.0) if unusable."""
+        inputs = landmark_inputs(points, w, h)
+        if inputs is None:
+            return None, 0.0
+        probabilities = self.predict_proba(inputs)
+        best = int(np.argmax(probabilities))
+        emotion = {label: float(p) * 100 for label, p in zip(self.labels, probabilities)}
+        return [{"dominant_emotion": self.labels[best], "emotion": emotion}], float(probabilities[best])
+
+    def save(self, path):
+        np.savez(path, version=MODEL_VERSION, weights=self.weights, bias=self.bias, mean=self.mean,
+                 scale=self.scale, labels=np.array(self.labels), landmarks=EXPRESSION_LANDMARKS)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            if int(data["version"]) != MODEL_VERSION:
+                raise ValueError(f"{path} is a version {int(data['version'])} model, expected {MODEL_VERSION}")
+            if not np.array_equal(data["landmarks"], EXPRESSION_LANDMARKS):
+                raise ValueError(f"{path} was fitted on different landmarks")
+            return cls(data["weights"], data["bias"], data["mean"], data["scale"], [str(l) for l in data["labels"]])
+
+
+def fit(inputs, targets, l2=1e-3, learning_rate=0.5, epochs=500):
+    """Fit a LandmarkClassifier by full-batch gradient descent on cross-entropy.
+
+    `targets` are per-sample probability vectors over DEEPFACE_LABELS (DeepFace's own output,
+    so the model learns its uncertainty too, not just the dominant label).
+    """
+    inputs = np.asarray(inputs, dtype=np.float64)
+    targets = np.asarray(targets, dtype=np.float64)
+    targets = targets / targets.sum(axis=1, keepdims=True)
+    mean = inputs.mean(axis=0)
+    scale = inputs.std(axis=0)
+    scale[scale < 1e-6] = 1.0
+    x = (inputs - mean) / scale
+    n, classes = len(x), targets.shape[1]
+    weights = np.zeros((x.shape[1], classes))
+    bias = np.log(targets.mean(axis=0) + 1e-6)  # Start from the class priors
+    for _ in range(epochs):
+        error = softmax(x @ weights + bias) - targets
+        weights -= learning_rate * (x.T @ error / n + l2 * weights)
+        bias -= learning_rate * error.mean(axis=0)
+    return LandmarkClassifier(weights, bias, mean, scale)
+
+
+# --- Shared Model ---
+_model = None
+_model_loaded = False
+_model_lock = threading.Lock()
+
+
+def get_landmark_classifier(path=None):
+    """The classifier at LANDMARK_MODEL_PATH, loaded on first use; None if it is missing or unreadable."""
+    global _model, _model_loaded
+    with _model_lock:
+        if not _model_loaded:
+            _model_loaded = True
+            path = path or LANDMARK_MODEL_PATH
+            if not os.path.exists(path):
+                logger.warning(f"Landmark classifier {path} not found; facial detection falls back to DeepFace")
+            else:
+                try:
+                    _model = LandmarkClassifier.load(path)
+                    logger.info(f"Loaded landmark classifier from {path}")
+                except Exception as e:
+                    logger.error(f"Error loading landmark classifier {path}: {str(e)}")
+                    logger.error(traceback.format_exc())
+        return _model
@@ -0,0 +1,275 @@
+import bisect
+import threading
+import time
+import weakref
+from contextlib import contextmanager
+
+# --- Low-overhead Instrumentation ---
+# Counters and histograms keep one shard per thread. A thread only ever writes its own shard,
+# so recording takes no lock; /metrics sums the shards when it renders. Values are exposed in
+# the Prometheus text format (version 0.0.4).
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class _ShardOwner:
+    """Lives in a thread's threading.local: collected when the thread ends, which retires its shards."""
+
+
+class _Sharded:
+    """Per-thread lists of `size` numbers, summed on read.
+
+    When a thread ends, its shard is folded into `retired` and forgotten, so threads that come
+    and go (per-session detector loops, threadpool workers) do not leave shards behind.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.local = threading.local()
+        self.shards = {}              # id(shard) -> shard of a live thread
+        self.retired = [0] * size     # Totals of threads that have ended
+        self.lock = threading.RLock()  # Only taken when a thread first records or ends, and on read
+
+    def shard(self):
+        try:
+            return self.local.shard
+        except AttributeError:
+            shard = [0] * self.size
+            owner = _ShardOwner()
+            with self.lock:
+                self.shards[id(shard)] = shard
+            weakref.finalize(owner, self._retire, shard)
+            self.local.shard = shard
+            self.local.owner = owner
+            return shard
+
+    def _retire(self, shard):
+        with self.lock:
+            if self.shards.pop(id(shard), None) is not None:
+                for i, value in enumerate(shard):
+                    self.retired[i] += value
+
+    def add(self, values):
+        """Add totals recorded elsewhere (another process) to this thread's shard."""
+        shard = self.shard()
+        for i, value in enumerate(values):
+            shard[i] += value
+
+    def total(self):
+        with self.lock:
+            shards = list(self.shards.values())
+            totals = list(self.retired)
+        for shard in shards:
+            for i, value in enumerate(shard):
+                totals[i] += value
+        return totals
+
+
+class Counter:
+    def __init__(self):
+        self.values = _Sharded(1)
+
+    def inc(self, amount=1):
+        self.values.shard()[0] += amount
+
+    def samples(self, name, labels):
+        return [(name, labels, self.values.total()[0])]
+
+
+class Gauge:
+    """A value that is set directly, or read from `fn` at render time (e.g. a queue depth)."""
+
+    def __init__(self, fn=None):
+        self.fn = fn
+        self.value = 0
+
+    def set(self, value):
+        self.value = value
+
+    def samples(self, name, labels):
+        return [(name, labels, self.fn() if self.fn else self.value)]
+
+
+# Raw observations per histogram while capture_samples() is active (benchmarks need exact percentiles)
+_captured = None
+
+
+@contextmanager
+def capture_samples():
+    """Also record every histogram observation made inside the block; yields {histogram: [values]}."""
+    global _captured
+    _captured = captured = {}
+    try:
+        yield captured
+    finally:
+        _captured = None
+
+
+class Histogram:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        # One count per bucket, one for +Inf, then sum and count
+        self.values = _Sharded(len(self.buckets) + 3)
+
+    def observe(self, value):
+        shard = self.values.shard()
+        shard[bisect.bisect_left(self.buckets, value)] += 1
+        shard[-2] += value
+        shard[-1] += 1
+        if _captured is not None:
+            _captured.setdefault(self, []).append(value)
+
+    @contextmanager
+    def time(self):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start)
+
+    def samples(self, name, labels):
+        totals = self.values.total()
+        rows = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float("inf"),), totals):
+            cumulative += count
+            le = "+Inf" if bound == float("inf") else repr(bound)
+            rows.append((name + "_bucket", labels + (("le", le),), cumulative))
+        rows.append((name + "_sum", labels, totals[-2]))
+        rows.append((name + "_count", labels, totals[-1]))
+        return rows
+
+
+class MetricFamily:
+    """A named metric with optional labels; each label combination is a separate child."""
+
+    def __init__(self, name, help_text, kind, label_names, factory):
+        self.name = name
+        self.help = help_text
+        self.kind = kind
+        self.label_names = tuple(label_names)
+        self.factory = factory
+        self.children = {}
+        self.lock = threading.Lock()
+        if not self.label_names:
+            self.children[()] = factory()
+
+    def labels(self, *values, **kwargs):
+        key = tuple(values) or tuple(kwargs[name] for name in self.label_names)
+        child = self.children.get(key)
+        if child is None:
+            with self.lock:
+                child = self.children.setdefault(key, self.factory())
+        return child
+
+    # Unlabelled families act as their single child
+    def __getattr__(self, attr):
+        if attr in ("inc", "set", "observe", "time"):
+            return getattr(self.children[()], attr)
+        raise AttributeError(attr)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for key, child in list(self.children.items()):
+            for name, labels, value in child.samples(self.name, tuple(zip(self.label_names, key))):
+                label_text = ",".join(f'{k}="{v}"' for k, v in labels)
+                lines.append(f"{name}{{{label_text}}} {value}" if label_text else f"{name} {value}")
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.families = {}
+        self.lock = threading.Lock()
+
+    def _register(self, name, help_text, kind, label_names, factory):
+        with self.lock:
+            if name not in self.families:
+                self.families[name] = MetricFamily(name, help_text, kind, label_names, factory)
+            return self.families[name]
+
+    def counter(self, name, help_text, labels=()):
+        return self._register(name, help_text, "counter", labels, Counter)
+
+    def gauge(self, name, help_text, labels=(), fn=None):
+        return self._register(name, help_text, "gauge", labels, lambda: Gauge(fn))
+
+    def histogram(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        return self._register(name, help_text, "histogram", labels, lambda: Histogram(buckets))
+
+    def snapshot(self, exclude=()):
+        """{family name: {label values: totals}} of every counter and histogram (gauges are local)."""
+        with self.lock:
+            families = [f for f in self.families.values() if f.kind != "gauge" and f.name not in exclude]
+        return {family.name: {key: child.values.total() for key, child in list(family.children.items())}
+                for family in families}
+
+    def merge(self, deltas):
+        """Add snapshot_delta() totals from another process (e.g. the facial worker) to this registry.
+
+        Families this process does not know are ignored.
+        """
+        with self.lock:
+            families = dict(self.families)
+        for name, children in deltas.items():
+            family = families.get(name)
+            if family is None or family.kind == "gauge":
+                continue
+            for key, values in children.items():
+                family.labels(*key).values.add(values)
+
+    def render(self):
+        with self.lock:
+            families = list(self.families.values())
+        lines = []
+        for family in families:
+            lines.extend(family.render())
+        return "\n".join(lines) + "\n"
+
+
+def snapshot_delta(current, previous):
+    """What changed between two snapshot()s, without the unchanged series (for merge())."""
+    deltas = {}
+    for name, children in current.items():
+        before = previous.get(name, {})
+        for key, values in children.items():
+            old = before.get(key)
+            delta = values if old is None else [v - o for v, o in zip(values, old)]
+            if any(delta):
+                deltas.setdefault(name, {})[key] = delta
+    return deltas
+
+
+# Process-wide registry exposed at /metrics
+registry = MetricsRegistry()
+
+# --- Pipeline Metrics ---
+STAGE_SECONDS = registry.histogram(
+    "emolearn_stage_seconds", "Time spent in each pipeline stage", labels=("detector", "stage"))
+FRAMES = registry.counter(
+    "emolearn_frames_total", "Frames or audio windows processed", labels=("detector",))
+FRAMES_DROPPED = registry.counter(
+    "emolearn_frames_dropped_total", "Frames or audio windows that could not be processed",
+    labels=("detector", "reason"))
+TRANSITIONS = registry.counter(
+    "emolearn_emotion_transitions_total", "Smoothed emotion changes reported by a detector", labels=("detector",))
+FUSIONS = registry.counter("emolearn_fusions_total", "Fused emotion samples produced by the combiner")
+CSV_ROWS = registry.counter("emolearn_csv_rows_total", "Detector CSV rows by result (written or dropped)", labels=("result",))
+QUEUE_DEPTH = registry.gauge("emolearn_queue_depth", "Items waiting in an internal queue", labels=("queue",))
+MOTION_GATE_CHECKS = registry.counter(
+    "emolearn_motion_gate_checks_total", "Facial frames checked by the motion gate before FaceMesh")
+FACEMESH_SKIPPED = registry.counter(
+    "emolearn_facemesh_skipped_total", "Facial frames that reused the last landmarks instead of running FaceMesh")
+FACEMESH_SKIP_RATIO = registry.gauge(
+    "emolearn_facemesh_skip_ratio", "Share of motion-gated facial frames that skipped FaceMesh, since start",
+    fn=lambda: _ratio(FACEMESH_SKIPPED, MOTION_GATE_CHECKS))
+
+
+def _ratio(part, whole):
+    whole = whole.children[()].values.total()[0]
+    return part.children[()].values.total()[0] / whole if whole else 0.0
+
+
+def track_queue(name, fn):
+    """Report `fn()` as the depth of queue `name` whenever metrics are rendered."""
+    QUEUE_DEPTH.children[(name,)] = Gauge(fn)
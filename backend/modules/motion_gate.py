@@ -0,0 +1,68 @@
+import os
+
+import cv2
+import numpy as np
+
+# --- Motion Gate Configuration ---
+# A learner reading the screen barely moves for minutes, yet every frame used to go through
+# FaceMesh. The gate compares a small grayscale copy of each frame with the last frame FaceMesh
+# saw; when they match, the loop reuses that frame's landmarks and features instead.
+MOTION_GATE = os.environ.get("MOTION_GATE", "1") == "1"
+MOTION_GATE_THRESHOLD = float(os.environ.get("MOTION_GATE_THRESHOLD", 2.0))  # Mean gray-level change (0-255) that counts as motion
+MOTION_GATE_REFRESH = float(os.environ.get("MOTION_GATE_REFRESH", 0.5))      # Seconds a frame's landmarks may be reused at most
+MOTION_GATE_WIDTH = 64  # Width of the compared copy (the height keeps the frame's aspect ratio)
+
+
+class MotionGate:
+    """Decides whether a frame differs enough from the last processed one to need FaceMesh.
+
+    Frames are shrunk to MOTION_GATE_WIDTH pixels wide and converted to gray into buffers
+    allocated once per frame size, so a check costs a few small OpenCV calls and no allocation.
+    Bilinear shrinking averages little, but is ~20x cheaper than INTER_AREA; the default
+    threshold still sits above camera noise and below a face moving a couple of pixels.
+    The reference only moves when a frame is processed, so slow drift adds up until it counts.
+    A frame is processed at least every `refresh` seconds whatever the difference, which keeps
+    changes too small to see at this size (an eye closing) from going unnoticed for longer.
+    """
+
+    def __init__(self, threshold=MOTION_GATE_THRESHOLD, refresh=MOTION_GATE_REFRESH, width=MOTION_GATE_WIDTH):
+        self.threshold = threshold
+        self.refresh = refresh
+        self.width = width
+        self.shape = None       # Shape of the frames the buffers were allocated for
+        self.small = None       # Downscaled BGR frame
+        self.gray = None        # Downscaled gray frame being checked
+        self.reference = None   # Downscaled gray frame FaceMesh last saw
+        self.diff = None
+        self.refreshed_at = None
+        self.checked = 0
+        self.skipped = 0
+
+    def _allocate(self, frame):
+        h, w = frame.shape[:2]
+        size = (self.width, max(1, round(h * self.width / w)))
+        self.shape = frame.shape
+        self.small = np.empty((size[1], size[0]) + frame.shape[2:], dtype=np.uint8)
+        self.gray = np.empty((size[1], size[0]), dtype=np.uint8)
+        self.reference = np.empty_like(self.gray)
+        self.diff = np.empty_like(self.gray)
+        self.refreshed_at = None
+
+    def changed(self, frame, now):
+        """True if the frame needs FaceMesh (it then becomes the reference); False to reuse the last result."""
+        self.checked += 1
+        if frame.shape != self.shape:
+            self._allocate(frame)
+        cv2.resize(frame, (self.small.shape[1], self.small.shape[0]), dst=self.small, interpolation=cv2.INTER_LINEAR)
+        if self.small.ndim == 3:
+            cv2.cvtColor(self.small, cv2.COLOR_BGR2GRAY, dst=self.gray)
+        else:
+            self.gray[:] = self.small
+        if self.refreshed_at is not None and now - self.refreshed_at < self.refresh:
+            cv2.absdiff(self.gray, self.reference, dst=self.diff)
+            if cv2.mean(self.diff)[0] < self.threshold:
+                self.skipped += 1
+                return False
+        self.gray, self.reference = self.reference, self.gray
+        self.refreshed_at = now
+        return True
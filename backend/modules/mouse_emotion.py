@@ -2,11 +2,12 @@ import time
 import threading
 import logging
 from collections import deque
-import pandas as pd
-from datetime import datetime
-import os
 import numpy as np # For calculating mean/std dev for movement
 import traceback # Ensure traceback is imported
+from modules.emotion_events import emotion_changes, publish_change
+from modules.event_log import event_sink
+from modules.metrics import STAGE_SECONDS
+from modules.clock import VirtualClock, system_clock
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -46,27 +47,42 @@ BORED_MAX_MOVEMENT_SPEED = 25
 # High click rate AND high movement speed over short period
 FRUSTRATED_MIN_COMBINED_ACTIVITY_SCORE = 0.8 # Score combines normalized click rate and movement speed
 
+# Seconds between evaluations of the detection loop
+EVALUATION_INTERVAL = 0.5
+
 # Smoothing
 EMOTION_HISTORY_LENGTH = 15 # Number of recent frames to consider for majority emotion
 MOUSE_METRIC_HISTORY_LENGTH = 20 # Number of recent samples for movement metrics
 
 # --- Shared State ---
 # This dictionary holds the real-time state of the mouse interaction system.
-STATE = {
-    "running": False, # Flag to control the main detection loop
-    "last_emotion": "Engaged", # Stores the last detected and smoothed emotion
-    "click_times": deque(maxlen=MOUSE_METRIC_HISTORY_LENGTH), # Timestamps of clicks
-    "hover_start_time": None, # Timestamp when a hover started
-    "hover_durations": deque(maxlen=MOUSE_METRIC_HISTORY_LENGTH), # Durations of individual hovers
-    "last_mouse_x": None, # Last known mouse X coordinate for movement tracking
-    "last_mouse_y": None, # Last known mouse Y coordinate for movement tracking
-    "last_move_time": None, # Timestamp of the last mouse movement
-    "movement_distances": deque(maxlen=MOUSE_METRIC_HISTORY_LENGTH), # Distances moved per short interval
-    "movement_speeds": deque(maxlen=MOUSE_METRIC_HISTORY_LENGTH), # Calculated speeds per short interval
-    "last_activity_time": time.time(), # Overall last activity (click or move)
-    "emotion_history": deque(maxlen=EMOTION_HISTORY_LENGTH), # History of classified emotions for smoothing
-    "lock": threading.Lock(), # A lock for thread-safe access to shared state variables
-}
+# new_state() builds one per learner session; STATE belongs to the default session.
+def new_state(log_path="emotion_log.csv", notifier=emotion_changes, clock=None):
+    """
+    Creates an independent mouse detector state for one learner session.
+    `clock` supplies event and idle times (see modules/clock.py); defaults to the system clock.
+    """
+    clock = clock or system_clock
+    return {
+        "running": False, # Flag to control the main detection loop
+        "last_emotion": "Engaged", # Stores the last detected and smoothed emotion
+        "click_times": deque(maxlen=MOUSE_METRIC_HISTORY_LENGTH), # Timestamps of clicks
+        "hover_start_time": None, # Timestamp when a hover started
+        "hover_durations": deque(maxlen=MOUSE_METRIC_HISTORY_LENGTH), # Durations of individual hovers
+        "last_mouse_x": None, # Last known mouse X coordinate for movement tracking
+        "last_mouse_y": None, # Last known mouse Y coordinate for movement tracking
+        "last_move_time": None, # Timestamp of the last mouse movement
+        "movement_distances": deque(maxlen=MOUSE_METRIC_HISTORY_LENGTH), # Distances moved per short interval
+        "movement_speeds": deque(maxlen=MOUSE_METRIC_HISTORY_LENGTH), # Calculated speeds per short interval
+        "last_activity_time": clock.time(), # Overall last activity (click or move)
+        "emotion_history": deque(maxlen=EMOTION_HISTORY_LENGTH), # History of classified emotions for smoothing
+        "lock": threading.Lock(), # A lock for thread-safe access to shared state variables
+        "log_path": log_path, # CSV file receiving this session's transitions
+        "changes": notifier, # Change notifier of the session's combiner
+        "clock": clock, # Time source for events, idle time and loop pacing
+    }
+
+STATE = new_state()
 
 # --- Emotion Classification Logic ---
 
@@ -119,11 +135,11 @@ def classify_mouse_emotion(click_rate, avg_hover_duration, idle_time, avg_moveme
 
 # --- Logging Function ---
 
-def log_emotion(emotion, source="mouse"):
+def log_emotion(emotion, source="mouse", log_path="emotion_log.csv", clock=system_clock):
     """
-    Logs the detected emotion to the console and appends it to a CSV file.
+    Logs the detected emotion to the console and queues it for the shared CSV writer.
     """
-    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    timestamp = clock.now().strftime("%Y-%m-%d %H:%M:%S")
     log_entry = {
         "timestamp": timestamp,
         "emotion": emotion,
@@ -132,10 +148,7 @@ def log_emotion(emotion, source="mouse"):
     logger.info(f"Logged emotion: {emotion} (Source: {source})")
     
     try:
-        # Check if file exists to determine if header is needed
-        file_exists = os.path.exists("emotion_log.csv")
-        df = pd.DataFrame([log_entry])
-        df.to_csv("emotion_log.csv", mode='a', index=False, header=not file_exists)
+        event_sink.write(log_path, log_entry)
     except Exception as e:
         logger.error(f"Error writing to log file: {str(e)}")
         logger.error(traceback.format_exc())
@@ -157,90 +170,117 @@ def get_majority_emotion(history_deque):
 
 # --- Main Mouse Emotion Detection Loop ---
 
-def mouse_emotion_loop():
+MOUSE_CLASSIFY_SECONDS = STAGE_SECONDS.labels("mouse", "classify_mouse_emotion")
+
+def evaluate_mouse_state(state, current_time=None):
+    """
+    One step of the detection loop: derives metrics from the recorded activity as of
+    `current_time` (default: now on the state's clock), classifies them and updates the
+    smoothed emotion. Returns the smoothed emotion.
+    """
+    if current_time is None:
+        current_time = state["clock"].time()
+    # --- Acquire metrics from shared state ---
+    with state["lock"]:
+        # Click rate calculation (consider clicks within the last 5 seconds)
+        recent_clicks = [t for t in state["click_times"] if t > current_time - 5]
+        # Calculate time window based on the spread of recent clicks
+        time_window_clicks = current_time - (recent_clicks[0] if recent_clicks else current_time)
+        click_rate = len(recent_clicks) / time_window_clicks if time_window_clicks > 0 else 0
+
+        # Average hover duration
+        avg_hover_duration = np.mean(list(state["hover_durations"])) if state["hover_durations"] else 0
+
+        # Movement speed calculation (average over recent movements)
+        avg_movement_speed = np.mean(list(state["movement_speeds"])) if state["movement_speeds"] else 0
+        movement_variability = np.std(list(state["movement_speeds"])) if len(state["movement_speeds"]) > 1 else 0
+
+        # Idle time calculation
+        idle_time = current_time - state["last_activity_time"]
+
+    # --- Classify emotion ---
+    with MOUSE_CLASSIFY_SECONDS.time():
+        current_emotion = classify_mouse_emotion(
+            click_rate, avg_hover_duration, idle_time, avg_movement_speed, movement_variability
+        )
+
+    # --- Smooth and update global emotion state ---
+    with state["lock"]:
+        state["emotion_history"].append(current_emotion)
+        smoothed_emotion = get_majority_emotion(state["emotion_history"])
+
+        if smoothed_emotion != state["last_emotion"]:
+            state["last_emotion"] = smoothed_emotion
+            log_emotion(smoothed_emotion, source="mouse", log_path=state["log_path"], clock=state["clock"])
+            publish_change("mouse", smoothed_emotion, state["changes"])
+
+    return smoothed_emotion
+
+def mouse_emotion_loop(state=STATE):
     """
     The main loop that continuously processes mouse activity metrics
     and classifies the user's emotion. This function runs in a separate thread.
     """
     
-    while STATE["running"]:
+    clock = state["clock"]
+    while state["running"]:
         try:
-            current_time = time.time()
-            
-            # --- Acquire metrics from shared state ---
-            with STATE["lock"]:
-                # Click rate calculation (consider clicks within the last 5 seconds)
-                recent_clicks = [t for t in STATE["click_times"] if t > current_time - 5]
-                # Calculate time window based on the spread of recent clicks
-                time_window_clicks = current_time - (recent_clicks[0] if recent_clicks else current_time)
-                click_rate = len(recent_clicks) / time_window_clicks if time_window_clicks > 0 else 0
-
-                # Average hover duration
-                avg_hover_duration = np.mean(list(STATE["hover_durations"])) if STATE["hover_durations"] else 0
-
-                # Movement speed calculation (average over recent movements)
-                avg_movement_speed = np.mean(list(STATE["movement_speeds"])) if STATE["movement_speeds"] else 0
-                movement_variability = np.std(list(STATE["movement_speeds"])) if len(STATE["movement_speeds"]) > 1 else 0
-
-                # Idle time calculation
-                idle_time = current_time - STATE["last_activity_time"]
-            
-            # --- Classify emotion ---
-            current_emotion = classify_mouse_emotion(
-                click_rate, avg_hover_duration, idle_time, avg_movement_speed, movement_variability
-            )
-
-            # --- Smooth and update global emotion state ---
-            with STATE["lock"]:
-                STATE["emotion_history"].append(current_emotion)
-                smoothed_emotion = get_majority_emotion(STATE["emotion_history"])
-
-                if smoothed_emotion != STATE["last_emotion"]:
-                    STATE["last_emotion"] = smoothed_emotion
-                    log_emotion(smoothed_emotion, source="mouse")
-
-            time.sleep(0.5) # Process metrics every 0.5 seconds
+            evaluate_mouse_state(state, clock.time())
+            clock.sleep(EVALUATION_INTERVAL) # Process metrics every 0.5 seconds
             
         except Exception as e:
             logger.error(f"Error in mouse emotion loop: {str(e)}")
             logger.error(traceback.format_exc())
             time.sleep(1) # Wait longer on error to prevent rapid error looping
 
+def advance_mouse_detection(state, seconds):
+    """
+    Lets `seconds` pass on the state's clock, evaluating every EVALUATION_INTERVAL as
+    mouse_emotion_loop would, but in the calling thread. With a VirtualClock this replays
+    long stretches of behaviour instantly (offline evaluation, the demo below).
+    """
+    clock = state["clock"]
+    end = clock.time() + seconds
+    while clock.time() + EVALUATION_INTERVAL <= end:
+        clock.sleep(EVALUATION_INTERVAL)
+        evaluate_mouse_state(state, clock.time())
+    clock.sleep(max(0.0, end - clock.time()))
+
 # --- Control Functions ---
 
-def start_mouse_emotion_detection():
+def start_mouse_emotion_detection(state=STATE):
     """
     Starts the mouse emotion detection loop in a new daemon thread.
     """
-    with STATE["lock"]:
-        if not STATE["running"]:
-            STATE["running"] = True
-            threading.Thread(target=mouse_emotion_loop, daemon=True).start()
+    with state["lock"]:
+        if not state["running"]:
+            state["running"] = True
+            threading.Thread(target=mouse_emotion_loop, args=(state,), daemon=True).start()
             logger.info("Mouse emotion detection started.")
         else:
             logger.info("Mouse emotion detection is already running.")
 
-def stop_mouse_emotion_detection():
+def stop_mouse_emotion_detection(state=STATE):
     """
     Stops the mouse emotion detection thread.
     """
-    with STATE["lock"]:
-        if STATE["running"]:
-            STATE["running"] = False
+    with state["lock"]:
+        if state["running"]:
+            state["running"] = False
             logger.info("Stopping mouse emotion detection...")
     time.sleep(0.6) # Give the loop a moment to recognize the stop signal
     logger.info("Mouse emotion detection stopped.")
 
-def get_mouse_emotion():
+def get_mouse_emotion(state=STATE):
     """
     Retrieves the current smoothed mouse-based emotion.
     """
-    with STATE["lock"]:
-        return STATE["last_emotion"]
+    with state["lock"]:
+        return state["last_emotion"]
 
 # --- Functions to Feed Mouse Activity (Simulated for this standalone script) ---
 
-def update_mouse_activity(activity_type, x=None, y=None, duration=0):
+def update_mouse_activity(activity_type, x=None, y=None, duration=0, state=STATE, timestamp=None):
     """
     Call this function from your application's mouse event handlers
     to feed real-time mouse activity into the system.
@@ -250,43 +290,44 @@ def update_mouse_activity(activity_type, x=None, y=None, duration=0):
         x (int, optional): Mouse X coordinate for 'move' events.
         y (int, optional): Mouse Y coordinate for 'move' events.
         duration (float, optional): Duration for 'hover_end' events.
+        timestamp (float, optional): Event time (epoch seconds) when replaying recorded events.
     """
-    with STATE["lock"]:
-        current_time = time.time()
-        STATE["last_activity_time"] = current_time # Update last activity for any event
+    with state["lock"]:
+        current_time = timestamp if timestamp is not None else state["clock"].time()
+        state["last_activity_time"] = current_time # Update last activity for any event
 
         if activity_type == 'click':
-            STATE["click_times"].append(current_time)
+            state["click_times"].append(current_time)
             logger.debug("Mouse click recorded") # Use debug for frequent events
 
         elif activity_type == 'hover_start':
-            STATE["hover_start_time"] = current_time
+            state["hover_start_time"] = current_time
             logger.debug("Hover started")
 
         elif activity_type == 'hover_end':
-            if STATE["hover_start_time"] is not None:
-                hover_duration = current_time - STATE["hover_start_time"]
-                STATE["hover_durations"].append(hover_duration)
-                STATE["hover_start_time"] = None # Reset
+            if state["hover_start_time"] is not None:
+                hover_duration = current_time - state["hover_start_time"]
+                state["hover_durations"].append(hover_duration)
+                state["hover_start_time"] = None # Reset
                 logger.debug(f"Hover ended, duration: {hover_duration:.2f}s")
 
         elif activity_type == 'move':
-            if STATE["last_mouse_x"] is not None and STATE["last_mouse_y"] is not None and STATE["last_move_time"] is not None:
-                dx = x - STATE["last_mouse_x"]
-                dy = y - STATE["last_mouse_y"]
+            if state["last_mouse_x"] is not None and state["last_mouse_y"] is not None and state["last_move_time"] is not None:
+                dx = x - state["last_mouse_x"]
+                dy = y - state["last_mouse_y"]
                 distance = np.sqrt(dx**2 + dy**2)
-                time_delta = current_time - STATE["last_move_time"]
+                time_delta = current_time - state["last_move_time"]
                 
                 if time_delta > 0: # Avoid division by zero
                     speed = distance / time_delta
-                    STATE["movement_distances"].append(speed) # Store speed directly
+                    state["movement_distances"].append(speed) # Store speed directly
                     # Note: We don't need to store movement_distances as a separate metric for classification
                     # Speed is already a derived metric for that.
                     logger.debug(f"Mouse moved, speed: {speed:.2f} px/s")
 
-            STATE["last_mouse_x"] = x
-            STATE["last_mouse_y"] = y
-            STATE["last_move_time"] = current_time
+            state["last_mouse_x"] = x
+            state["last_mouse_y"] = y
+            state["last_move_time"] = current_time
         else:
             logger.warning(f"Unknown mouse activity type: {activity_type}")
 
@@ -294,68 +335,64 @@ def update_mouse_activity(activity_type, x=None, y=None, duration=0):
 # This block simulates mouse events to demonstrate the functionality.
 # In a real application, you would replace these `simulate_mouse_...` calls
 # with actual event listeners from your GUI or web environment.
+# It runs on a VirtualClock, so the minute-plus of simulated idling finishes instantly;
+# advance_mouse_detection() stands in for both time.sleep() and the detection thread.
 
 if __name__ == "__main__":
     import random # For simulating erratic movements
 
-    print("Starting mouse emotion detection...")
-    start_mouse_emotion_detection()
+    print("Starting mouse emotion detection (simulated time)...")
+    demo = new_state(clock=VirtualClock())
+    wait = lambda seconds: advance_mouse_detection(demo, seconds)
 
     # Simulate some initial mouse position
-    update_mouse_activity('move', x=0, y=0)
+    update_mouse_activity('move', x=0, y=0, state=demo)
 
     print("\n--- Simulating User Behavior ---")
     
     print("\nSimulating 'Engaged' behavior (moderate clicks, movements)...")
     for _ in range(10):
-        update_mouse_activity('click')
-        update_mouse_activity('move', x=random.randint(50, 100), y=random.randint(50, 100))
-        time.sleep(0.5)
-    print(f"Current Mouse Emotion: {get_mouse_emotion()}") # Should be Engaged
+        update_mouse_activity('click', state=demo)
+        update_mouse_activity('move', x=random.randint(50, 100), y=random.randint(50, 100), state=demo)
+        wait(0.5)
+    print(f"Current Mouse Emotion: {get_mouse_emotion(demo)}") # Should be Engaged
 
     print("\nSimulating 'Frustrated' behavior (rapid clicks AND jerky moves)...")
     # Simulate an intense burst of activity
     for i in range(15): # More actions over a shorter period
-        update_mouse_activity('click')
+        update_mouse_activity('click', state=demo)
         # Simulate very fast, large, erratic movements
-        update_mouse_activity('move', x=random.randint(400, 700), y=random.randint(400, 700)) 
-        time.sleep(0.08) # Very fast interval
-    print(f"Current Mouse Emotion: {get_mouse_emotion()}") # Should clearly transition to Frustrated
+        update_mouse_activity('move', x=random.randint(400, 700), y=random.randint(400, 700), state=demo)
+        wait(0.08) # Very fast interval
+    print(f"Current Mouse Emotion: {get_mouse_emotion(demo)}") # Should clearly transition to Frustrated
 
     print("\nSimulating 'Confused' behavior (long, deliberate hovers)...")
     # This should be harder to trigger now
     for _ in range(3): # Fewer instances to show it's rarer
-        update_mouse_activity('hover_start')
+        update_mouse_activity('hover_start', state=demo)
         # Ensure it's above threshold and long enough to register
-        time.sleep(random.uniform(CONFUSED_HOVER_DURATION_THRESHOLD + 0.5, CONFUSED_HOVER_DURATION_THRESHOLD + 1.5)) 
-        update_mouse_activity('hover_end') # Duration will be calculated internally
+        wait(random.uniform(CONFUSED_HOVER_DURATION_THRESHOLD + 0.5, CONFUSED_HOVER_DURATION_THRESHOLD + 1.5))
+        update_mouse_activity('hover_end', state=demo) # Duration will be calculated internally
         # Simulate small, slow moves during/after hover to signify deliberate thought
-        update_mouse_activity('move', x=random.randint(10, 20), y=random.randint(10, 20)) 
-        time.sleep(0.5)
-    print(f"Current Mouse Emotion: {get_mouse_emotion()}") # Should transition to Confused, but only if hover is significant
+        update_mouse_activity('move', x=random.randint(10, 20), y=random.randint(10, 20), state=demo)
+        wait(0.5)
+    print(f"Current Mouse Emotion: {get_mouse_emotion(demo)}") # Should transition to Confused, but only if hover is significant
 
     print("\nSimulating 'Bored' behavior (long idle, occasional very slow move)...")
-    time.sleep(BORED_IDLE_THRESHOLD + 5) # Idle time
-    update_mouse_activity('move', x=10, y=10) # Small, slow move to reset idle but still show low activity
-    time.sleep(2)
-    print(f"Current Mouse Emotion: {get_mouse_emotion()}") # Should transition to Bored
+    wait(BORED_IDLE_THRESHOLD + 5) # Idle time
+    update_mouse_activity('move', x=10, y=10, state=demo) # Small, slow move to reset idle but still show low activity
+    wait(2)
+    print(f"Current Mouse Emotion: {get_mouse_emotion(demo)}") # Should transition to Bored
 
     print("\nSimulating 'Sleepy' behavior (very long idle)...")
-    time.sleep(SLEEPY_IDLE_THRESHOLD + 5) # Very long idle
-    print(f"Current Mouse Emotion: {get_mouse_emotion()}") # Should transition to Sleepy
-
-    # You can also manually stop it with Ctrl+C if testing continuously
-    try:
-        print("\nMonitoring for 10 more seconds (press Ctrl+C to stop early)...")
-        for i in range(10):
-            print(f"Time remaining: {10 - i}s. Current Mouse Emotion: {get_mouse_emotion()}")
-            time.sleep(1)
-    except KeyboardInterrupt:
-        pass
-    finally:
-        print("\nStopping mouse emotion detection...")
-        stop_mouse_emotion_detection()
-        print("Application exited.")
+    wait(SLEEPY_IDLE_THRESHOLD + 5) # Very long idle
+    print(f"Current Mouse Emotion: {get_mouse_emotion(demo)}") # Should transition to Sleepy
+
+    print("\nMonitoring for 10 more seconds...")
+    for i in range(10):
+        print(f"Time remaining: {10 - i}s. Current Mouse Emotion: {get_mouse_emotion(demo)}")
+        wait(1)
+    print("Application exited.")
 
 # if __name__ == "__main__":
 #     import random
@@ -0,0 +1,90 @@
+import logging
+import os
+import threading
+import traceback
+
+import cv2
+import numpy as np
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# --- ONNX Emotion Model ---
+# DeepFace's facial expression CNN exported to ONNX (compare_emotion_backends.py export) and run
+# through onnxruntime's CPU provider, so facial detection does not need TensorFlow at all. Input
+# preprocessing reproduces DeepFace.analyze(detector_backend="skip") and results come back in
+# DeepFace's shape, so deepface_emotion() reads them unchanged.
+ONNX_EMOTION_MODEL_PATH = os.environ.get("ONNX_EMOTION_MODEL_PATH", "emotion_model.onnx")  # Or the .int8.onnx variant
+ONNX_THREADS = int(os.environ.get("ONNX_THREADS", 1))  # Intra-op threads per inference
+
+# DeepFace's emotion labels, in the order of the model's outputs
+EMOTION_LABELS = ("angry", "disgust", "fear", "happy", "sad", "surprise", "neutral")
+DEEPFACE_FACE_SIZE = 224  # DeepFace letterboxes every face to this size first
+MODEL_INPUT_SIZE = 48     # The expression model's grayscale input
+
+
+def preprocess(face):
+    """BGR uint8 face crop -> (48, 48, 1) float32 model input, as DeepFace prepares it."""
+    img = face.astype(np.float32) / 255.0
+    # Letterbox into 224 x 224 (resize keeping the aspect ratio, pad with black)
+    factor = min(DEEPFACE_FACE_SIZE / img.shape[0], DEEPFACE_FACE_SIZE / img.shape[1])
+    img = cv2.resize(img, (int(img.shape[1] * factor), int(img.shape[0] * factor)))
+    pad_y = DEEPFACE_FACE_SIZE - img.shape[0]
+    pad_x = DEEPFACE_FACE_SIZE - img.shape[1]
+    img = np.pad(img, ((pad_y // 2, pad_y - pad_y // 2), (pad_x // 2, pad_x - pad_x // 2), (0, 0)))
+    if img.shape[:2] != (DEEPFACE_FACE_SIZE, DEEPFACE_FACE_SIZE):
+        img = cv2.resize(img, (DEEPFACE_FACE_SIZE, DEEPFACE_FACE_SIZE))
+    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    return cv2.resize(gray, (MODEL_INPUT_SIZE, MODEL_INPUT_SIZE))[:, :, np.newaxis]
+
+
+def to_analysis(probabilities):
+    """One face's output vector as a DeepFace.analyze result (percentages)."""
+    total = float(probabilities.sum()) or 1.0
+    emotion = {label: 100.0 * float(p) / total for label, p in zip(EMOTION_LABELS, probabilities)}
+    return [{"dominant_emotion": EMOTION_LABELS[int(np.argmax(probabilities))], "emotion": emotion}]
+
+
+class OnnxEmotionModel:
+    """The expression model in an onnxruntime CPU session; analyze() takes a batch of face crops."""
+
+    def __init__(self, path=ONNX_EMOTION_MODEL_PATH, threads=ONNX_THREADS):
+        import onnxruntime
+
+        options = onnxruntime.SessionOptions()
+        options.intra_op_num_threads = threads
+        options.inter_op_num_threads = 1
+        self.path = path
+        self.session = onnxruntime.InferenceSession(path, options, providers=["CPUExecutionProvider"])
+        self.input_name = self.session.get_inputs()[0].name
+
+    def predict(self, faces):
+        """(n, 7) softmax outputs for a list of BGR face crops."""
+        batch = np.stack([preprocess(face) for face in faces])
+        return self.session.run(None, {self.input_name: batch})[0]
+
+    def analyze(self, faces):
+        """One DeepFace-shaped result per face crop."""
+        return [to_analysis(p) for p in self.predict(faces)]
+
+
+# --- Shared Model ---
+_model = None
+_model_loaded = False
+_model_lock = threading.Lock()
+
+
+def get_onnx_emotion_model(path=None):
+    """The model at ONNX_EMOTION_MODEL_PATH, loaded on first use; None if it cannot be loaded."""
+    global _model, _model_loaded
+    with _model_lock:
+        if not _model_loaded:
+            _model_loaded = True
+            path = path or ONNX_EMOTION_MODEL_PATH
+            try:
+                _model = OnnxEmotionModel(path)
+                logger.info(f"Loaded ONNX emotion model from {path}")
+            except Exception as e:
+                logger.error(f"Error loading ONNX emotion model {path}, facial detection falls back to DeepFace: {str(e)}")
+                logger.debug(traceback.format_exc())
+        return _model
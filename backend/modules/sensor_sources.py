@@ -0,0 +1,290 @@
+import logging
+import os
+import time
+import wave
+
+import cv2
+import numpy as np
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# --- Source Configuration ---
+# Specs: "camera:<index>", "file:<path>" or "synthetic" for frames;
+#        "microphone", "file:<path.wav>" or "synthetic" for audio.
+# FACIAL_SOURCE=browser or upload opens no frame source: the client posts landmarks (browser)
+# or JPEG frames (upload) over HTTP instead.
+FACIAL_SOURCE = os.environ.get("FACIAL_SOURCE", "camera:0")
+BROWSER_SOURCE = "browser"
+UPLOAD_SOURCE = "upload"
+REMOTE_SOURCES = (BROWSER_SOURCE, UPLOAD_SOURCE)
+SPEECH_SOURCE = os.environ.get("SPEECH_SOURCE", "microphone")
+# File and synthetic sources normally deliver data at real-time pace; this lets them run flat out
+FASTER_THAN_REALTIME = os.environ.get("SENSOR_FASTER_THAN_REALTIME", "0") == "1"
+
+FRAME_WIDTH = 640
+FRAME_HEIGHT = 480
+
+
+class _Pacer:
+    """Sleeps so that items come out at `rate` per second (unless unthrottled)."""
+
+    def __init__(self, rate, unthrottled):
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self.unthrottled = unthrottled
+        self.next_due = None
+
+    def wait(self, items=1):
+        if self.unthrottled or not self.interval:
+            return
+        now = time.monotonic()
+        if self.next_due is None or now - self.next_due > 1.0:
+            self.next_due = now  # First read, or the consumer fell far behind: don't burst to catch up
+        elif self.next_due > now:
+            time.sleep(self.next_due - now)
+        self.next_due += self.interval * items
+
+
+# --- Frame Sources ---
+# All frame sources mirror the parts of cv2.VideoCapture the detector uses: open(), read([image]) -> (ok, BGR frame),
+# release(). read() fills `image` in place when given one of the right size (see modules/frame_capture.py). `realtime` is False when frames come faster than real time, so callers can skip their own sleeps.
+# `exhausted` turns True when a finite source has no more frames.
+
+class CameraSource:
+    realtime = True
+
+    def __init__(self, index=0, width=FRAME_WIDTH, height=FRAME_HEIGHT):
+        self.index = index
+        self.width = width
+        self.height = height
+        self.cap = None
+        self.exhausted = False
+
+    def open(self):
+        self.cap = cv2.VideoCapture(self.index)
+        if not self.cap.isOpened():
+            return False
+        self.cap.set(cv2.CAP_PROP_FRAME_WIDTH, self.width)
+        self.cap.set(cv2.CAP_PROP_FRAME_HEIGHT, self.height)
+        return True
+
+    def read(self, image=None):
+        return self.cap.read(image)
+
+    def release(self):
+        if self.cap is not None:
+            self.cap.release()
+            self.cap = None
+
+    def available(self):
+        """Open the camera briefly and grab one frame."""
+        try:
+            if not self.open():
+                return False
+            ret, _ = self.read()
+            return bool(ret)
+        finally:
+            self.release()
+
+
+class VideoFileSource:
+    def __init__(self, path, faster_than_realtime=FASTER_THAN_REALTIME, loop=False):
+        self.path = path
+        self.loop = loop
+        self.realtime = not faster_than_realtime
+        self.cap = None
+        self.pacer = None
+        self.exhausted = False
+
+    def open(self):
+        self.cap = cv2.VideoCapture(self.path)
+        if not self.cap.isOpened():
+            return False
+        fps = self.cap.get(cv2.CAP_PROP_FPS) or 30.0
+        self.pacer = _Pacer(fps, not self.realtime)
+        self.exhausted = False
+        return True
+
+    def read(self, image=None):
+        self.pacer.wait()
+        ret, frame = self.cap.read(image)
+        if not ret and self.loop:
+            self.cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+            ret, frame = self.cap.read(image)
+        if not ret:
+            self.exhausted = True
+        return ret, frame
+
+    def release(self):
+        if self.cap is not None:
+            self.cap.release()
+            self.cap = None
+
+    def available(self):
+        return os.path.exists(self.path)
+
+
+class SyntheticFrameSource:
+    """Endless mid-gray frames with a little noise (no face): exercises the pipeline without a camera."""
+
+    def __init__(self, width=FRAME_WIDTH, height=FRAME_HEIGHT, fps=30.0, faster_than_realtime=FASTER_THAN_REALTIME):
+        self.width = width
+        self.height = height
+        self.realtime = not faster_than_realtime
+        self.pacer = _Pacer(fps, faster_than_realtime)
+        self.rng = np.random.default_rng(0)
+        self.base = np.full((height, width, 3), 128, dtype=np.uint8)
+        self.exhausted = False
+
+    def open(self):
+        return True
+
+    def read(self, image=None):
+        self.pacer.wait()
+        noise = self.rng.integers(0, 8, size=(self.height, self.width, 1), dtype=np.uint8)
+        if image is None or image.shape != self.base.shape:
+            image = np.empty_like(self.base)
+        np.add(self.base, noise, out=image)
+        return True, image
+
+    def release(self):
+        pass
+
+    def available(self):
+        return True
+
+
+def frame_source_from_spec(spec=None, faster_than_realtime=FASTER_THAN_REALTIME):
+    """Build a frame source from a spec string (defaults to FACIAL_SOURCE)."""
+    kind, _, arg = (spec or FACIAL_SOURCE).partition(":")
+    if kind == "camera":
+        return CameraSource(int(arg or 0))
+    if kind == "file":
+        return VideoFileSource(arg, faster_than_realtime)
+    if kind == "synthetic":
+        return SyntheticFrameSource(faster_than_realtime=faster_than_realtime)
+    if kind in REMOTE_SOURCES:
+        raise ValueError(f"The {kind} source is fed over HTTP (/api/landmarks, /api/frames), not read")
+    raise ValueError(f"Unknown frame source '{spec}'")
+
+
+# --- Audio Sources ---
+# Audio sources deliver 16-bit mono PCM: open(), read(n_frames) -> bytes (b"" once exhausted), close().
+# recognition_source() returns a speech_recognition AudioSource for transcription, or None.
+
+class MicrophoneSource:
+    realtime = True
+
+    def __init__(self, rate, chunk):
+        self.rate = rate
+        self.chunk = chunk
+        self.pyaudio_instance = None
+        self.stream = None
+        self.exhausted = False
+
+    def open(self):
+        import pyaudio
+
+        self.pyaudio_instance = pyaudio.PyAudio()
+        try:
+            self.stream = self.pyaudio_instance.open(
+                format=pyaudio.paInt16, channels=1, rate=self.rate, input=True,
+                frames_per_buffer=self.chunk, input_device_index=None)
+            self.stream.start_stream()
+        except Exception:
+            self.close()
+            raise
+        return True
+
+    def read(self, frames):
+        return self.stream.read(frames, exception_on_overflow=False)
+
+    def close(self):
+        if self.stream is not None:
+            self.stream.stop_stream()
+            self.stream.close()
+            self.stream = None
+        if self.pyaudio_instance is not None:
+            self.pyaudio_instance.terminate()
+            self.pyaudio_instance = None
+
+    def recognition_source(self):
+        import speech_recognition as sr
+        return sr.Microphone()
+
+
+class WavFileSource:
+    def __init__(self, path, rate, faster_than_realtime=FASTER_THAN_REALTIME):
+        self.path = path
+        self.rate = rate
+        self.realtime = not faster_than_realtime
+        self.wav = None
+        self.pacer = _Pacer(rate, faster_than_realtime)
+        self.exhausted = False
+
+    def open(self):
+        self.wav = wave.open(self.path, "rb")
+        if self.wav.getframerate() != self.rate or self.wav.getnchannels() != 1 or self.wav.getsampwidth() != 2:
+            self.close()
+            raise ValueError(f"{self.path} must be {self.rate} Hz mono 16-bit PCM")
+        self.exhausted = False
+        return True
+
+    def read(self, frames):
+        self.pacer.wait(frames)
+        data = self.wav.readframes(frames)
+        if not data:
+            self.exhausted = True
+        return data
+
+    def close(self):
+        if self.wav is not None:
+            self.wav.close()
+            self.wav = None
+
+    def recognition_source(self):
+        import speech_recognition as sr
+        return sr.AudioFile(self.path)
+
+
+class SyntheticAudioSource:
+    """Endless sine tone with some noise; no speech, so no transcription."""
+
+    def __init__(self, rate, frequency=220.0, amplitude=0.3, noise=0.02, faster_than_realtime=FASTER_THAN_REALTIME):
+        self.rate = rate
+        self.frequency = frequency
+        self.amplitude = amplitude
+        self.noise = noise
+        self.realtime = not faster_than_realtime
+        self.pacer = _Pacer(rate, faster_than_realtime)
+        self.rng = np.random.default_rng(0)
+        self.position = 0
+        self.exhausted = False
+
+    def open(self):
+        return True
+
+    def read(self, frames):
+        self.pacer.wait(frames)
+        t = (self.position + np.arange(frames)) / self.rate
+        self.position += frames
+        signal = self.amplitude * np.sin(2 * np.pi * self.frequency * t) + self.rng.normal(0, self.noise, frames)
+        return (np.clip(signal, -1, 1) * 32767).astype(np.int16).tobytes()
+
+    def close(self):
+        pass
+
+    def recognition_source(self):
+        return None
+
+
+def audio_source_from_spec(spec=None, rate=16000, chunk=512, faster_than_realtime=FASTER_THAN_REALTIME):
+    """Build an audio source from a spec string (defaults to SPEECH_SOURCE)."""
+    kind, _, arg = (spec or SPEECH_SOURCE).partition(":")
+    if kind == "microphone":
+        return MicrophoneSource(rate, chunk)
+    if kind == "file":
+        return WavFileSource(arg, rate, faster_than_realtime)
+    if kind == "synthetic":
+        return SyntheticAudioSource(rate, faster_than_realtime=faster_than_realtime)
+    raise ValueError(f"Unknown audio source '{spec}'")
@@ -0,0 +1,243 @@
+import logging
+import os
+import re
+import threading
+import time
+import traceback
+
+from modules import facial_emotion, speech_emotion, mouse_emotion
+from modules.clock import system_clock
+from modules.emotion_archive import EmotionArchive, compact, emotion_archive
+from modules.emotion_events import ChangeNotifier, emotion_changes
+from modules.emotion_history import iter_history
+from modules.emotion_rollups import EmotionRollups
+from modules.metrics import registry
+from modules.emotion_snapshot import EmotionSnapshot, emotion_snapshot
+from modules.emotion_store import EmotionLogStore, emotion_log
+from modules.emotion_stream import EmotionHub, emotion_hub
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# --- Session Configuration ---
+DEFAULT_SESSION_ID = "default"
+SESSIONS_DIR = os.environ.get("EMOLEARN_SESSIONS_DIR", "sessions")
+SESSION_IDLE_TIMEOUT = float(os.environ.get("EMOLEARN_SESSION_IDLE_TIMEOUT", 900))  # Seconds without requests
+MAX_SESSIONS = int(os.environ.get("EMOLEARN_MAX_SESSIONS", 500))
+SWEEP_INTERVAL = 60  # Seconds between idle-session sweeps
+
+SESSION_ID_PATTERN = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+
+
+class SessionLimitError(Exception):
+    """Raised when a new session would exceed MAX_SESSIONS and none can be evicted."""
+
+
+class DeviceBusyError(Exception):
+    """Raised when a session enables a server camera or microphone that another session is using."""
+
+
+def server_device(session, sensor):
+    """The device on this machine behind a session's "camera" or "microphone" toggle.
+
+    None for sources every session can have its own of (browser/upload, files, synthetic).
+    """
+    if sensor == "camera":
+        spec = session.facial_state["source"]
+        return spec if spec.startswith("camera") else None
+    spec = session.speech_state["source"]
+    return spec if spec.startswith("microphone") else None
+
+
+class LearnerSession:
+    """All detector, fusion and logging state for one learner.
+
+    The default session reuses the module-level singletons (detector STATE dicts,
+    emotion_log, emotion_archive, emotion_snapshot, emotion_hub), so single-learner callers keep working.
+    Other sessions get their own instances and log files under SESSIONS_DIR/<id>/.
+    """
+
+    def __init__(self, session_id):
+        self.id = session_id
+        self.lock = threading.Lock()
+        self.clock = system_clock  # Timestamps fused samples; see set_clock()
+        if session_id == DEFAULT_SESSION_ID:
+            self.directory = "."
+            self.changes = emotion_changes
+            self.emotion_log = emotion_log
+            self.archive = emotion_archive
+            self.snapshot = emotion_snapshot
+            self.hub = emotion_hub
+            self.facial_state = facial_emotion.STATE
+            self.speech_state = speech_emotion.STATE
+            self.mouse_state = mouse_emotion.STATE
+        else:
+            self.directory = os.path.join(SESSIONS_DIR, session_id)
+            os.makedirs(self.directory, exist_ok=True)
+            csv_path = os.path.join(self.directory, "emotion_log.csv")
+            self.changes = ChangeNotifier()
+            self.emotion_log = EmotionLogStore(os.path.join(self.directory, "emotion_log.jsonl"))
+            self.archive = EmotionArchive(os.path.join(self.directory, "emotion_archive"))
+            self.snapshot = EmotionSnapshot()
+            self.snapshot.seed(self.emotion_log.read_latest())
+            self.hub = EmotionHub()
+            self.facial_state = facial_emotion.new_state(csv_path, self.changes)
+            self.speech_state = speech_emotion.new_state(csv_path, self.changes)
+            self.mouse_state = mouse_emotion.new_state(csv_path, self.changes)
+        self.rollups = EmotionRollups(
+            os.path.join(self.directory, "emotion_rollups.json"),
+            history=lambda start_seq: iter_history(self.emotion_log, self.archive, start_seq))
+        self.rollups.start_loading()  # Replays the history off the fusion path
+        self.detectors_running = {
+            "facial": False,
+            "speech": False,
+            "mouse": False
+        }
+        self.fusion = {
+            "running": False,
+            "thread": None,
+            "last_fusion_time": 0.0
+        }
+        self.camera_enabled = False
+        self.microphone_enabled = False
+        self.detection_running = False
+        self.last_seen = time.time()
+
+    def set_clock(self, clock):
+        """Run the session's detectors and fusion timestamps on `clock` (e.g. a VirtualClock for replays)."""
+        self.clock = clock
+        for state in (self.facial_state, self.speech_state, self.mouse_state):
+            state["clock"] = clock
+
+    def touch(self):
+        """Mark the session as active."""
+        self.last_seen = time.time()
+
+    def is_idle(self, now):
+        """A session is idle when nobody has called the API or listened to its stream for a while."""
+        if self.id == DEFAULT_SESSION_ID:
+            return False
+        return now - self.last_seen > SESSION_IDLE_TIMEOUT and self.hub.subscriber_count() == 0
+
+
+class SessionRegistry:
+    """Session id -> LearnerSession map with idle eviction."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.sessions = {DEFAULT_SESSION_ID: LearnerSession(DEFAULT_SESSION_ID)}
+        self.on_evict = None  # Set by the combiner to stop a session's detectors
+        self.device_owners = {}  # Server camera/microphone spec -> id of the session using it
+        self.sweeper = None
+        self.sweeping = False
+
+    def get(self, session_id=None):
+        """Return the session for `session_id`, creating it on first use."""
+        session_id = session_id or DEFAULT_SESSION_ID
+        if not SESSION_ID_PATTERN.match(session_id):
+            raise ValueError("session_id must be 1-64 characters of letters, digits, '_' or '-'")
+        with self.lock:
+            session = self.sessions.get(session_id)
+            if session is not None:
+                return session
+        if len(self.sessions) >= MAX_SESSIONS:
+            self.evict_idle()
+        with self.lock:
+            session = self.sessions.get(session_id)
+            if session is None:
+                if len(self.sessions) >= MAX_SESSIONS:
+                    raise SessionLimitError(f"Session limit of {MAX_SESSIONS} reached")
+                session = LearnerSession(session_id)
+                self.sessions[session_id] = session
+                logger.info(f"Created learner session {session_id} ({len(self.sessions)} active)")
+            return session
+
+    def all(self):
+        with self.lock:
+            return list(self.sessions.values())
+
+    def claim_device(self, session, sensor):
+        """Reserve the server device behind `sensor` for `session`; raises DeviceBusyError if another has it.
+
+        There is one camera and one microphone on the server, so only one learner can use them;
+        the others must send landmarks or frames from their browser.
+        """
+        device = server_device(session, sensor)
+        if device is None:
+            return
+        with self.lock:
+            owner = self.device_owners.setdefault(device, session.id)
+        if owner != session.id:
+            raise DeviceBusyError(f"The server {sensor} ({device}) is in use by session {owner}")
+
+    def release_device(self, session, sensor):
+        device = server_device(session, sensor)
+        with self.lock:
+            if device is not None and self.device_owners.get(device) == session.id:
+                del self.device_owners[device]
+
+    def evict(self, session_id):
+        """Shut down and forget a session (the default session is never evicted)."""
+        if session_id == DEFAULT_SESSION_ID:
+            return False
+        with self.lock:
+            session = self.sessions.pop(session_id, None)
+        if session is None:
+            return False
+        try:
+            if self.on_evict:
+                self.on_evict(session)
+            session.rollups.save()  # Spares the next load a replay of the session's history
+            session.emotion_log.close()
+            session.archive.close()
+        except Exception as e:
+            logger.error(f"Error shutting down session {session_id}: {str(e)}")
+            logger.error(traceback.format_exc())
+        with self.lock:
+            self.device_owners = {d: o for d, o in self.device_owners.items() if o != session_id}
+        logger.info(f"Evicted learner session {session_id}")
+        return True
+
+    def evict_idle(self):
+        """Evict every idle session; returns the evicted ids."""
+        now = time.time()
+        idle = [s.id for s in self.all() if s.is_idle(now)]
+        return [session_id for session_id in idle if self.evict(session_id)]
+
+    def compact_all(self):
+        """Move old records of every session's live log into its columnar archive."""
+        for session in self.all():
+            compact(session.emotion_log, session.archive)
+
+    def save_rollups(self):
+        for session in self.all():
+            session.rollups.save()
+
+    def _sweep_loop(self):
+        while self.sweeping:
+            time.sleep(SWEEP_INTERVAL)
+            try:
+                self.evict_idle()
+                self.compact_all()
+                self.save_rollups()
+            except Exception as e:
+                logger.error(f"Error sweeping idle sessions: {str(e)}")
+
+    def start_sweeper(self):
+        if self.sweeping:
+            return
+        self.sweeping = True
+        self.sweeper = threading.Thread(target=self._sweep_loop, daemon=True)
+        self.sweeper.start()
+
+    def stop_sweeper(self):
+        self.sweeping = False
+
+
+# Process-wide registry used by the combiner and the API
+session_registry = SessionRegistry()
+
+registry.gauge("emolearn_sessions", "Active learner sessions",
+               fn=lambda: len(session_registry.all()))
+registry.gauge("emolearn_stream_subscribers", "Open SSE/WebSocket emotion streams",
+               fn=lambda: sum(s.hub.subscriber_count() for s in session_registry.all()))
@@ -1,9 +1,6 @@
-import pyaudio
 import numpy as np
-import pandas as pd
 import librosa
 import speech_recognition as sr
-from datetime import datetime
 import threading
 from queue import Queue
 import time
@@ -14,18 +11,23 @@ import torch
 import logging
 import os
 import traceback
+from modules.emotion_events import emotion_changes, publish_change
+from modules.event_log import event_sink
+from modules.metrics import FRAMES, FRAMES_DROPPED, STAGE_SECONDS, track_queue
+from modules.sensor_sources import SPEECH_SOURCE, audio_source_from_spec
+from modules.clock import system_clock
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-# Audio configuration
-FORMAT = pyaudio.paInt16
+# Audio configuration (16-bit PCM)
 CHANNELS = 1
 RATE = 16000
 CHUNK = 512
 WINDOW_SECONDS = 0.3
 SILENCE_TIMEOUT = 10
+RECOGNITION_SECONDS = 5  # Length of each transcribed phrase (phrase_time_limit for the microphone)
 
 # Load or initialize emotion weights
 WEIGHTS_FILE = "emotion_weights.json"
@@ -94,23 +96,38 @@ AUDIO_THRESHOLDS = {
 }
 
 EMOTION_WEIGHTS = load_weights()
-result_queue = Queue()
 
 # Shared state
-STATE = {
-    "running": False,
-    "last_emotion": "Engaged",
-    "latest_text": "",
-    "last_change_time": time.time(),
-    "last_speech_time": time.time(),
-    "pyaudio_instance": None,
-    "stream": None,
-    "pitch_buffer": deque(maxlen=3),
-    "zcr_buffer": deque(maxlen=3),
-    "device": "0",
-    "lock": threading.Lock(),
-    "transcription": ""
-}
+def new_state(log_path="emotion_log.csv", notifier=emotion_changes, source=None, clock=None):
+    """Create an independent speech detector state (one per learner session).
+
+    `source` is an audio source spec (see modules/sensor_sources.py); defaults to SPEECH_SOURCE.
+    `clock` times the silence and emotion-change rules (see modules/clock.py).
+    """
+    clock = clock or system_clock
+    return {
+        "running": False,
+        "last_emotion": "Engaged",
+        "latest_text": "",
+        "last_change_time": clock.time(),
+        "last_speech_time": clock.time(),
+        "source": source or SPEECH_SOURCE,
+        "stream": None,
+        "pitch_buffer": deque(maxlen=3),
+        "zcr_buffer": deque(maxlen=3),
+        "device": "0",
+        "lock": threading.Lock(),
+        "transcription": "",
+        "result_queue": Queue(),
+        "log_path": log_path,
+        "changes": notifier,
+        "clock": clock
+    }
+
+# State of the default (single-learner) session
+STATE = new_state()
+result_queue = STATE["result_queue"]
+track_queue("speech_results", result_queue.qsize)
 
 def match_keyword(text, keywords, weights):
     try:
@@ -206,9 +223,9 @@ def classify_emotion(text, pitch, pitch_std, zcr):
         logger.error(traceback.format_exc())
         return "Engaged"
 
-def log_emotion(emotion, text, pitch, pitch_std, zcr):
+def log_emotion(emotion, text, pitch, pitch_std, zcr, log_path="emotion_log.csv", clock=system_clock):
     try:
-        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        timestamp = clock.now().strftime("%Y-%m-%d %H:%M:%S")
         log_entry = {
             "timestamp": timestamp, "emotion": emotion, "text": text,
             "pitch": f"{pitch:.2f}" if pitch else "0.00",
@@ -217,26 +234,40 @@ def log_emotion(emotion, text, pitch, pitch_std, zcr):
             "source": "speech"
         }
         logger.info(f"Logged emotion: {emotion}, Text: '{text}'")
-        pd.DataFrame([log_entry]).to_csv("emotion_log.csv", mode='a', index=False, header=not os.path.exists("emotion_log.csv"))
+        event_sink.write(log_path, log_entry)
     except Exception as e:
         logger.error(f"Error logging emotion: {str(e)}")
         logger.error(traceback.format_exc())
 
-def process_speech_recognition():
+def process_speech_recognition(state=STATE):
     try:
         recognizer = sr.Recognizer()
-        microphone = sr.Microphone()
+        audio_source = state["stream"]
+        microphone = audio_source.recognition_source() if audio_source else None
+        if microphone is None:
+            logger.info(f"Audio source {state['source']} has no speech to transcribe")
+            return
+        from_file = isinstance(microphone, sr.AudioFile)
         with microphone as source:
-            recognizer.adjust_for_ambient_noise(source, duration=2)
+            if not from_file:
+                recognizer.adjust_for_ambient_noise(source, duration=2)
             logger.info("Speech recognition initialized")
-            while STATE["running"]:
+            while state["running"]:
                 try:
-                    audio = recognizer.listen(source, timeout=2, phrase_time_limit=5)
+                    if from_file:
+                        # Transcribe the recording in fixed slices, keeping pace with the audio thread
+                        audio = recognizer.record(source, duration=RECOGNITION_SECONDS)
+                        if not audio.frame_data:
+                            break
+                        if audio_source.realtime:
+                            time.sleep(RECOGNITION_SECONDS)
+                    else:
+                        audio = recognizer.listen(source, timeout=2, phrase_time_limit=RECOGNITION_SECONDS)
                     text = recognizer.recognize_google(audio)
-                    with STATE["lock"]:
-                        STATE["transcription"] = text
-                        STATE["latest_text"] = text
-                        STATE["last_speech_time"] = time.time()
+                    with state["lock"]:
+                        state["transcription"] = text
+                        state["latest_text"] = text
+                        state["last_speech_time"] = state["clock"].time()
                     logger.info(f"Recognized speech: {text}")
                 except sr.WaitTimeoutError:
                     continue
@@ -254,13 +285,71 @@ def process_speech_recognition():
         logger.error(f"Error initializing speech recognition: {str(e)}")
         logger.error(traceback.format_exc())
 
-def process_audio():
+# Per-stage timers and window counters (see modules/metrics.py)
+AUDIO_READ_SECONDS = STAGE_SECONDS.labels("speech", "read")
+FEATURES_SECONDS = STAGE_SECONDS.labels("speech", "extract_features")
+CLASSIFY_SECONDS = STAGE_SECONDS.labels("speech", "classify_emotion")
+SPEECH_WINDOWS = FRAMES.labels("speech")
+
+def analyze_audio_window(state, audio_data):
+    """Classify one WINDOW_SECONDS window of 16-bit PCM and apply the result to the detector state.
+
+    This is the per-window body of process_audio, usable on audio from any source (replays
+    included): pitch and ZCR are averaged over the last windows, a stale transcription is
+    cleared after SILENCE_TIMEOUT, and emotion changes are held for 2 seconds before the next.
+    Returns the window's result for the UI feed, or None when no features could be extracted.
+    """
+    SPEECH_WINDOWS.inc()
+    with FEATURES_SECONDS.time():
+        features = extract_features(audio_data, state["device"])
+    if not features:
+        FRAMES_DROPPED.labels("speech", "no_features").inc()
+        return None
+    pitch = features["pitch"]
+    pitch_std = features["pitch_std"]
+    zcr = features["zcr"]
+    clock = state["clock"]
+    with state["lock"]:
+        state["pitch_buffer"].append(pitch)
+        state["zcr_buffer"].append(zcr)
+        avg_pitch = np.mean(state["pitch_buffer"])
+        avg_zcr = np.mean(state["zcr_buffer"])
+        text = state["latest_text"]
+        if clock.time() - state["last_speech_time"] > SILENCE_TIMEOUT and text:
+            state["latest_text"] = ""
+            state["transcription"] = ""
+            state["last_emotion"] = "Engaged"
+            state["last_speech_time"] = clock.time()
+            log_emotion("Engaged", "", 0, 0, 0, log_path=state["log_path"], clock=clock)
+            publish_change("speech", "Engaged", state["changes"])
+            text = ""
+    with CLASSIFY_SECONDS.time():
+        current_emotion = classify_emotion(text, avg_pitch, pitch_std, avg_zcr)
+    with state["lock"]:
+        if current_emotion != state["last_emotion"] and clock.time() - state["last_change_time"] >= 2:
+            state["last_emotion"] = current_emotion
+            state["last_change_time"] = clock.time()
+            log_emotion(current_emotion, text, avg_pitch, pitch_std, avg_zcr, log_path=state["log_path"],
+                        clock=clock)
+            publish_change("speech", current_emotion, state["changes"])
+    return {
+        "emotion": current_emotion,
+        "pitch": f"{avg_pitch:.1f}",
+        "zcr": f"{avg_zcr:.3f}",
+        "waveform": features["waveform_data"]
+    }
+
+def process_audio(state=STATE):
     threading.current_thread().setName("AudioProcessing")
     frames = []
     try:
-        while STATE["running"]:
+        while state["running"]:
             try:
-                data = STATE["stream"].read(CHUNK, exception_on_overflow=False)
+                with AUDIO_READ_SECONDS.time():
+                    data = state["stream"].read(CHUNK)
+                if not data and state["stream"].exhausted:
+                    logger.info(f"Audio source {state['source']} has no more audio; audio processing ending")
+                    break
                 if not data or len(data) == 0:
                     logger.debug("Empty audio data")
                     continue
@@ -268,120 +357,76 @@ def process_audio():
                 if len(frames) * CHUNK / RATE >= WINDOW_SECONDS:
                     audio_data = b''.join(frames)
                     frames = []
-                    features = extract_features(audio_data, STATE["device"])
-                    if not features:
-                        continue
-                    pitch = features["pitch"]
-                    pitch_std = features["pitch_std"]
-                    zcr = features["zcr"]
-                    waveform_data = features["waveform_data"]
-                    with STATE["lock"]:
-                        STATE["pitch_buffer"].append(pitch)
-                        STATE["zcr_buffer"].append(zcr)
-                        avg_pitch = np.mean(STATE["pitch_buffer"])
-                        avg_zcr = np.mean(STATE["zcr_buffer"])
-                        text = STATE["latest_text"]
-                        if time.time() - STATE["last_speech_time"] > SILENCE_TIMEOUT and text:
-                            STATE["latest_text"] = ""
-                            STATE["transcription"] = ""
-                            STATE["last_emotion"] = "Engaged"
-                            STATE["last_speech_time"] = time.time()
-                            log_emotion("Engaged", "", 0, 0, 0)
-                            text = ""
-                    current_emotion = classify_emotion(text, avg_pitch, pitch_std, avg_zcr)
-                    with STATE["lock"]:
-                        if current_emotion != STATE["last_emotion"] and time.time() - STATE["last_change_time"] >= 2:
-                            STATE["last_emotion"] = current_emotion
-                            STATE["last_change_time"] = time.time()
-                            log_emotion(current_emotion, text, avg_pitch, pitch_std, avg_zcr)
-                    result_queue.put({
-                        "emotion": current_emotion,
-                        "pitch": f"{avg_pitch:.1f}",
-                        "zcr": f"{avg_zcr:.3f}",
-                        "waveform": waveform_data
-                    })
+                    result = analyze_audio_window(state, audio_data)
+                    if result is not None:
+                        state["result_queue"].put(result)
             except Exception as e:
+                FRAMES_DROPPED.labels("speech", "error").inc()
                 logger.error(f"Audio processing error: {str(e)}")
                 logger.error(traceback.format_exc())
                 time.sleep(0.1)
     finally:
         try:
-            if STATE["stream"]:
-                STATE["stream"].stop_stream()
-                STATE["stream"].close()
-                STATE["stream"] = None
-            if STATE["pyaudio_instance"]:
-                STATE["pyaudio_instance"].terminate()
-                STATE["pyaudio_instance"] = None
+            if state["stream"]:
+                state["stream"].close()
+                state["stream"] = None
             logger.info("Audio stream closed")
         except Exception as e:
             logger.error(f"Error closing audio stream: {str(e)}")
             logger.error(traceback.format_exc())
 
-def start_speech_emotion_detection():
+def start_speech_emotion_detection(state=STATE):
     try:
-        with STATE["lock"]:
-            if STATE["running"]:
+        with state["lock"]:
+            if state["running"]:
                 logger.warning("Speech detection already running")
                 return
-            STATE["running"] = True
-            STATE["last_emotion"] = "Engaged"
-            STATE["latest_text"] = ""
-            STATE["transcription"] = ""
-            STATE["last_change_time"] = time.time()
-            STATE["last_speech_time"] = time.time()
+            state["running"] = True
+            state["last_emotion"] = "Engaged"
+            state["latest_text"] = ""
+            state["transcription"] = ""
+            state["last_change_time"] = state["clock"].time()
+            state["last_speech_time"] = state["clock"].time()
         for attempt in range(3):
             try:
-                with STATE["lock"]:
-                    STATE["pyaudio_instance"] = pyaudio.PyAudio()
-                    STATE["stream"] = STATE["pyaudio_instance"].open(
-                        format=FORMAT, channels=CHANNELS, rate=RATE, input=True,
-                        frames_per_buffer=CHUNK, input_device_index=None)
-                    STATE["stream"].start_stream()
-                logger.info("Audio stream started")
+                with state["lock"]:
+                    stream = audio_source_from_spec(state["source"], RATE, CHUNK)
+                    stream.open()
+                    state["stream"] = stream
+                logger.info(f"Audio stream started from {state['source']}")
                 break
             except Exception as e:
                 logger.error(f"Attempt {attempt+1}/3 to start audio stream failed: {str(e)}")
                 logger.error(traceback.format_exc())
-                if STATE["pyaudio_instance"]:
-                    try:
-                        STATE["pyaudio_instance"].terminate()
-                        STATE["pyaudio_instance"] = None
-                    except:
-                        pass
                 time.sleep(1)
                 if attempt == 2:
-                    with STATE["lock"]:
-                        STATE["running"] = False
+                    with state["lock"]:
+                        state["running"] = False
                     raise Exception("Failed to start audio stream")
-        threading.Thread(target=process_audio, daemon=True).start()
-        threading.Thread(target=process_speech_recognition, daemon=True).start()
+        threading.Thread(target=process_audio, args=(state,), daemon=True).start()
+        threading.Thread(target=process_speech_recognition, args=(state,), daemon=True).start()
     except Exception as e:
         logger.error(f"Error starting speech processing: {str(e)}")
         logger.error(traceback.format_exc())
-        with STATE["lock"]:
-            STATE["running"] = False
+        with state["lock"]:
+            state["running"] = False
         try:
-            if STATE["pyaudio_instance"]:
-                STATE["pyaudio_instance"].terminate()
-                STATE["pyaudio_instance"] = None
+            if state["stream"]:
+                state["stream"].close()
+                state["stream"] = None
         except Exception as e:
-            logger.error(f"Error cleaning up pyaudio: {str(e)}")
+            logger.error(f"Error cleaning up audio source: {str(e)}")
             logger.error(traceback.format_exc())
 
-def stop_speech_emotion_detection():
+def stop_speech_emotion_detection(state=STATE):
     try:
-        with STATE["lock"]:
-            STATE["running"] = False
+        with state["lock"]:
+            state["running"] = False
         time.sleep(0.1)
         try:
-            if STATE["stream"]:
-                STATE["stream"].stop_stream()
-                STATE["stream"].close()
-                STATE["stream"] = None
-            if STATE["pyaudio_instance"]:
-                STATE["pyaudio_instance"].terminate()
-                STATE["pyaudio_instance"] = None
+            if state["stream"]:
+                state["stream"].close()
+                state["stream"] = None
             logger.info("Speech emotion detection stopped")
         except Exception as e:
             logger.error(f"Error stopping speech stream: {str(e)}")
@@ -390,19 +435,19 @@ def stop_speech_emotion_detection():
         logger.error(f"Error stopping speech detection: {str(e)}")
         logger.error(traceback.format_exc())
 
-def get_speech_emotion():
+def get_speech_emotion(state=STATE):
     try:
-        with STATE["lock"]:
-            return STATE["last_emotion"]
+        with state["lock"]:
+            return state["last_emotion"]
     except Exception as e:
         logger.error(f"Error getting speech emotion: {str(e)}")
         logger.error(traceback.format_exc())
         return "Engaged"
 
-def get_speech_transcription():
+def get_speech_transcription(state=STATE):
     try:
-        with STATE["lock"]:
-            return STATE["transcription"]
+        with state["lock"]:
+            return state["transcription"]
     except Exception as e:
         logger.error(f"Error getting transcription: {str(e)}")
         logger.error(traceback.format_exc())
@@ -0,0 +1,76 @@
+"""Day rollups follow local midnight, including on the 23- and 25-hour days of DST changes,
+and loading the rollups never holds up fusion."""
+import threading
+import time
+
+import pytest
+
+from modules.emotion_rollups import EmotionRollups, bucket_end, bucket_start
+from modules.emotion_store import record_timestamp_ms
+
+
+@pytest.fixture
+def new_york(monkeypatch):
+    if not hasattr(time, "tzset"):
+        pytest.skip("time.tzset() is not available on this platform")
+    monkeypatch.setenv("TZ", "America/New_York")
+    time.tzset()
+    yield
+    monkeypatch.undo()
+    time.tzset()
+
+
+def fold(rollups, *times, emotion="Engaged"):
+    """add() each sample on a thread, so a regression fails the test instead of hanging it."""
+    def run():
+        for seq, t in enumerate(times, start=1):
+            rollups.add(seq, {"time": t, "final_emotion": emotion, "value": 0.5})
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    thread.join(5)
+    assert not thread.is_alive(), "add() did not return"
+
+
+def day_seconds(rollups):
+    return {row["start"][:10]: row["seconds"].get("Engaged", 0.0) for row in rollups.query("day")}
+
+
+def test_fall_back_day_is_25_hours(new_york, tmp_path):
+    start = bucket_start("day", int(time.mktime((2025, 11, 2, 12, 0, 0, 0, 0, -1)) * 1000))
+    assert bucket_end("day", start) - start == 25 * 3600 * 1000
+
+    rollups = EmotionRollups(str(tmp_path / "rollups.json"))
+    fold(rollups, "2025-11-02 23:30:00", "2025-11-02 23:30:20")
+    assert day_seconds(rollups) == {"2025-11-02": 20.0}
+
+
+def test_spring_forward_day_is_23_hours(new_york, tmp_path):
+    start = bucket_start("day", int(time.mktime((2025, 3, 9, 12, 0, 0, 0, 0, -1)) * 1000))
+    assert bucket_end("day", start) - start == 23 * 3600 * 1000
+
+    rollups = EmotionRollups(str(tmp_path / "rollups.json"))
+    fold(rollups, "2025-03-09 23:59:30", "2025-03-10 00:00:20")
+    assert day_seconds(rollups) == {"2025-03-09": 30.0, "2025-03-10": 20.0}
+
+
+def test_add_does_not_wait_for_the_history_replay(tmp_path):
+    logged = [(seq, {"time": f"2025-01-01 10:00:{seq:02d}", "final_emotion": "Engaged", "value": 0.5})
+              for seq in range(1, 11)]
+    release = threading.Event()
+
+    def history(start_seq):
+        release.wait(5)  # A long history
+        return [(seq, record_timestamp_ms(record), record) for seq, record in logged if seq >= start_seq]
+
+    rollups = EmotionRollups(str(tmp_path / "rollups.json"), history=history)
+    rollups.start_loading()
+    started = time.monotonic()
+    # Samples 9 and 10 are logged during the replay: they may be seen by both, and count once
+    for seq, record in logged[8:]:
+        rollups.add(seq, record)
+    assert time.monotonic() - started < 1
+    release.set()
+
+    rows = rollups.query("minute")
+    assert sum(row["count"] for row in rows) == 10
+    assert sum(row["seconds"]["Engaged"] for row in rows) == pytest.approx(9.0)
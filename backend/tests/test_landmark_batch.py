@@ -0,0 +1,114 @@
+"""The landmark batch format must read the same on both sides of POST /api/landmarks.
+
+The browser writes batches with src/api/landmarkBatch.js and the server reads them with
+modules/landmark_batch.py; these tests pin the byte layout so the two cannot drift apart.
+"""
+import base64
+import json
+import os
+import shutil
+import struct
+import subprocess
+
+import numpy as np
+import pytest
+
+from modules.landmark_batch import (COORDINATE_SCALE, HEADER, MAX_BATCH_BYTES, MAX_BATCH_FRAMES, MAX_LANDMARKS,
+                                    encode_landmark_batch, parse_landmark_batch)
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+JS_ENCODER = os.path.join(REPO_ROOT, "src", "api", "landmarkBatch.js")
+LANDMARKS = 468
+
+
+def sample_face(seed):
+    return np.random.default_rng(seed).uniform(0.0, 1.0, (LANDMARKS, 3)).astype(np.float32)
+
+
+def quantized(points):
+    return np.round(np.clip(points[:, :2], 0.0, 1.0) * COORDINATE_SCALE) / COORDINATE_SCALE
+
+
+def js_layout_batch(frames, width, height, base_time):
+    """A batch laid out byte by byte at the offsets landmarkBatch.js writes (22-byte header)."""
+    header = bytearray(22)
+    header[0:4] = b"EMLB"
+    header[4] = 1  # Version
+    header[5] = 0  # Flags
+    struct.pack_into("<H", header, 6, LANDMARKS)
+    struct.pack_into("<H", header, 8, len(frames))
+    struct.pack_into("<H", header, 10, width)
+    struct.pack_into("<H", header, 12, height)
+    struct.pack_into("<d", header, 14, base_time)
+    body = bytearray()
+    for offset_ms, points in frames:
+        body += struct.pack("<IB", offset_ms, 0 if points is None else 1)
+        if points is not None:
+            xy = np.round(np.clip(points[:, :2], 0.0, 1.0) * COORDINATE_SCALE).astype("<u2")
+            body += xy.tobytes()
+    return bytes(header + body)
+
+
+def test_header_matches_browser_layout():
+    assert HEADER.size == 22
+
+
+def test_largest_batch_fits_the_body_limit():
+    face = np.random.default_rng(5).uniform(0.0, 1.0, (MAX_LANDMARKS, 3)).astype(np.float32)
+    data = encode_landmark_batch([(1_700_000_000.0 + i / 10, [face]) for i in range(MAX_BATCH_FRAMES)], 640, 480)
+    assert len(data) == MAX_BATCH_BYTES
+    assert len(parse_landmark_batch(data)["frames"]) == MAX_BATCH_FRAMES
+
+    too_many = np.zeros((MAX_LANDMARKS + 1, 3), np.float32)
+    with pytest.raises(ValueError):
+        parse_landmark_batch(encode_landmark_batch([(0.0, [too_many])], 640, 480))
+
+
+def test_round_trip():
+    base = 1_700_000_000.25
+    faces = [sample_face(1), sample_face(2)]
+    frames = [(base, [faces[0]]), (base + 0.1, []), (base + 0.25, [faces[1]])]
+    batch = parse_landmark_batch(encode_landmark_batch(frames, 640, 480))
+
+    assert (batch["width"], batch["height"]) == (640, 480)
+    assert [timestamp for timestamp, _ in batch["frames"]] == pytest.approx([base, base + 0.1, base + 0.25], abs=1e-6)
+    assert batch["frames"][1][1] == []
+    for (_, parsed), face in zip((batch["frames"][0], batch["frames"][2]), faces):
+        assert parsed[0].shape == (LANDMARKS, 3)
+        np.testing.assert_allclose(parsed[0][:, :2], quantized(face), atol=1e-6)
+        assert not parsed[0][:, 2].any()
+
+
+def test_parses_browser_layout():
+    base = 1_700_000_000.5
+    face = sample_face(3)
+    data = js_layout_batch([(0, face), (40, None), (120, face)], 1280, 720, base)
+    batch = parse_landmark_batch(data)
+
+    assert (batch["width"], batch["height"]) == (1280, 720)
+    assert [timestamp for timestamp, _ in batch["frames"]] == pytest.approx([base, base + 0.04, base + 0.12], abs=1e-6)
+    assert [len(faces) for _, faces in batch["frames"]] == [1, 0, 1]
+    np.testing.assert_allclose(batch["frames"][2][1][0][:, :2], quantized(face), atol=1e-6)
+    # The server's own encoder writes the same bytes
+    assert encode_landmark_batch(batch["frames"], 1280, 720, base_time=base) == data
+
+
+@pytest.mark.skipif(shutil.which("node") is None, reason="node is not installed")
+def test_parses_js_encoder_output():
+    face = sample_face(4)
+    frames = [
+        {"time": 1_700_000_000_000, "landmarks": [{"x": float(x), "y": float(y)} for x, y, _ in face]},
+        {"time": 1_700_000_000_066, "landmarks": None},
+    ]
+    script = (
+        f"import {{ encodeLandmarkBatch }} from {json.dumps('file://' + JS_ENCODER)};\n"
+        f"const buffer = encodeLandmarkBatch({json.dumps(frames)}, 640, 480);\n"
+        "process.stdout.write(Buffer.from(buffer).toString('base64'));\n"
+    )
+    encoded = subprocess.run(["node", "--input-type=module", "-e", script], capture_output=True, text=True,
+                             check=True, timeout=30).stdout
+    batch = parse_landmark_batch(base64.b64decode(encoded))
+
+    assert [timestamp for timestamp, _ in batch["frames"]] == pytest.approx([1_700_000_000.0, 1_700_000_000.066], abs=1e-6)
+    np.testing.assert_allclose(batch["frames"][0][1][0][:, :2], quantized(face), atol=1e-6)
+    assert batch["frames"][1][1] == []
@@ -0,0 +1,71 @@
+"""Per-thread metric shards are retired with their thread, and metrics can be merged across processes."""
+import threading
+
+from modules.metrics import Counter, Histogram, MetricsRegistry, snapshot_delta
+
+
+def run_threads(fn, count):
+    for _ in range(count):
+        thread = threading.Thread(target=fn)
+        thread.start()
+        thread.join()
+
+
+def test_ended_threads_leave_no_shards():
+    counter = Counter()
+    histogram = Histogram(buckets=(1.0,))
+    counter.inc()  # This thread stays alive
+
+    def record():
+        counter.inc(2)
+        histogram.observe(0.5)
+
+    run_threads(record, 200)
+    assert len(counter.values.shards) == 1
+    assert len(histogram.values.shards) == 0
+    assert counter.values.total() == [401]
+    assert histogram.values.total() == [200, 0, 100.0, 200]
+
+
+def test_live_threads_keep_counting():
+    counter = Counter()
+    started, finish = threading.Barrier(5), threading.Event()
+
+    def record():
+        counter.inc()
+        started.wait()
+        finish.wait()
+        counter.inc()
+
+    threads = [threading.Thread(target=record) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    started.wait()
+    assert len(counter.values.shards) == 4 and counter.values.total() == [4]
+    finish.set()
+    for thread in threads:
+        thread.join()
+    assert counter.values.total() == [8]
+
+
+def test_snapshot_deltas_merge_into_another_registry():
+    worker, parent = MetricsRegistry(), MetricsRegistry()
+    for registry in (worker, parent):
+        registry.counter("frames_total", "Frames", labels=("detector",))
+        registry.histogram("stage_seconds", "Stages", labels=("stage",), buckets=(1.0,))
+    worker.counter("worker_only_total", "Not known to the parent")
+
+    sent = {}
+    for frames in (3, 2):
+        worker.families["frames_total"].labels("facial").inc(frames)
+        worker.families["stage_seconds"].labels("face_mesh").observe(0.5)
+        worker.families["worker_only_total"].inc()
+        current = worker.snapshot()
+        parent.merge(snapshot_delta(current, sent))
+        sent = current
+    assert snapshot_delta(worker.snapshot(), sent) == {}
+
+    assert parent.snapshot() == {
+        "frames_total": {("facial",): [5]},
+        "stage_seconds": {("face_mesh",): [2, 0, 1.0, 2]},
+    }
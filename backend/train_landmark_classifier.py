@@ -0,0 +1,173 @@
+"""Record DeepFace labels for landmark geometry and fit the landmark classifier on them.
+
+The landmark classifier (modules/landmark_classifier.py) imitates DeepFace from FaceMesh landmarks
+alone. Training happens in two steps, so the slow DeepFace pass runs once per recording:
+
+    python train_landmark_classifier.py record --video session.mp4 --output session_labels.npz
+    python train_landmark_classifier.py record --images faces/ --output faces_labels.npz
+    python train_landmark_classifier.py fit session_labels.npz faces_labels.npz --output landmark_classifier.npz
+
+"record" runs FaceMesh and DeepFace (on the aligned face crop, as the facial loop does) and
+stores the classifier inputs with DeepFace's seven emotion probabilities. "fit" needs only
+numpy: it fits the classifier, reports how often it agrees with DeepFace on held-out samples
+and writes the model file read through LANDMARK_MODEL_PATH.
+"""
+import argparse
+import glob
+import os
+import time
+
+import numpy as np
+
+from modules.landmark_classifier import DEEPFACE_LABELS, fit, landmark_inputs
+
+IMAGE_PATTERNS = ("*.jpg", "*.jpeg", "*.png")
+FRUSTRATION_LABELS = ("angry", "disgust")  # What deepface_emotion() turns into Frustrated
+
+
+# --- Recording ---
+
+def video_frames(path, every):
+    import cv2
+
+    cap = cv2.VideoCapture(path)
+    if not cap.isOpened():
+        raise SystemExit(f"Cannot open video {path}")
+    index = 0
+    try:
+        while True:
+            ret, frame = cap.read()
+            if not ret:
+                return
+            if index % every == 0:
+                yield frame
+            index += 1
+    finally:
+        cap.release()
+
+
+def image_frames(directory):
+    import cv2
+
+    paths = sorted(p for pattern in IMAGE_PATTERNS for p in glob.glob(os.path.join(directory, pattern)))
+    if not paths:
+        raise SystemExit(f"No images in {directory}")
+    for path in paths:
+        frame = cv2.imread(path)
+        if frame is not None:
+            yield frame
+
+
+def record(args):
+    import cv2
+    from modules import facial_emotion
+
+    # Stills are unrelated images: FaceMesh must not track from one to the next
+    face_mesh = facial_emotion.mp_face_mesh.FaceMesh(static_image_mode=bool(args.images), max_num_faces=1,
+                                                     min_detection_confidence=0.7)
+    frames = image_frames(args.images) if args.images else video_frames(args.video, args.every)
+    inputs, targets = [], []
+    seen = skipped = 0
+    start = time.perf_counter()
+    try:
+        for frame in frames:
+            seen += 1
+            results = face_mesh.process(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
+            if not results.multi_face_landmarks:
+                skipped += 1
+                continue
+            h, w = frame.shape[:2]
+            points = facial_emotion.landmarks_to_array(results.multi_face_landmarks[0])
+            x = landmark_inputs(points, w, h)
+            face = facial_emotion.face_roi(frame, points, w, h)
+            analysis = facial_emotion.run_deepface(face, "skip") if face is not None else None
+            if x is None or analysis is None or isinstance(analysis, Exception):
+                skipped += 1
+                continue
+            emotion = analysis[0]["emotion"]
+            inputs.append(x)
+            targets.append([float(emotion.get(label, 0.0)) / 100.0 for label in DEEPFACE_LABELS])
+            if len(inputs) % 100 == 0:
+                print(f"{len(inputs)} samples ({seen} frames, {time.perf_counter() - start:.0f} s)")
+    finally:
+        face_mesh.close()
+    if not inputs:
+        raise SystemExit("No usable faces found")
+    np.savez_compressed(args.output, inputs=np.array(inputs, dtype=np.float32),
+                        targets=np.array(targets, dtype=np.float32), labels=np.array(DEEPFACE_LABELS))
+    print(f"Recorded {len(inputs)} samples from {seen} frames ({skipped} without a usable face) to {args.output}")
+
+
+# --- Fitting ---
+
+def load_recordings(paths):
+    inputs, targets = [], []
+    for path in paths:
+        with np.load(path) as data:
+            if tuple(str(l) for l in data["labels"]) != DEEPFACE_LABELS:
+                raise SystemExit(f"{path} has different emotion labels")
+            inputs.append(data["inputs"])
+            targets.append(data["targets"])
+    return np.concatenate(inputs), np.concatenate(targets)
+
+
+def agreement(model, inputs, targets):
+    """Share of samples where the classifier's dominant label, and its frustration call, match DeepFace's."""
+    predicted = model.predict_proba(inputs).argmax(axis=1)
+    expected = targets.argmax(axis=1)
+    frustration = [DEEPFACE_LABELS.index(label) for label in FRUSTRATION_LABELS]
+    return {
+        "dominant": float(np.mean(predicted == expected)),
+        "frustration": float(np.mean(np.isin(predicted, frustration) == np.isin(expected, frustration))),
+    }
+
+
+def fit_model(args):
+    inputs, targets = load_recordings(args.recordings)
+    order = np.random.default_rng(args.seed).permutation(len(inputs))
+    holdout = int(len(inputs) * args.holdout)
+    test, train = order[:holdout], order[holdout:]
+    if len(train) == 0:
+        raise SystemExit("No samples left to fit on")
+    model = fit(inputs[train], targets[train], l2=args.l2, learning_rate=args.learning_rate, epochs=args.epochs)
+
+    counts = np.bincount(targets.argmax(axis=1), minlength=len(DEEPFACE_LABELS))
+    print("DeepFace dominant labels: " + ", ".join(f"{l} {c}" for l, c in zip(DEEPFACE_LABELS, counts)))
+    print(f"Train agreement: {agreement(model, inputs[train], targets[train])}")
+    if holdout:
+        print(f"Held-out agreement ({holdout} samples): {agreement(model, inputs[test], targets[test])}")
+        # The shipped model uses every sample
+        model = fit(inputs, targets, l2=args.l2, learning_rate=args.learning_rate, epochs=args.epochs)
+    model.save(args.output)
+    print(f"Model written to {args.output}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Train the landmark emotion classifier from DeepFace labels.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    rec = commands.add_parser("record", help="Label faces from a video or an image folder with DeepFace")
+    source = rec.add_mutually_exclusive_group(required=True)
+    source.add_argument("--video", help="Video file to label")
+    source.add_argument("--images", help="Folder of .jpg/.png face images to label")
+    rec.add_argument("--every", type=int, default=5, help="Label every Nth video frame")
+    rec.add_argument("--output", required=True, help="Where to write the recording (.npz)")
+
+    fitter = commands.add_parser("fit", help="Fit the classifier on one or more recordings")
+    fitter.add_argument("recordings", nargs="+", help="Recordings written by the record command")
+    fitter.add_argument("--output", default="landmark_classifier.npz", help="Where to write the model")
+    fitter.add_argument("--holdout", type=float, default=0.2, help="Share of samples held out to report agreement")
+    fitter.add_argument("--l2", type=float, default=1e-3, help="L2 regularization strength")
+    fitter.add_argument("--learning-rate", type=float, default=0.5)
+    fitter.add_argument("--epochs", type=int, default=500)
+    fitter.add_argument("--seed", type=int, default=0, help="Seed of the train/holdout split")
+    args = parser.parse_args()
+
+    if args.command == "record":
+        record(args)
+    else:
+        fit_model(args)
+
+
+if __name__ == "__main__":
+    main()
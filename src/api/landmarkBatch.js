@@ -0,0 +1,60 @@
+// landmarkBatch.js
+// Packs FaceMesh landmarks computed in the browser into the binary batches accepted by
+// POST /api/landmarks (backend/modules/landmark_batch.py), so the backend never needs the camera.
+const MAGIC = [0x45, 0x4d, 0x4c, 0x42]; // "EMLB"
+const VERSION = 1;
+const HEADER_BYTES = 22; // Packed, no padding: the f64 base time sits at offset 14
+const FRAME_HEADER_BYTES = 5;
+
+// frames: [{ time: epoch ms, landmarks: [{x, y}, ...] | null }], width/height: video size in pixels
+export function encodeLandmarkBatch(frames, width, height) {
+  const withFace = frames.find((frame) => frame.landmarks);
+  const count = withFace ? withFace.landmarks.length : 468;
+  let size = HEADER_BYTES;
+  for (const frame of frames) {
+    size += FRAME_HEADER_BYTES + (frame.landmarks ? count * 4 : 0);
+  }
+
+  const buffer = new ArrayBuffer(size);
+  const view = new DataView(buffer);
+  const baseTime = frames.length ? frames[0].time : Date.now();
+  MAGIC.forEach((byte, i) => view.setUint8(i, byte));
+  view.setUint8(4, VERSION);
+  view.setUint8(5, 0);
+  view.setUint16(6, count, true);
+  view.setUint16(8, frames.length, true);
+  view.setUint16(10, width, true);
+  view.setUint16(12, height, true);
+  view.setFloat64(14, baseTime / 1000, true);
+
+  let offset = HEADER_BYTES;
+  for (const frame of frames) {
+    view.setUint32(offset, Math.max(0, Math.round(frame.time - baseTime)), true);
+    view.setUint8(offset + 4, frame.landmarks ? 1 : 0);
+    offset += FRAME_HEADER_BYTES;
+    if (frame.landmarks) {
+      for (const point of frame.landmarks) {
+        view.setUint16(offset, quantize(point.x), true);
+        view.setUint16(offset + 2, quantize(point.y), true);
+        offset += 4;
+      }
+    }
+  }
+  return buffer;
+}
+
+function quantize(value) {
+  return Math.round(Math.min(1, Math.max(0, value)) * 65535);
+}
+
+export async function postLandmarkBatch(frames, width, height, sessionId = 'default') {
+  const response = await fetch(`http://localhost:8000/api/landmarks?session_id=${encodeURIComponent(sessionId)}`, {
+    method: 'POST',
+    headers: { 'Content-Type': 'application/octet-stream' },
+    body: encodeLandmarkBatch(frames, width, height),
+  });
+  if (!response.ok) {
+    throw new Error(`Landmark upload failed: ${response.status}`);
+  }
+  return response.json(); // { frames, emotion }
+}
@@ -48,6 +48,7 @@ export const ControlPanel = ({
   const [dndTimer, setDndTimer] = useState<number | null>(null);
   const [showDndDialog, setShowDndDialog] = useState(false);
   const [dndMinutes, setDndMinutes] = useState(30);
+  const streamedEmotionRef = useRef<string | null>(null);
 
   // Function to notify backend about sensor state changes
   const notifyBackendSensorChange = async (sensorType: 'camera' | 'microphone', enabled: boolean) => {
@@ -248,26 +249,50 @@ export const ControlPanel = ({
     }
   };
 
-  // Poll emotion from backend based on current state
+  // Subscribe to the backend emotion stream (falls back to polling without EventSource)
   useEffect(() => {
-    // Only poll if at least one sensor is enabled
+    // Only listen if at least one sensor is enabled
     if (!isCameraOn && !isMicOn) {
-      console.log("No sensors enabled, skipping emotion polling");
+      console.log("No sensors enabled, skipping emotion stream");
       return;
     }
 
-    const fetchEmotion = async () => {
-      await getEmotionBasedOnState();
-    };
+    if (typeof EventSource === "undefined") {
+      const fetchEmotion = async () => {
+        await getEmotionBasedOnState();
+      };
 
-    // Initial fetch
-    fetchEmotion();
-    
-    // Set up polling interval
-    const interval = setInterval(fetchEmotion, 2000); // Poll every 2 seconds for more responsive updates
+      fetchEmotion();
+      const interval = setInterval(fetchEmotion, 2000);
+      return () => clearInterval(interval);
+    }
+
+    // Pick the same field the per-modality endpoints would have returned
+    const field = isCameraOn && !isMicOn
+      ? "facial_emotion"
+      : !isCameraOn && isMicOn
+        ? "voice_emotion"
+        : "final_emotion";
+
+    // The browser reconnects on its own and resumes via Last-Event-ID
+    const source = new EventSource("http://localhost:8000/api/emotion/stream");
+    source.addEventListener("emotion", (event) => {
+      const data = JSON.parse((event as MessageEvent).data);
+      const detectedEmotion = data[field] || "Unknown";
+      if (detectedEmotion !== streamedEmotionRef.current) {
+        streamedEmotionRef.current = detectedEmotion;
+        setEmotion(detectedEmotion);
+        setLastEmotion(detectedEmotion);
+        onEmotionChange(detectedEmotion); // Pass to parent component
+        console.log(`Emotion changed: ${detectedEmotion} (${field})`);
+      }
+    });
+    source.onerror = () => {
+      console.error("Emotion stream interrupted, reconnecting...");
+    };
 
-    return () => clearInterval(interval);
-  }, [isCameraOn, isMicOn]); // Re-run when camera or mic state changes
+    return () => source.close();
+  }, [isCameraOn, isMicOn]); // Re-subscribe when camera or mic state changes
 
   // Function to check backend status
   const checkBackendStatus = async () => {
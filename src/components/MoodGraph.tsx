@@ -56,12 +56,10 @@ export const MoodGraph = ({ data }: MoodGraphProps) => {
       if (response.ok) {
         const latestData = await response.json();
         
-        // Get all emotion data from the JSON file
-        const allDataResponse = await fetch('http://localhost:8000/api/emotion/all');
+        // Get only the last 10 entries of the history
+        const allDataResponse = await fetch('http://localhost:8000/api/emotion/all?tail=true&limit=10');
         if (allDataResponse.ok) {
-          const allData = await allDataResponse.json();
-          // Get last 10 entries
-          const last10Entries = allData.slice(-10);
+          const last10Entries = await allDataResponse.json();
           setEmotionData(last10Entries);
         } else {
           // Fallback: create sample data from latest entry
@@ -77,11 +75,27 @@ export const MoodGraph = ({ data }: MoodGraphProps) => {
     }
   };
 
-  // Fetch data on component mount and every 10 seconds
+  // Fetch history once on mount, then append live changes from the emotion stream
   useEffect(() => {
     fetchEmotionData();
-    const interval = setInterval(fetchEmotionData, 10000);
-    return () => clearInterval(interval);
+    if (typeof EventSource === 'undefined') {
+      const interval = setInterval(fetchEmotionData, 10000);
+      return () => clearInterval(interval);
+    }
+
+    const source = new EventSource('http://localhost:8000/api/emotion/stream');
+    source.addEventListener('emotion', (event) => {
+      const entry: EmotionData = JSON.parse((event as MessageEvent).data);
+      setEmotionData((previous) => {
+        const last = previous[previous.length - 1];
+        if (last && last.time === entry.time && last.final_emotion === entry.final_emotion) {
+          return previous;
+        }
+        return [...previous, entry].slice(-10);
+      });
+      setLoading(false);
+    });
+    return () => source.close();
   }, []);
 
   // Transform data for chart display